@@ -0,0 +1,149 @@
+"""
+This module provides an asyncio interface to the execution engine.
+
+The blocking database calls run in a bounded thread pool, so many queries
+can be awaited concurrently from a single event loop while at most
+`SCHEDULER.dsn_limit` queries run on the query database at the same time.
+This limit is shared with `scheduler.run_scheduled` (see
+`scheduler.get_dsn_slots`). Connections are borrowed from the shared
+connection pool.
+
+Usage
+=====
+result = await run_query_async(qd)
+
+async for result in run_set_async(qds):
+    ...
+"""
+
+# standard library
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# local
+from query.cancellation import Cancellation
+from query.config import SCHEDULER
+from query.execution import run_query
+from query.scheduler import bind, get_graph, get_order, limited, skipped
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    "Return the bounded thread pool used for running queries."
+
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=SCHEDULER.dsn_limit,
+                thread_name_prefix='query',
+            )
+    return _executor
+
+
+async def run_query_async(qd, cancel=None, **kwargs):
+    """
+    Run query and return results without blocking the event loop.
+    If the awaiting task is cancelled, the running query is cancelled too.
+
+    Parameters
+    ==========
+    :param qd: `QueryDef`
+        Instance of `QueryDef` containing the query definition.
+
+    Optional key-word arguments
+    ===========================
+    :param cancel: `Cancellation`, default `None`
+        Token with which the query can be cancelled.
+    Other key-word arguments are passed to `run_query`.
+
+    Return
+    ======
+    :QueryResult:
+    """
+
+    if cancel is None:
+        cancel = Cancellation()
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(
+        get_executor(),
+        functools.partial(limited(run_query), qd, cancel=cancel, **kwargs),
+    )
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancel.cancel()
+        raise
+
+
+async def run_set_async(qds, history=None, **kwargs):
+    """
+    Run a set of queries concurrently.
+    Queries are started in the order returned by `scheduler.schedule`;
+    queries that depend on other queries are started as soon as these have
+    completed (see `scheduler.run_scheduled`).
+    Yield the results as they are completed.
+
+    Parameters
+    ==========
+    :param qds: `list`
+        List of `QueryDef` instances.
+
+    Optional key-word arguments
+    ===========================
+    :param history: `dict`, default `None`
+        Runtimes of earlier runs per filename (see `scheduler`).
+    Other key-word arguments are passed to `run_query`.
+    """
+
+    upstream = get_graph(qds)
+    results = asyncio.Queue()
+    nodes = dict()
+
+    async def run_copy(qd):
+        result = await run_query_async(qd, **kwargs)
+        await results.put(result)
+        return result
+
+    async def run_node(idx):
+        "Run query `idx` when its upstream queries have completed."
+
+        qd = qds[idx]
+        copies = [qd]
+        if upstream[idx]:
+            inputs, names = list(), list()
+            for up in upstream[idx]:
+                inputs.extend(await nodes[up])
+                names.append(qds[up].name)
+            try:
+                copies = bind(qd, inputs, names)
+            except ValueError as e:
+                result = skipped(qd, e)
+                await results.put(result)
+                return [result]
+        return await asyncio.gather(*[run_copy(copy) for copy in copies])
+
+    async def run_all():
+        try:
+            await asyncio.gather(*nodes.values())
+        finally:
+            await results.put(None)
+
+    for idx in get_order(qds, history, upstream):
+        nodes[idx] = asyncio.ensure_future(run_node(idx))
+    main = asyncio.ensure_future(run_all())
+    try:
+        while True:
+            result = await results.get()
+            if result is None:
+                break
+            yield result
+        await main
+    finally:
+        for task in [main, *nodes.values()]:
+            task.cancel()
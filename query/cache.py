@@ -0,0 +1,275 @@
+# standard library
+import datetime
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# local
+from query.config import CACHE, to_path
+
+
+# seconds after which a lock file is considered left behind by a crash
+LOCK_STALE = 60
+LOCK_TIMEOUT = 30
+
+
+class ResultCache:
+    """
+    ResultCache
+    ===========
+    Local cache of query results.
+
+    Results are stored under a key derived from the primed sql statement and
+    the column specification (names and dtypes) of the query definition.
+    A cached result is served as long as it is younger than the time-to-live
+    of the query definition (`QueryDef.cache_ttl`) or, if the definition does
+    not set one, the default ttl from the config. When the cache grows beyond
+    its maximum size the least recently used results are evicted.
+
+    The index of the cache is only changed while holding a lock file, so
+    the cache can be shared by threads and processes (e.g. worker processes
+    in offload mode).
+
+    Attributes
+    ==========
+    path: Path
+        Folder in which the cached results are stored.
+    ttl: int
+        Default time-to-live in seconds (0: do not cache).
+    max_size: int
+        Maximum size of the cache in MB.
+
+    Methods
+    =======
+    - get
+    - put
+    - evict
+    - clear
+    """
+
+    def __init__(self, path=None, ttl=None, max_size=None):
+        self.path     = to_path(CACHE.path) if path is None else Path(path)
+        self.ttl      = CACHE.ttl if ttl is None else ttl
+        self.max_size = CACHE.max_size if max_size is None else max_size
+        self._lock    = threading.Lock()
+
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}, '{self.path}'>"
+
+
+    @staticmethod
+    def key(qd):
+        "Return cache key for the (primed) query definition `qd`."
+
+        columns = qd.columns if isinstance(qd.columns, dict) else {
+            col: None for col in qd.columns or []
+        }
+        spec = json.dumps(
+            [qd.sql, list(columns.items())],
+            default=str,
+        )
+        return hashlib.sha256(spec.encode('utf-8')).hexdigest()
+
+
+    def get_ttl(self, qd):
+        "Return time-to-live in seconds for query definition `qd`."
+
+        ttl = getattr(qd, 'cache_ttl', None)
+        return self.ttl if ttl is None else ttl
+
+
+    def get(self, qd):
+        """
+        Return cached QueryResult for `qd` or None if there is no valid
+        result in the cache.
+        """
+
+        ttl = self.get_ttl(qd)
+        if not ttl:
+            return None
+
+        key = self.key(qd)
+        with self._locked():
+            index = self._read_index()
+            entry = index.get(key)
+            if entry is None:
+                return None
+
+            path = self.path / entry['file']
+            age = datetime.datetime.now().timestamp() - entry['created']
+            if age > ttl or not path.exists():
+                self._remove(index, key)
+                self._write_index(index)
+                return None
+
+            entry['accessed'] = datetime.datetime.now().timestamp()
+            self._write_index(index)
+
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+    def put(self, result):
+        """
+        Store QueryResult in the cache (if its definition has a ttl).
+        Evict least recently used results if the cache exceeds its maximum
+        size.
+        """
+
+        if not self.get_ttl(result.qd):
+            return None
+
+        key = self.key(result.qd)
+        filename = f'{key}.pkl'
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        tmp = self._tmp_path(filename)
+        with open(tmp, 'wb') as f:
+            pickle.dump(result, f)
+
+        with self._locked():
+            os.replace(tmp, self.path / filename)
+            now = datetime.datetime.now().timestamp()
+            index = self._read_index()
+            index[key] = {
+                'file': filename,
+                'name': result.qd.name,
+                'created': now,
+                'accessed': now,
+                'size': (self.path / filename).stat().st_size,
+            }
+            self._evict(index)
+            self._write_index(index)
+        return None
+
+
+    def evict(self):
+        "Evict least recently used results beyond the maximum size."
+
+        with self._locked():
+            index = self._read_index()
+            self._evict(index)
+            self._write_index(index)
+        return None
+
+
+    def clear(self):
+        "Remove all results from the cache."
+
+        with self._locked():
+            index = self._read_index()
+            for key in list(index):
+                self._remove(index, key)
+            self._write_index(index)
+        return None
+
+
+    def _evict(self, index):
+        max_bytes = self.max_size * 1024 ** 2
+        total = sum(entry['size'] for entry in index.values())
+        by_access = sorted(index, key=lambda k: index[k]['accessed'])
+        for key in by_access:
+            if total <= max_bytes:
+                break
+            total -= index[key]['size']
+            self._remove(index, key)
+        return None
+
+
+    def _remove(self, index, key):
+        entry = index.pop(key)
+        try:
+            (self.path / entry['file']).unlink()
+        except FileNotFoundError:
+            pass
+        return None
+
+
+    @contextmanager
+    def _locked(self):
+        "Hold the lock on the index of the cache (threads and processes)."
+
+        with self._lock, file_lock(self.path / 'index.lock'):
+            yield
+
+
+    def _tmp_path(self, filename):
+        "Return temporary path unique to the current process and thread."
+
+        return self.path / f'{filename}.{os.getpid()}.{threading.get_ident()}'
+
+
+    @property
+    def _index_path(self):
+        return self.path / 'index.json'
+
+
+    def _read_index(self):
+        try:
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return dict()
+
+
+    def _write_index(self, index):
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp = self._tmp_path(self._index_path.name)
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=4)
+        os.replace(tmp, self._index_path)
+        return None
+
+
+@contextmanager
+def file_lock(path, timeout=LOCK_TIMEOUT, stale=LOCK_STALE):
+    """
+    Hold an exclusive lock by creating the file `path`.
+    Lock files older than `stale` seconds are removed.
+    Raise TimeoutError if the lock cannot be acquired within `timeout`
+    seconds.
+    """
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    start = time.monotonic()
+    while True:
+        try:
+            handle = os.open(str(path), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            pass
+        try:
+            if time.time() - path.stat().st_mtime > stale:
+                path.unlink()
+                continue
+        except FileNotFoundError:
+            continue
+        if time.monotonic() - start > timeout:
+            raise TimeoutError(f"Cannot acquire lock '{path}'.")
+        time.sleep(0.01)
+    try:
+        yield
+    finally:
+        os.close(handle)
+        path.unlink()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    "Return the shared result cache (created on first use)."
+
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+    return _cache
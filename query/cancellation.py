@@ -0,0 +1,91 @@
+# standard library
+import threading
+
+
+CANCELLED = 'cancelled'
+TIMEOUT = 'timeout'
+
+
+class QueryInterrupted(Exception):
+    "Raised when a running query is cancelled or exceeds its timeout."
+
+    def __init__(self, status, message=None):
+        self.status = status
+        super().__init__(message or f"Query {status}.")
+
+
+class Cancellation:
+    """
+    Cancellation
+    ============
+    Token for cancelling a running query from another thread.
+
+    The token is attached to the cursor while the query runs. Cancelling
+    the token cancels the statement on the database (`cursor.cancel`) and
+    makes the fetch loop stop at the next batch. A query split into chunks
+    runs on several cursors at once; all attached cursors are cancelled.
+
+    Attributes
+    ==========
+    status: str
+        None while the query is allowed to run; 'cancelled' or 'timeout'
+        once the query has been interrupted.
+    """
+
+    def __init__(self):
+        self.status   = None
+        self._cursors = set()
+        self._lock    = threading.Lock()
+
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}, status={self.status!r}>"
+
+
+    @property
+    def interrupted(self):
+        return self.status is not None
+
+
+    def attach(self, cursor):
+        "Attach a cursor on which the query runs."
+
+        with self._lock:
+            self._cursors.add(cursor)
+        return None
+
+
+    def detach(self, cursor=None):
+        "Detach `cursor` (None: all cursors) once it is finished."
+
+        with self._lock:
+            if cursor is None:
+                self._cursors.clear()
+            else:
+                self._cursors.discard(cursor)
+        return None
+
+
+    def cancel(self, status=CANCELLED):
+        "Interrupt the query (if it has not been interrupted already)."
+
+        with self._lock:
+            if self.status is not None:
+                return None
+            self.status = status
+            cursors = list(self._cursors)
+        for cursor in cursors:
+            try:
+                cursor.cancel()
+            except Exception:
+                # the fetch loop will stop at the next batch
+                pass
+        return None
+
+
+    def check(self):
+        "Raise `QueryInterrupted` if the query has been interrupted."
+
+        if self.status is not None:
+            raise QueryInterrupted(self.status)
+        return None
@@ -0,0 +1,190 @@
+"""
+This module indexes the query sets and query definitions on disk.
+
+Parsed query definitions (including their compiled templates) are pickled
+in a single cache file, so a query set is only parsed again when its files
+change. Entries of definitions that were deleted are dropped from the cache.
+The cache is discarded as a whole when `CATALOG_VERSION` changes.
+"""
+
+# standard library
+import copy
+import hashlib
+import os
+import pickle
+import threading
+from pathlib import Path
+
+# local
+from query.config import PATHS, CACHE, to_path
+from query.definition import QueryDef
+
+
+# bump when the pickled form of QueryDef or Template (query.template) changes
+CATALOG_VERSION = 2
+
+
+class DefinitionCatalog:
+    """
+    DefinitionCatalog
+    =================
+    Index of the query sets and query definitions in PATHS.definitions.
+
+    Parsed query definitions are cached on disk. A definition is only parsed
+    again when its file has changed: the modification time and size are
+    checked first and, if those differ, the content hash decides whether the
+    file needs to be parsed again.
+
+    Attributes
+    ==========
+    path: Path
+        Folder containing the query sets.
+    cache_path: Path
+        File in which the parsed definitions are cached.
+
+    Methods
+    =======
+    - sets
+    - files
+    - definitions
+    - clear
+    """
+
+    def __init__(self, path=None, cache_path=None):
+        self.path       = PATHS.definitions if path is None else Path(path)
+        self.cache_path = (
+            to_path(CACHE.path) / 'catalog.pkl'
+            if cache_path is None else Path(cache_path)
+        )
+        self._lock      = threading.Lock()
+        self._entries   = None
+
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}, '{self.path}'>"
+
+
+    def sets(self):
+        "Return names of the query sets (folders) in the definitions folder."
+
+        return sorted(
+            entry.name for entry in os.scandir(self.path) if entry.is_dir()
+        )
+
+
+    def files(self, queryset):
+        "Return paths to the query definitions (.ini) in `queryset`."
+
+        path = self.path / queryset
+        return sorted(
+            path / entry.name for entry in os.scandir(path)
+            if entry.is_file() and entry.name.endswith('.ini')
+        )
+
+
+    def definitions(self, queryset):
+        """
+        Return query definitions in `queryset`.
+        Only definitions that changed since they were cached are parsed.
+        The returned definitions are copies and can be primed safely.
+
+        Parameters
+        ==========
+        :param queryset: `str`
+            Name of the query set.
+
+        Return
+        ======
+        :definitions: `list`
+            List of `QueryDef` instances.
+        """
+
+        qds = list()
+        with self._lock:
+            entries = self._load()
+            changed = self._prune(entries)
+            for path in self.files(queryset):
+                entry, updated = self._get_entry(entries, path)
+                changed = changed or updated
+                qd = copy.deepcopy(entry['qd'])
+                # definitions cached before templates were stored on them
+                if getattr(qd, '_templates', None) is None:
+                    qd.compile_templates()
+                qds.append(qd)
+            if changed:
+                self._save(entries)
+        return qds
+
+
+    def clear(self):
+        "Remove all cached definitions."
+
+        with self._lock:
+            self._entries = dict()
+            self._save(self._entries)
+        return None
+
+
+    def _get_entry(self, entries, path):
+        key = str(path.resolve())
+        stat = path.stat()
+        entry = entries.get(key)
+        unchanged = (
+            entry is not None
+            and entry['mtime'] == stat.st_mtime_ns
+            and entry['size'] == stat.st_size
+        )
+        if unchanged:
+            return entry, False
+
+        digest = hashlib.sha1(path.read_bytes()).hexdigest()
+        if entry is None or entry['hash'] != digest:
+            entry = {'hash': digest, 'qd': QueryDef.from_ini(path)}
+        entry.update({'mtime': stat.st_mtime_ns, 'size': stat.st_size})
+        entries[key] = entry
+        return entry, True
+
+
+    def _prune(self, entries):
+        deleted = [key for key in entries if not os.path.exists(key)]
+        for key in deleted:
+            del entries[key]
+        return bool(deleted)
+
+
+    def _load(self):
+        if self._entries is not None:
+            return self._entries
+        try:
+            with open(self.cache_path, 'rb') as f:
+                cached = pickle.load(f)
+            if cached.get('version') != CATALOG_VERSION:
+                raise ValueError
+            self._entries = cached['entries']
+        except (FileNotFoundError, EOFError, ValueError, pickle.PickleError):
+            self._entries = dict()
+        return self._entries
+
+
+    def _save(self, entries):
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache_path.with_name(
+            f'{self.cache_path.name}.{os.getpid()}.{threading.get_ident()}')
+        with open(tmp, 'wb') as f:
+            pickle.dump({'version': CATALOG_VERSION, 'entries': entries}, f)
+        os.replace(tmp, self.cache_path)
+        return None
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    "Return the shared definition catalog (created on first use)."
+
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = DefinitionCatalog()
+    return _catalog
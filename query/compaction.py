@@ -0,0 +1,144 @@
+"""
+This module compacts query results in memory.
+
+Columns without a declared dtype are compacted:
+- integers are downcast to the smallest integer type that fits;
+- floats are downcast to float32 if this does not change any value;
+- dates (date/datetime objects or ISO formatted strings) are parsed;
+- strings with few distinct values are converted to categoricals.
+
+A query definition enables compaction with a [compaction] section:
+
+    [compaction]
+    category_threshold: 0.5
+    downcast: true
+    parse_dates: true
+    studentnummer: false
+    opleiding: 0.9
+
+- category_threshold: convert strings to a categorical if the number of
+  distinct values divided by the number of values is at most this ratio.
+- downcast: downcast numeric columns.
+- parse_dates: parse date-like columns.
+- <column>: threshold for a single column, or false to leave it untouched.
+
+Settings that are not given are taken from [COMPACTION] in the config.
+If `enabled` is true in the config, all queries are compacted.
+"""
+
+# standard library
+import datetime
+import re
+
+# third party
+import numpy as np
+import pandas as pd
+
+# local
+from query.config import COMPACTION
+
+
+SETTINGS = ['category_threshold', 'downcast', 'parse_dates']
+ISO_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2})?)?$')
+SAMPLE_SIZE = 100
+
+
+def get_spec(qd, force=False):
+    """
+    Return compaction specification for `qd` or None if the query results
+    should not be compacted. If `force` is True the specification is
+    returned even if compaction is not enabled.
+    """
+
+    section = getattr(qd, 'compaction', None)
+    enabled = COMPACTION.enabled if section is None else True
+    section = dict(section or {})
+    enabled = section.pop('enabled', enabled)
+    if not (enabled or force):
+        return None
+
+    spec = {
+        key: section.pop(key, getattr(COMPACTION, key)) for key in SETTINGS
+    }
+    spec['columns'] = section
+
+    # columns with a declared dtype are left as declared
+    if isinstance(qd.columns, dict):
+        for col, dtype in qd.columns.items():
+            if dtype is not None:
+                spec['columns'][col] = False
+    return spec
+
+
+def compact_frame(df, spec):
+    """
+    Return compacted copy of `df`.
+
+    Parameters
+    ==========
+    :param df: `DataFrame`
+    :param spec: `dict`
+        Compaction specification (see `get_spec`).
+
+    Return
+    ======
+    :compact_frame: `DataFrame`
+    """
+
+    columns = dict()
+    for col in df.columns:
+        threshold = spec['columns'].get(col, spec['category_threshold'])
+        if threshold is False:
+            columns[col] = df[col]
+        else:
+            columns[col] = compact_series(df[col], threshold, spec)
+    return pd.DataFrame(columns, index=df.index)[list(df.columns)]
+
+
+def compact_series(s, threshold, spec):
+    "Return compacted series."
+
+    if spec['downcast'] and pd.api.types.is_integer_dtype(s.dtype):
+        if isinstance(s.dtype, np.dtype):
+            return pd.to_numeric(s, downcast='integer')
+        return s
+
+    if spec['downcast'] and pd.api.types.is_float_dtype(s.dtype):
+        downcast = s.astype(np.float32)
+        if s.equals(downcast.astype(s.dtype)):
+            return downcast
+        return s
+
+    if s.dtype != object:
+        return s
+
+    values = s.dropna()
+    if values.empty:
+        return s
+
+    if spec['parse_dates'] and is_date_like(values):
+        try:
+            return pd.to_datetime(s)
+        except (ValueError, OverflowError):
+            pass
+
+    if not all(isinstance(v, str) for v in values.iloc[:SAMPLE_SIZE]):
+        return s
+    if values.nunique() / len(values) <= threshold:
+        return s.astype('category')
+    return s
+
+
+def is_date_like(values):
+    "Return True if a sample of `values` consists of dates."
+
+    sample = values.iloc[:SAMPLE_SIZE]
+    if all(isinstance(v, (datetime.date, datetime.datetime)) for v in sample):
+        return True
+    return all(isinstance(v, str) and ISO_DATE.match(v) for v in sample)
+
+
+def memory_usage(df):
+    "Return memory usage of `df` in bytes (including object contents)."
+
+    return int(df.memory_usage(index=True, deep=True).sum())
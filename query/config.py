@@ -105,10 +105,106 @@ def get_list(value):
     return lst
 
 
+def to_path(value):
+    "Return path; paths starting with '/' are relative to the library."
+
+    return PATH_LIB / value[1:] if value.startswith('/') else Path(value)
+
+
+def get_settings(ini, section, defaults=None):
+    """
+    Return section from ini as namedtuple.
+    Items missing from the ini are taken from `defaults`.
+    """
+
+    values = dict() if defaults is None else dict(defaults)
+    if ini.has_section(section):
+        for item in ini[section]:
+            values[item] = parse_value(ini[section][item])
+    Section = namedtuple(section, [item for item in values])
+    return Section(**values)
+
+
+# default settings (used when missing from config.ini)
+DEFAULTS = {
+    'EXECUTION': {
+        'fetch_size': 10000,
+        'timeout': 0,
+        'offload': False,
+        'processes': 0,
+        'driver': 'pyodbc',
+        'connection_string': '',
+        'in_list_limit': 500,
+    },
+    'POOL': {
+        'size': 7,
+        'health_check': 'select 1 from dual',
+        'idle_check': 60,
+    },
+    'SCHEDULER': {
+        'dsn_limit': 7,
+        'window': 5,
+    },
+    'COMPACTION': {
+        'enabled': False,
+        'category_threshold': 0.5,
+        'downcast': True,
+        'parse_dates': True,
+    },
+    'RUNLOG': {
+        'path': '',
+        'timeout': 30,
+    },
+    'STORAGE': {
+        'format': 'pickle',
+        'compression': 'snappy',
+    },
+    'TRACING': {
+        'console': True,
+        'jsonl': '',
+        'prometheus': '',
+    },
+    'SNAPSHOTS': {
+        'enabled': False,
+        'path': '',
+        'compression': 'zlib',
+        'chunk_rows': 8192,
+    },
+    'PREFLIGHT': {
+        'enabled': False,
+        'method': 'history',
+        'memory_budget': 1024,
+        'partition_rows': 1000000,
+        'partitions': 4,
+        'sample_rows': 1000,
+    },
+    'SCHEMA': {
+        'path': '',
+        'pattern': 'OST_%',
+    },
+    'CACHE': {
+        'path': '/cache',
+        'ttl': 0,
+        'max_size': 2048,
+    },
+}
+
+
 # easy access to settings and paths
 config = load_ini(CFG_FILE)
 PATHS  = get_section(
     load_ini(CFG_FILE),
     'PATHS',
-    func=lambda x: PATH_LIB / x[1:] if x.startswith('/') else Path(x)
+    func=to_path,
 )
+EXECUTION = get_settings(config, 'EXECUTION', DEFAULTS['EXECUTION'])
+POOL      = get_settings(config, 'POOL', DEFAULTS['POOL'])
+SCHEDULER = get_settings(config, 'SCHEDULER', DEFAULTS['SCHEDULER'])
+COMPACTION = get_settings(config, 'COMPACTION', DEFAULTS['COMPACTION'])
+RUNLOG    = get_settings(config, 'RUNLOG', DEFAULTS['RUNLOG'])
+STORAGE   = get_settings(config, 'STORAGE', DEFAULTS['STORAGE'])
+CACHE     = get_settings(config, 'CACHE', DEFAULTS['CACHE'])
+TRACING   = get_settings(config, 'TRACING', DEFAULTS['TRACING'])
+SCHEMA    = get_settings(config, 'SCHEMA', DEFAULTS['SCHEMA'])
+SNAPSHOTS = get_settings(config, 'SNAPSHOTS', DEFAULTS['SNAPSHOTS'])
+PREFLIGHT = get_settings(config, 'PREFLIGHT', DEFAULTS['PREFLIGHT'])
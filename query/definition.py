@@ -1,9 +1,21 @@
+import copy
+import itertools
+import numbers
 import re
 import textwrap
 from collections import namedtuple
 from configparser import ConfigParser
 from pathlib import Path
-from query.config import PATHS, load_ini, config_from_ini
+from query.config import EXECUTION, PATHS, load_ini, config_from_ini
+from query.template import compile_template
+
+
+TEMPLATE_FIELDS = ['name', 'filename', 'description', 'sql']
+# fields that cannot be changed on a primed definition (see `replace`)
+FROZEN_FIELDS = TEMPLATE_FIELDS + ['parameters', 'chunks', 'depends']
+LIST_TYPE = re.compile(r'^list\[(?P<item>\w+)\]$')
+# list parameter in a NOT IN-clause (cannot be split into chunks)
+NOT_IN = r'(?i)\bnot\s+in\s*\(\s*\[{}\]\s*\)'
 
 
 class QueryDef:
@@ -20,6 +32,12 @@ class QueryDef:
     Call the instance and pass it the parameters as a dictionary.
     This will prime the query defintion by setting any parameters within the query definition.
 
+    Use `prime` or `expand` to get primed copies instead; the instance itself
+    is left untouched, so it can be primed for many parameter values without
+    loading the definition again. Primed copies are immutable: the sql
+    statement, parameters and other primed fields cannot be changed (use
+    `replace` to get a changed copy).
+
     Attributes
     ==========
     name: str
@@ -40,6 +58,41 @@ class QueryDef:
         Dictionary storing the parameters used in the query definition.
         - keys: parameter name;
         - values: parameter type.
+        List-typed parameters (e.g. 'list[int]') take a list of values that
+        is rendered as the contents of an IN-clause.
+    chunks: list
+        SQL statements to run instead of `sql` when a list-typed parameter
+        holds more values than the database accepts in an IN-clause (see
+        `in_list_limit` in the config). The results of the chunks are
+        concatenated. None if the query is not split.
+    cache_ttl: int
+        Number of seconds the results of this query may be served from the
+        result cache (None: use the default from the config).
+    timeout: int
+        Maximum number of seconds the query may run
+        (None: use the default from the config).
+    priority: int
+        Queries with a higher priority are started first when running a set
+        (default 0).
+    incremental: dict
+        Specification for incremental refreshes (see `query.incremental`).
+        - column: column holding the watermark;
+        - key: column(s) identifying a record (optional).
+    compaction: dict
+        Settings for compacting the query results in memory
+        (see `query.compaction`).
+    snapshot: bool
+        If True a snapshot of the results is stored with every run
+        (None: use the default from the config; see `query.snapshots`).
+    depends: dict
+        Parameters bound to the results of other queries in the set.
+        - keys: parameter name;
+        - values: reference to the upstream column ('<query name>.<column>').
+        The parameters are set when the upstream queries have completed
+        (see `bind`).
+    preflight: dict
+        Settings for estimating the size of the results before fetching
+        them and picking a fetch strategy (see `query.preflight`).
     """
 
     def __init__(
@@ -51,6 +104,15 @@ class QueryDef:
         qtype=None,
         description=None,
         parameters=None,
+        cache_ttl=None,
+        incremental=None,
+        priority=0,
+        compaction=None,
+        timeout=None,
+        chunks=None,
+        depends=None,
+        snapshot=None,
+        preflight=None,
     ):
         self.name        = name
         self.filename    = filename
@@ -59,6 +121,24 @@ class QueryDef:
         self.parameters  = parameters
         self.columns     = columns
         self.sql         = sql
+        self.cache_ttl   = cache_ttl
+        self.incremental = incremental
+        self.priority    = priority
+        self.compaction  = compaction
+        self.timeout     = timeout
+        self.chunks      = chunks
+        self.depends     = depends
+        self.snapshot    = snapshot
+        self.preflight   = preflight
+
+
+    def __setattr__(self, name, value):
+        if name in FROZEN_FIELDS and getattr(self, '_primed', False):
+            raise AttributeError(
+                f"Primed definition for '{self.name}' cannot be changed; "
+                "use `replace` to get a changed copy."
+            )
+        super().__setattr__(name, value)
 
 
     def _repr_html_(self):
@@ -99,18 +179,24 @@ class QueryDef:
 
         if not self.parameters:
             return None
-        if not all([k in parameters.keys() for k in self.parameters.keys()]):
-            missing = set(self.parameters.keys()) - set(parameters.keys())
+        # parameters bound to upstream results are set later (see `bind`)
+        depends = getattr(self, 'depends', None) or dict()
+        missing = set(self.parameters) - set(parameters) - set(depends)
+        if missing:
             raise ValueError(
                 f"Definition for '{self.name}' is underdefined. "
                 f"Missing the following parameters: {missing}."
             )
 
+        lists = dict()
         for key, value in parameters.items():
             if key not in self.parameters.keys():
                 continue
+            item_type = get_list_type(self.parameters[key])
             try:
-                if self.parameters[key] == 'int':
+                if item_type is not None:
+                    lists[key] = to_list(value, item_type)
+                elif self.parameters[key] == 'int':
                     int(value)
             except ValueError:
                 raise ValueError(
@@ -118,10 +204,169 @@ class QueryDef:
                     f"of type {self.parameters[key]}."
                 )
 
-        self.name = self.set_param(self.name, parameters)
-        self.filename = self.set_param(self.filename, parameters)
-        self.description = self.set_param(self.description, parameters)
-        self.sql = self.set_param(self.sql, parameters)
+        # split lists that exceed the limit of the database into chunks
+        # (a definition primed in steps may have been split before); the
+        # union of the chunks only equals the full query for an IN-clause
+        # on records, not for NOT IN or aggregates over the whole set
+        statements = getattr(self, 'chunks', None) or [self.sql]
+        limit = EXECUTION.in_list_limit
+        chunked = {k: v for k, v in lists.items() if limit and len(v) > limit}
+        keys = list(chunked)
+        for key in keys:
+            pattern = NOT_IN.format(re.escape(key))
+            if any(re.search(pattern, sql) for sql in statements):
+                raise ValueError(
+                    f"Parameter '{key}' of '{self.name}' has {len(lists[key])}"
+                    f" values (limit {limit}) and cannot be split into chunks"
+                    f" in a NOT IN-clause."
+                )
+        combos = list(itertools.product(
+            *[chunk_list(chunked[key], limit) for key in keys]))
+        parameters = {
+            **parameters,
+            **{k: format_list(v) for k, v in lists.items()},
+        }
+        if len(statements) > 1 or chunked:
+            templates = [self.get_template('sql', sql) for sql in statements]
+            self.chunks = [
+                template.render({
+                    **parameters,
+                    **{k: format_list(v) for k, v in zip(keys, combo)},
+                })
+                for template in templates
+                for combo in combos
+            ]
+
+        for field in TEMPLATE_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                value = self.get_template(field, value).render(parameters)
+            setattr(self, field, value)
+        if depends:
+            self.depends = {
+                k: self.get_template(f'depends.{k}', v).render(parameters)
+                for k, v in depends.items()
+            }
+
+
+    def prime(self, parameters=None):
+        "Return a primed (immutable) copy of the query definition."
+
+        qd = self._thaw()
+        qd(parameters)
+        qd._primed = True
+        return qd
+
+
+    def replace(self, **changes):
+        """
+        Return copy of the query definition with the attributes in `changes`
+        set. A copy of a primed definition is primed as well.
+        """
+
+        qd = copy.copy(self)
+        vars(qd).update(changes)
+        return qd
+
+
+    def _thaw(self):
+        "Return mutable deep copy of the query definition."
+
+        qd = copy.deepcopy(self)
+        qd._primed = False
+        return qd
+
+
+    def expand(self, grid):
+        """
+        Return primed copies of the query definition for every combination
+        of parameters in `grid` (see `expand_grid`).
+        Combinations that only differ in parameters that are not used by
+        the definition result in one copy. Copies get a unique filename
+        (see `prime_set`).
+        """
+
+        return prime_set([self], grid)
+
+
+    def bind(self, frames):
+        """
+        Return primed copies of the query definition with the parameters in
+        `depends` set to the values in the upstream results.
+
+        A list-typed parameter gets all distinct values of the upstream
+        column. Any other parameter results in a copy per distinct value;
+        if the filename does not contain the parameter, the value is
+        appended to the filename so every copy is stored separately.
+
+        Parameters
+        ==========
+        :param frames: `dict`
+            Upstream results per query name (list of DataFrames).
+
+        Return
+        ======
+        :bind: `list`
+            List of primed `QueryDef` instances.
+        """
+
+        values = dict()
+        for key, reference in self.depends.items():
+            name, column = split_reference(reference)
+            if name not in frames:
+                raise ValueError(
+                    f"Definition for '{self.name}' depends on "
+                    f"unknown query '{name}'."
+                )
+            if not all(column in df.columns for df in frames[name]):
+                raise ValueError(
+                    f"Results of query '{name}' have no column '{column}'.")
+            ptype = self.parameters.get(key)
+            value = [v for df in frames[name] for v in df[column].dropna()]
+            if ptype == 'int' or get_list_type(ptype) == 'int':
+                value = [int(v) for v in value]
+            values[key] = list(dict.fromkeys(value))
+
+        keep = {k for k in values if get_list_type(self.parameters.get(k))}
+        in_filename = self.get_template('filename', self.filename).keys
+        suffix = [k for k in values if k not in keep and k not in in_filename]
+        primed = list()
+        for parameters in expand_grid(values, keep=keep):
+            qd = self._thaw()
+            # the other parameters have been set when priming the definition
+            qd.parameters = {k: self.parameters[k] for k in parameters}
+            qd.depends = None
+            qd(parameters)
+            qd.parameters = dict(self.parameters)
+            if suffix:
+                qd.filename = '_'.join(
+                    [qd.filename]
+                    + [to_filename(parameters[k]) for k in suffix]
+                )
+            qd._primed = True
+            primed.append(qd)
+        return primed
+
+
+    def to_dict(self):
+        "Return the attributes of the query definition (see `from_dict`)."
+
+        return {k: v for k, v in vars(self).items() if k != '_templates'}
+
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Return query definition from its attributes, e.g. as stored in the
+        manifest of query results.
+        """
+
+        data = dict(data)
+        data.pop('_templates', None)
+        primed = data.pop('_primed', False)
+        qd = cls(**data)
+        qd._primed = primed
+        return qd
 
 
     @classmethod
@@ -143,12 +388,20 @@ class QueryDef:
         # optional specifications
         columns = ini.columns if 'columns' in fields else None
         parameters = ini.parameters if 'parameters' in fields else None
-
-        meta_exists = 'meta' in fields
-        description = ini.meta.description if meta_exists else ''
-        qtype = ini.meta.qtype if meta_exists else ''
-
-        return cls(
+        incremental = ini.incremental if 'incremental' in fields else None
+        compaction = ini.compaction if 'compaction' in fields else None
+        depends = ini.depends if 'depends' in fields else None
+        preflight = ini.preflight if 'preflight' in fields else None
+
+        meta = ini.meta if 'meta' in fields else None
+        description = getattr(meta, 'description', '')
+        qtype = getattr(meta, 'qtype', '')
+        cache_ttl = getattr(meta, 'cache_ttl', None)
+        priority = getattr(meta, 'priority', None) or 0
+        timeout = getattr(meta, 'timeout', None)
+        snapshot = getattr(meta, 'snapshot', None)
+
+        qd = cls(
             ini.definition.name,
             ini.definition.filename,
             format_sql(ini.query.sql),
@@ -156,13 +409,55 @@ class QueryDef:
             description=description.strip('\n'),
             columns=dict() if columns is None else columns._asdict(),
             parameters=dict() if parameters is None else parameters._asdict(),
+            cache_ttl=cache_ttl,
+            incremental=None if incremental is None else incremental._asdict(),
+            priority=priority,
+            compaction=None if compaction is None else compaction._asdict(),
+            timeout=timeout,
+            depends=None if depends is None else depends._asdict(),
+            snapshot=snapshot,
+            preflight=None if preflight is None else preflight._asdict(),
         )
+        qd.compile_templates()
+        return qd
+
+
+    def compile_templates(self):
+        """
+        Compile the parameter templates in the query definition.
+        The compiled templates are stored on the definition (and its copies),
+        so priming does not parse the templates again.
+        """
+
+        templates = dict()
+        for field in TEMPLATE_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                templates[field] = compile_template(value)
+        for key, value in (getattr(self, 'depends', None) or dict()).items():
+            templates[f'depends.{key}'] = compile_template(value)
+        self._templates = templates
+        return None
+
+
+    def get_template(self, field, text):
+        """
+        Return compiled template of `field` if it still holds `text`, else
+        compile `text` (e.g. a definition primed in steps).
+        """
+
+        template = (getattr(self, '_templates', None) or dict()).get(field)
+        if template is None or template.text != text:
+            template = compile_template(text)
+        return template
 
 
     @staticmethod
     def set_param(x, parameters=None):
         """
         Set variables, if any.
+        The string is compiled into a template, so setting parameters is a
+        single pass over the string.
 
         Parameters
         ==========
@@ -178,51 +473,178 @@ class QueryDef:
         :set_param: `string`
         """
 
-        if parameters:
-            for key, value in parameters.items():
-                x = x.replace(f'[{key}]', str(value))
-
-                # simple arithmetic
-                srch_str = fr'(\[({key})(-|\+)(\d+)\])'
-                regex = re.compile(srch_str)
-                matches = re.findall(regex, x)
-                if matches is not None:
-                    for match in matches:
-                        left = value
-                        operator = match[2]
-                        right = match[3]
-                        output = eval(left + operator + right)
-                        x = x.replace(match[0], str(output))
-
-                # slice logic on variables
-                srch_str = fr'\[{key}\((.?:.?)\)\]'
-                regex = re.compile(srch_str)
-                match = re.search(regex, x)
-                if match is None:
-                    continue
-
-                slice_ = match.group(1).split(':')
-                left = None if slice_[0] == '' else int(slice_[0])
-                right = None if slice_[1] == '' else int(slice_[1])
-                key_slice = f'[{key}({match.group(1)})]'
-                val_slice = value[left:right]
-                x = x.replace(key_slice, val_slice)
+        if parameters and x is not None:
+            x = compile_template(x).render(parameters)
         return x
 
 
     @staticmethod
     def fetch_queries(queryset):
         """
-        Print avialbable query results in PATHS.definitions / queryset.
+        Return paths to the query definitions in PATHS.definitions / queryset
+        by name, as indexed by the definition catalog.
         (Use view_sets to view available sets.)
         """
 
-        base = PATHS.definitions
-        path = PATHS.definitions / queryset
-        queries = {}
-        for item in path.glob('**/*.*'):
-            queries[item.relative_to(path).with_suffix('').name] = item
-        return queries
+        # the catalog imports this module
+        from query.catalog import get_catalog
+
+        return {path.stem: path for path in get_catalog().files(queryset)}
+
+
+def get_list_type(ptype):
+    "Return item type of a list-typed parameter ('list[int]' -> 'int')."
+
+    if not isinstance(ptype, str):
+        return None
+    match = LIST_TYPE.match(ptype.strip())
+    return None if match is None else match.group('item')
+
+
+def to_list(value, item_type=None):
+    """
+    Return value of a list-typed parameter as list without duplicates.
+    Strings are split on commas, semicolons and whitespace. If `item_type` is
+    'int' the values are converted to integers (ValueError if impossible).
+    """
+
+    if isinstance(value, str):
+        value = [v for v in re.split(r'[,;\s]+', value) if v]
+    elif not hasattr(value, '__iter__'):
+        value = [value]
+    if item_type == 'int':
+        value = [int(v) for v in value]
+    return list(dict.fromkeys(value))
+
+
+def to_filename(value):
+    "Return value as part of a filename (unsafe characters replaced by _)."
+
+    return re.sub(r'[^\w.-]+', '_', str(value))
+
+
+def split_reference(reference):
+    "Split reference to an upstream column ('query.column') in its parts."
+
+    name, _, column = str(reference).strip().rpartition('.')
+    if not name or not column:
+        raise ValueError(
+            f"Invalid reference '{reference}'; use '<query name>.<column>'.")
+    return name, column
+
+
+def chunk_list(values, size):
+    "Return `values` split into lists of at most `size` values."
+
+    return [values[idx:idx + size] for idx in range(0, len(values), size)]
+
+
+def format_list(values):
+    "Return values as the contents of an sql IN-clause."
+
+    if not values:
+        return 'null'
+    return ', '.join(
+        str(int(v)) if isinstance(v, numbers.Integral)
+        else "'{}'".format(str(v).replace("'", "''"))
+        for v in values
+    )
+
+
+def expand_grid(grid, keep=None):
+    """
+    Return list of parameter dictionaries from a parameter grid.
+
+    Parameters
+    ==========
+    :param grid: `dict` or `list`
+        - dict: maps parameter names to a value or a list of values;
+          every combination of values (cartesian product) is returned.
+        - list: explicit list of parameter dictionaries; returned as is.
+
+    Optional key-word arguments
+    ===========================
+    :param keep: `set`, default `None`
+        Names of (list-typed) parameters whose list is a single value.
+
+    Example
+    =======
+    >>> expand_grid({'collegejaar': [2018, 2019], 'examentype': 'BA'})
+    [{'collegejaar': 2018, 'examentype': 'BA'},
+     {'collegejaar': 2019, 'examentype': 'BA'}]
+
+    Return
+    ======
+    :expand_grid: `list`
+    """
+
+    if isinstance(grid, (list, tuple)):
+        return [dict(parameters) for parameters in grid]
+
+    keep = keep or set()
+    keys = list(grid.keys())
+    values = [
+        value
+        if isinstance(value, (list, tuple, range)) and key not in keep
+        else [value]
+        for key, value in grid.items()
+    ]
+    return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+
+
+def prime_set(qds, grid):
+    """
+    Return primed copies of the query definitions in `qds` for every
+    combination of parameters in `grid` (see `expand_grid`).
+    The definitions in `qds` are not changed. If the filename does not
+    contain a parameter that differs between the copies of a definition,
+    its value is appended to the filename (like `QueryDef.bind`), so every
+    copy is stored, cached and cancelled separately.
+
+    Parameters
+    ==========
+    :param qds: `list`
+        List of `QueryDef` instances.
+    :param grid: `dict` or `list`
+        Parameter grid.
+
+    Return
+    ======
+    :prime_set: `list`
+        List of primed `QueryDef` instances.
+    """
+
+    keep = {
+        key
+        for qd in qds
+        for key, ptype in (qd.parameters or {}).items()
+        if get_list_type(ptype) is not None
+    }
+
+    primed = list()
+    for qd in qds:
+        combos = dict()
+        for parameters in expand_grid(grid, keep=keep):
+            used = tuple(
+                (k, str(parameters.get(k))) for k in sorted(qd.parameters or {})
+            )
+            combos.setdefault(used, parameters)
+
+        in_filename = qd.get_template('filename', qd.filename).keys
+        suffix = [
+            k for k, ptype in (qd.parameters or {}).items()
+            if get_list_type(ptype) is None and k not in in_filename
+            and len({str(p.get(k)) for p in combos.values()}) > 1
+        ]
+        for parameters in combos.values():
+            copy = qd.prime(parameters)
+            if suffix:
+                copy = copy.replace(filename='_'.join(
+                    [copy.filename]
+                    + [to_filename(parameters.get(k)) for k in suffix]
+                ))
+            primed.append(copy)
+    return primed
 
 
 def format_sql(sql, tab_length=4):
@@ -0,0 +1,264 @@
+"""
+This module compares the results of two runs of the same query.
+
+Records are compared on hashes instead of merging the frames: every record
+is hashed once (vectorized with pandas) on its key columns and once on its
+other columns. Records of which the key only occurs in the new results are
+added, records of which the key only occurs in the old results are removed
+and records with the same key but different values are changed. Without a
+key, complete records are compared (a changed record then shows up as
+removed and added).
+
+In summary mode only the number of added, removed and changed records (and
+the number of changes per column) is returned; the differing records are
+not collected.
+
+Usage
+=====
+today = QueryResult.read('monitor/inschrijvingen')
+yesterday = get_snapshot_store().load('monitor/inschrijvingen', '2019-10-01')
+
+diff = today.diff(yesterday, key=['studentnummer', 'opleiding'])
+diff.summary
+diff.changed
+diff.save()
+"""
+
+# standard library
+import json
+import pickle
+from pathlib import Path
+
+# third party
+import numpy as np
+import pandas as pd
+
+# local
+from query.config import PATHS
+
+
+# mixed into the hash of duplicate records to tell them apart
+GOLDEN_RATIO = np.uint64(0x9E3779B97F4A7C15)
+
+
+class Diff:
+    """
+    Diff
+    ====
+    Differences between the results of two runs of a query.
+
+    Attributes
+    ==========
+    name: str
+        Name of the query.
+    filename: str
+        Filename of the query definition.
+    dtime_old: datetime
+        Execution date and time of the old results.
+    dtime_new: datetime
+        Execution date and time of the new results.
+    summary: dict
+        Number of records, the number of added, removed, changed and
+        unchanged records, the number of changed values per column and the
+        added and removed columns.
+    added: DataFrame
+        Records only in the new results (None in summary mode).
+    removed: DataFrame
+        Records only in the old results (None in summary mode).
+    changed: DataFrame
+        New version of the changed records (None in summary mode).
+    before: DataFrame
+        Old version of the changed records, in the same order as `changed`
+        (None in summary mode).
+
+    Methods
+    =======
+    - save
+    - read
+    """
+
+    def __init__(
+        self,
+        summary,
+        added=None,
+        removed=None,
+        changed=None,
+        before=None,
+    ):
+        self.name      = None
+        self.filename  = None
+        self.dtime_old = None
+        self.dtime_new = None
+        self.summary   = summary
+        self.added     = added
+        self.removed   = removed
+        self.changed   = changed
+        self.before    = before
+
+
+    def __repr__(self):
+        counts = ', '.join(
+            f"{k} {self.summary[k]}" for k in ['added', 'removed', 'changed'])
+        return f"<{self.__class__.__name__}, '{self.name}', {counts}>"
+
+
+    def save(self, path=None):
+        """
+        Save the diff next to the stored results of the query.
+        The summary is written to a json file next to it.
+
+        Optional key-word arguments
+        ===========================
+        :param path: `Path`
+            Path to store the diff.
+            If None '<filename>.diff' in the output folder is used.
+        """
+
+        if not path:
+            path = PATHS.output / f'{self.filename}.diff'
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+        meta = {
+            'name': self.name,
+            'filename': self.filename,
+            'dtime_old': self.dtime_old,
+            'dtime_new': self.dtime_new,
+            'summary': self.summary,
+        }
+        with open(f'{path}.json', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=4, default=str)
+        return None
+
+
+    @staticmethod
+    def read(name=None, path=None):
+        """
+        Read a stored diff.
+
+        Optional key-word arguments
+        ===========================
+        :param name: `str`
+            Filename of the query, for example 'monitor/inschrijvingen'.
+        :param path: `Path`
+            Path to the stored diff.
+        """
+
+        if name is not None:
+            path = PATHS.output / f'{name}.diff'
+        elif path is None:
+            raise ValueError(
+                "Either query name or path is needed to load a diff.")
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+def diff_frames(new, old, key=None, summary=False):
+    """
+    Return the differences between two frames.
+    Only the columns in both frames are compared.
+
+    Parameters
+    ==========
+    :param new: `DataFrame`
+    :param old: `DataFrame`
+
+    Optional key-word arguments
+    ===========================
+    :param key: `str` or `list`, default `None`
+        Column(s) identifying a record. If None complete records are
+        compared and no records are reported as changed.
+    :param summary: `bool`, default False
+        If True only the summary is returned (see `Diff`).
+
+    Return
+    ======
+    :diff_frames: `Diff`
+    """
+
+    columns = [col for col in new.columns if col in old.columns]
+    key = [key] if isinstance(key, str) else list(key or [])
+    missing = [col for col in key if col not in columns]
+    if missing:
+        raise ValueError(f"Key column(s) {missing} not in both frames.")
+    values = [col for col in columns if col not in key]
+
+    if key:
+        new_keys, old_keys = hash_rows(new, key), hash_rows(old, key)
+        for keys, which in [(new_keys, 'new'), (old_keys, 'old')]:
+            if not pd.Index(keys).is_unique:
+                raise ValueError(
+                    f"Key {key} does not identify the {which} records.")
+    else:
+        new_keys = number_duplicates(hash_rows(new, columns))
+        old_keys = number_duplicates(hash_rows(old, columns))
+
+    # position of every new record in the old records (-1: added)
+    positions = pd.Index(old_keys).get_indexer(new_keys)
+    added = positions == -1
+    found = np.flatnonzero(~added)
+    removed = np.ones(len(old), dtype=bool)
+    removed[positions[found]] = False
+
+    changed = np.zeros(len(new), dtype=bool)
+    if key and values and len(found):
+        new_values = hash_rows(new.iloc[found], values)
+        old_values = hash_rows(old.iloc[positions[found]], values)
+        changed[found] = new_values != old_values
+    idx_new = np.flatnonzero(changed)
+    idx_old = positions[idx_new]
+
+    # changes per column are only computed for the changed records
+    per_column = dict()
+    for col in values if len(idx_new) else list():
+        differs = (
+            hash_rows(new.iloc[idx_new], [col])
+            != hash_rows(old.iloc[idx_old], [col])
+        )
+        per_column[col] = int(differs.sum())
+
+    counts = {
+        'key': key,
+        'old': len(old),
+        'new': len(new),
+        'added': int(added.sum()),
+        'removed': int(removed.sum()),
+        'changed': len(idx_new),
+        'unchanged': len(found) - len(idx_new),
+        'columns': per_column,
+        'columns_added': [c for c in new.columns if c not in old.columns],
+        'columns_removed': [c for c in old.columns if c not in new.columns],
+    }
+    if summary:
+        return Diff(counts)
+    return Diff(
+        counts,
+        added=new[added].reset_index(drop=True),
+        removed=old[removed].reset_index(drop=True),
+        changed=new.iloc[idx_new].reset_index(drop=True),
+        before=old.iloc[idx_old].reset_index(drop=True),
+    )
+
+
+def hash_rows(frame, columns):
+    "Return hash (uint64) per record of `columns` in `frame`."
+
+    df = frame[list(columns)]
+    # dates are compared on their value, regardless of their resolution
+    dates = [
+        col for col, dtype in df.dtypes.items()
+        if str(dtype).startswith('datetime64[')
+        and str(dtype) != 'datetime64[ns]'
+    ]
+    if dates:
+        df = df.astype({col: 'datetime64[ns]' for col in dates})
+    return pd.util.hash_pandas_object(df, index=False).values
+
+
+def number_duplicates(hashes):
+    "Return hashes in which duplicate values are made distinct."
+
+    occurrence = pd.Series(hashes).groupby(hashes).cumcount().values
+    return hashes ^ (occurrence.astype('uint64') * GOLDEN_RATIO)
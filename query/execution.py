@@ -1,22 +1,48 @@
 # standard library
-import sys
+import atexit
+import importlib
 import json
+import math
+import queue
+import threading
 import timeit
-from collections import Iterable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
 
 # third party
 import pandas as pd
 import pyodbc
 
 # local
-from query.config import PATHS
+from query import preflight
+from query.cache import get_cache
+from query.cancellation import Cancellation, QueryInterrupted, TIMEOUT
+from query.compaction import get_spec as get_compaction_spec
+from query.config import PATHS, EXECUTION, POOL, STORAGE
 from query.definition import QueryDef
-from query.results import QueryResult
-from query.utils import reporter, getpw, get_credentials
+from query.fetch import fetch_typed, get_nbytes, stream_parquet
+from query.incremental import (
+    load_stored, get_watermark, increment_def, merge_increment)
+from query.offload import fetch_raw, build_result, get_process_pool
+from query.results import QueryResult, OK, FAILED, SUFFIXES
+from query.snapshots import (
+    get_snapshot_store, is_enabled as is_snapshot_enabled)
+from query.tracing import Trace, traced
+from query.utils import getpw, get_credentials
 
 
-@reporter
-def run_query(qd, cursor=None, save=True):
+@traced
+def run_query(
+    qd,
+    cursor=None,
+    save=True,
+    use_cache=True,
+    incremental=True,
+    cancel=None,
+    timeout=None,
+    offload=None,
+    trace=None,
+):
     """
     Run query and return results.
 
@@ -26,6 +52,38 @@ def run_query(qd, cursor=None, save=True):
     - Execute sql statement.
     - Fetch records.
 
+    If the query definition has a cache ttl, a valid result from the result
+    cache is returned instead of querying the database.
+
+    If the query definition declares an [incremental] section and results
+    are stored, only records beyond the stored watermark are fetched and
+    merged into the stored results.
+
+    A query that is cancelled, exceeds its timeout or fails returns a
+    QueryResult with an empty frame and the corresponding status. Such
+    results are not saved or cached.
+
+    The duration of every phase is recorded in a trace and stored on the
+    QueryResult as `spans` (see `query.tracing`).
+
+    If a list-typed parameter was split into chunks (see `QueryDef.chunks`),
+    the chunks run in parallel, each on a connection from the pool (or one
+    after the other on `cursor`), and their records are concatenated.
+    Such queries are always fully refreshed.
+
+    In offload mode the records are fetched in this thread, but the frame is
+    built, compacted and saved in a worker process (see `query.offload`).
+    If the results are saved, the returned QueryResult loads its frame from
+    storage on first access.
+
+    If the query definition enables a pre-flight estimate, the size of the
+    results is estimated first and the records are fetched in memory,
+    streamed to disk or fetched in parallel partitions (see
+    `query.preflight`). The chosen strategy is stored on the QueryResult
+    as `strategy`. Results streamed to disk are stored as parquet file and
+    load their frame from it on first access; they are not compacted or
+    cached (their snapshot is read back from the file in parts).
+
     Return QueryDef
     - (Optionally) rename columns.
     - (Optionally) recast dtypes.
@@ -40,36 +98,237 @@ def run_query(qd, cursor=None, save=True):
     ===================
     :param cursor: `cursor`, default `None`
         ODBC-connection to the database.
-        If None the constructor will establish connection.
+        If None a connection is borrowed from the shared connection pool.
+    :param save: `bool`, default True
+        If True the results are saved to disk.
+    :param use_cache: `bool`, default True
+        If False the result cache is bypassed and the query is always run
+        against the database (the fresh result is still cached).
+    :param incremental: `bool`, default True
+        If False incremental definitions are fully refreshed.
+    :param cancel: `Cancellation`, default `None`
+        Token with which the query can be cancelled from another thread.
+    :param timeout: `int`, default `None`
+        Maximum number of seconds the query may run. If None the timeout
+        of the query definition or else the timeout from the config is used.
+    :param offload: `bool`, default `None`
+        If True the CPU work after fetching is done in a worker process.
+        If None the offload setting from the config is used.
+    :param trace: `Trace`, default `None`
+        Trace in which the phases are recorded.
+        If None a new trace is started.
 
     Return
     ======
     :QueryResult:
     """
 
-    # connection
-    if not cursor:
-        cursor = connect()
+    if offload is None:
+        offload = EXECUTION.offload
+    if timeout is None:
+        timeout = getattr(qd, 'timeout', None) or EXECUTION.timeout
+    if cancel is None:
+        cancel = Cancellation()
+
+    # result cache
+    cache = get_cache()
+    if use_cache:
+        with trace.span('cache'):
+            q = cache.get(qd)
+        if q is not None:
+            print(f"Query '{qd.name}' loaded from cache.")
+            q.cached = True
+            return q
+
+    # stored results to refresh incrementally
+    chunks = getattr(qd, 'chunks', None)
+    stored = load_stored(qd) if incremental and not chunks else None
+
+    # pre-flight estimate of the size of the results
+    strategy, stream = None, None
+    spec = preflight.get_spec(qd) if stored is None and not chunks else None
+    if spec is not None:
+        strategy = plan_fetch(qd, spec, cursor=cursor, save=save, trace=trace)
+        if strategy == preflight.PARTITIONED:
+            qd = preflight.partition(qd, spec)
+            chunks = qd.chunks
+        elif strategy == preflight.DISK:
+            stream = PATHS.output / f"{qd.filename}{SUFFIXES['parquet']}"
+
+    # connection (chunks borrow their own connections)
+    if cursor or chunks:
+        borrowed = nullcontext(cursor)
+    else:
+        borrowed = get_pool().cursor()
 
     # fetch records
-    start = timeit.default_timer()
-    df = execute(cursor, qd)
-    stop = timeit.default_timer()
-    seconds = stop - start
+    # errors are caught outside the borrowed connection, so the pool closes
+    # connections that failed or were interrupted instead of reusing them
+    status, error = OK, None
+    connecting = start = timeit.default_timer()
+    try:
+        with borrowed as cursor:
+            start = timeit.default_timer()
+            trace.add('connect', start - connecting, start=connecting)
+            if chunks:
+                df = execute_chunks(
+                    cursor, qd,
+                    cancel=cancel, timeout=timeout, raw=offload, trace=trace,
+                )
+            elif stream is not None:
+                nrecords = execute(
+                    cursor, qd,
+                    cancel=cancel, timeout=timeout, raise_errors=True,
+                    trace=trace, stream=stream,
+                )
+            elif stored is None:
+                df = execute(
+                    cursor, qd,
+                    cancel=cancel, timeout=timeout, raise_errors=True,
+                    raw=offload, trace=trace,
+                )
+            else:
+                watermark = get_watermark(qd, stored.frame)
+                df = execute(
+                    cursor, increment_def(qd), params=[watermark],
+                    cancel=cancel, timeout=timeout, raise_errors=True,
+                    raw=offload, trace=trace,
+                )
+                print(
+                    f"Query '{qd.name}' fetched {len(df)} records "
+                    f"beyond watermark {watermark}."
+                )
+    except QueryInterrupted as e:
+        df, status, error = pd.DataFrame(), e.status, str(e)
+        print(f"Query '{qd.name}' was interrupted ({status}).")
+    except pyodbc.Error as e:
+        df, status, error = pd.DataFrame(), FAILED, get_error_message(e)
+    seconds = timeit.default_timer() - start
+
+    if stream is not None and status == OK:
+        q = QueryResult.from_parquet(qd, stream, nrecords, seconds)
+        q.strategy = strategy
+        if get_compaction_spec(qd) is not None:
+            print(
+                f"Query '{qd.name}' was streamed to disk: "
+                "the results are not compacted."
+            )
+        if is_snapshot_enabled(qd):
+            with trace.span('snapshot', nrows=q.nrecords) as span:
+                span.nbytes = get_snapshot_store().save(q)['written']
+        # the result only refers to the parquet file, so it is not cached
+        return q
+
+    if offload and status == OK:
+        submitted = timeit.default_timer()
+        future = get_process_pool().submit(
+            build_result, qd, df, seconds,
+            save=save, merge=stored is not None,
+        )
+        q = future.result()
+        trace.extend(q.spans, start=submitted)
+        q.strategy = strategy
+        return q
+
+    if stored is not None and status == OK:
+        df = merge_increment(qd, stored.frame, df)
 
     # store results
-    q = QueryResult(qd, df, seconds)
+    q = QueryResult(qd, df, seconds, status=status, error=error)
+    q.strategy = strategy
+    if status != OK:
+        return q
+    if get_compaction_spec(qd) is not None:
+        with trace.span('compaction', nrows=q.nrecords) as span:
+            q.compact()
+            span.nbytes = q.memory_after
     if save:
-        q.to_pickle()
+        with trace.span('save', nrows=q.nrecords) as span:
+            q.save()
+            span.nbytes = q.path.stat().st_size
+    if save and is_snapshot_enabled(qd):
+        with trace.span('snapshot', nrows=q.nrecords) as span:
+            span.nbytes = get_snapshot_store().save(q)['written']
+    cache.put(q)
     return q
 
 
-def execute(cursor, qd):
+def plan_fetch(qd, spec, cursor=None, save=True, trace=None):
+    """
+    Estimate the size of the results of `qd` and return the fetch strategy
+    (see `query.preflight`). The estimate and strategy are printed. If the
+    records cannot be counted, the records are fetched in memory.
+
+    Parameters
+    ==========
+    :param qd: `QueryDef`
+        Instance of `QueryDef` containing the query definition.
+    :param spec: `dict`
+        Pre-flight specification (see `query.preflight.get_spec`).
+
+    Optional parameters
+    ===================
+    :param cursor: `cursor`, default `None`
+        ODBC-connection to the database.
+        If None a connection is borrowed from the shared connection pool
+        (only if the records are counted).
+    :param save: `bool`, default True
+        If False the results are always fetched in memory.
+    :param trace: `Trace`, default `None`
+        Trace in which the estimate is recorded.
+
+    Return
+    ======
+    :plan_fetch: `str`
+    """
+
+    if trace is None:
+        trace = Trace()
+    with trace.span('preflight') as span:
+        estimate = None
+        if spec['method'] == 'history':
+            estimate = preflight.estimate_history(qd)
+        if estimate is None:
+            borrowed = nullcontext(cursor) if cursor else get_pool().cursor()
+            try:
+                with borrowed as cursor:
+                    estimate = preflight.estimate_count(
+                        cursor, qd, spec['sample_rows'])
+            except pyodbc.Error as e:
+                print(
+                    f"Query '{qd.name}' could not be estimated: "
+                    f"{get_error_message(e)}"
+                )
+                return preflight.MEMORY
+        span.nrows = estimate['nrows']
+        span.nbytes = estimate['nbytes']
+
+    strategy = preflight.choose(estimate, spec, save=save)
+    print(preflight.describe(qd, estimate, strategy))
+    return strategy
+
+
+def execute(
+    cursor,
+    qd,
+    fetch_size=None,
+    params=None,
+    cancel=None,
+    timeout=None,
+    raise_errors=False,
+    raw=False,
+    trace=None,
+    stream=None,
+):
     """
     Execute sql statement from `qd`. Return dataframe.
 
     If the sql statement throws an error, the error message will be caught
-    and printed. An empty dataframe is returned.
+    and printed. An empty dataframe is returned (or the error is raised if
+    `raise_errors` is True).
+
+    If the query is cancelled through `cancel` or exceeds `timeout`,
+    `QueryInterrupted` is raised.
 
     Parameters
     ==========
@@ -78,13 +337,59 @@ def execute(cursor, qd):
     :param qd: `QueryDef`
         Instance of `QueryDef` containing the query definition.
 
+    Optional parameters
+    ===================
+    :param fetch_size: `int`, default `None`
+        Number of records to fetch per batch.
+        If None the fetch_size from the config is used.
+        If 0 all records are fetched at once.
+    :param params: `list`, default `None`
+        Values bound to the parameter markers ('?') in the sql statement.
+    :param cancel: `Cancellation`, default `None`
+        Token with which the query can be cancelled from another thread.
+    :param timeout: `float`, default `None`
+        Maximum number of seconds the query may run (None: no timeout).
+        The timeout is set as ODBC query timeout and enforced during
+        fetching by cancelling the statement.
+    :param raise_errors: `bool`, default False
+        If True database errors are raised after printing them.
+    :param raw: `bool`, default False
+        If True the records are returned as fetched batches (`RawBatches`)
+        instead of a dataframe (see `query.offload`).
+    :param trace: `Trace`, default `None`
+        Trace in which the phases are recorded (see `query.tracing`).
+    :param stream: `Path`, default `None`
+        If set the records are written to this parquet file while fetching
+        and the number of records is returned (see
+        `query.fetch.stream_parquet`).
+
     Return
     ======
     :pd.DataFrame:
     """
 
+    if fetch_size is None:
+        fetch_size = EXECUTION.fetch_size
+    if cancel is None:
+        cancel = Cancellation()
+
+    watchdog = None
+    if timeout:
+        set_query_timeout(cursor, timeout)
+        watchdog = threading.Timer(timeout, cancel.cancel, args=[TIMEOUT])
+        watchdog.daemon = True
+        watchdog.start()
+    cancel.attach(cursor)
+
     try:
-        cursor.execute(qd.sql)
+        cancel.check()
+        if trace is None:
+            trace = Trace()
+        with trace.span('execute'):
+            if params:
+                cursor.execute(qd.sql, params)
+            else:
+                cursor.execute(qd.sql)
         if isinstance(qd.columns, dict):
             cols = qd.columns.keys()
             dtypes = {k: v for k, v in qd.columns.items() if v is not None}
@@ -95,16 +400,42 @@ def execute(cursor, qd):
         if not cols:
             cols = [column[0] for column in cursor.description]
 
-        df =  pd.DataFrame.from_records(
-            cursor.fetchall(),
-            columns=cols,
-        )
+        if stream is not None:
+            return stream_parquet(
+                cursor, list(cols), fetch_size, stream,
+                dtypes=dtypes, cancel=cancel, trace=trace,
+                compression=STORAGE.compression,
+            )
+        if raw:
+            return fetch_raw(
+                cursor, list(cols), fetch_size,
+                dtypes=dtypes, cancel=cancel, trace=trace,
+            )
+        if fetch_size:
+            return fetch_typed(
+                cursor, list(cols), fetch_size,
+                dtypes=dtypes, cancel=cancel, trace=trace,
+            )
 
+        with trace.span('fetch') as span:
+            records = cursor.fetchall()
+            span.nrows = len(records)
+        with trace.span('frame_build', nrows=len(records)) as span:
+            df = pd.DataFrame.from_records(records, columns=cols)
+            span.nbytes = get_nbytes(df)
+        del records
+        cancel.check()
         if dtypes:
-            df = df.astype(dtypes)
+            with trace.span('cast', nrows=len(df)) as span:
+                df = df.astype(dtypes)
+                span.nbytes = get_nbytes(df)
         return df
 
-    except pyodbc.Error:
+    except pyodbc.Error as e:
+        if cancel.interrupted:
+            raise QueryInterrupted(cancel.status) from e
+        if is_timeout(e):
+            raise QueryInterrupted(TIMEOUT) from e
         print(
             "\n"
             " ____ ____ _  _ ___  _  _ ___ ____ ____  "
@@ -117,20 +448,371 @@ def execute(cursor, qd):
         )
         print(f"Query '{qd.name}' failed. The following error was returned:\n")
 
-        except_type, value, traceback = sys.exc_info()
-        print(except_type)
-        print(value.args[1].split('\n')[0])
+        print(type(e))
+        print(get_error_message(e))
         print()
+        if raise_errors:
+            raise
         return pd.DataFrame()
 
+    finally:
+        if watchdog is not None:
+            watchdog.cancel()
+            set_query_timeout(cursor, 0)
+        cancel.detach(cursor)
+
+
+def execute_chunks(
+    cursor,
+    qd,
+    cancel=None,
+    timeout=None,
+    raw=False,
+    trace=None,
+):
+    """
+    Execute the chunks of `qd` (see `QueryDef.chunks`) and return the
+    concatenated records. If `cursor` is None the chunks run in parallel,
+    each on a connection borrowed from the shared pool. If a chunk fails,
+    the other chunks are cancelled and the error is raised. The `timeout`
+    applies to all chunks together: each chunk gets the time that is left.
+
+    Parameters
+    ==========
+    :param cursor: `cursor`
+        ODBC-connection to the database or None.
+    :param qd: `QueryDef`
+        Instance of `QueryDef` with chunks.
+
+    Optional parameters
+    ===================
+    See `execute`.
+
+    Return
+    ======
+    :pd.DataFrame: (or `RawBatches` if `raw` is True)
+    """
+
+    if cancel is None:
+        cancel = Cancellation()
+    deadline = timeit.default_timer() + timeout if timeout else None
+
+    def remaining():
+        if deadline is None:
+            return timeout
+        seconds = deadline - timeit.default_timer()
+        if seconds <= 0:
+            cancel.cancel(TIMEOUT)
+            cancel.check()
+        return seconds
+
+    def run(sql, cursor=None):
+        chunk = qd.replace(sql=sql, chunks=None)
+        if cursor is not None:
+            return execute(
+                cursor, chunk,
+                cancel=cancel, timeout=remaining(), raise_errors=True,
+                raw=raw, trace=trace,
+            )
+        with get_pool().cursor() as cursor:
+            return run(sql, cursor)
+
+    if cursor is not None:
+        parts = [run(sql, cursor) for sql in qd.chunks]
+    else:
+        workers = min(len(qd.chunks), get_pool().size)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run, sql) for sql in qd.chunks]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                cancel.cancel()
+                raise
+        parts = [future.result() for future in futures]
+
+    if raw:
+        for part in parts[1:]:
+            parts[0].extend(part)
+        return parts[0]
+
+    categories = [
+        col for col, dtype in parts[0].dtypes.items()
+        if str(dtype) == 'category'
+    ]
+    df = pd.concat(parts, ignore_index=True)
+    if categories:
+        df = df.astype({col: 'category' for col in categories})
+    return df
+
+
+def set_query_timeout(cursor, timeout):
+    "Set ODBC query timeout (in seconds, 0 = no timeout) for the connection."
+
+    try:
+        # whole seconds; rounded up, since 0 means no timeout
+        cursor.connection.timeout = math.ceil(timeout)
+    except (AttributeError, pyodbc.Error):
+        pass
+    return None
+
+
+def is_timeout(error):
+    "Return True if the database error is a query timeout."
+
+    return bool(error.args) and error.args[0] == 'HYT00'
+
+
+def get_error_message(error):
+    "Return first line of the message of a database error."
+
+    message = error.args[1] if len(error.args) > 1 else str(error)
+    return message.split('\n')[0]
+
+
+# DB-API module and connection string used to connect to the database
+DRIVER = EXECUTION.driver
+CONNECTION_STRING = EXECUTION.connection_string
+
 
 def connect():
     "Connect to query database."
 
-    # get login credentials
+    return open_connection().cursor()
+
+
+def open_connection(connection_string=None):
+    "Open connection to query database."
+
+    if connection_string is None:
+        connection_string = get_connection_string()
+    return importlib.import_module(DRIVER).connect(connection_string)
+
+
+def use_driver(driver, connection_string=''):
+    """
+    Connect to the database through another DB-API module, for example the
+    SQLite stand-in in `testing.odbc_sqlite`. The module must provide
+    `connect` and raise errors derived from `pyodbc.Error`.
+    Idle connections in the shared connection pool are closed.
+
+    Parameters
+    ==========
+    :param driver: `str`
+        Name of the DB-API module.
+
+    Optional key-word arguments
+    ===========================
+    :param connection_string: `str`, default ''
+        Connection string passed to `connect`.
+        If empty the connection string is based on the login credentials.
+    """
+
+    global DRIVER, CONNECTION_STRING, _pool
+    DRIVER = driver
+    CONNECTION_STRING = connection_string
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+    return None
+
+
+def get_connection_string():
+    "Return ODBC connection string based on login credentials."
+
+    if CONNECTION_STRING:
+        return CONNECTION_STRING
     creds = get_credentials(PATHS.login)
+    return f'DSN={creds.dsn};UID={creds.uid};PWD={creds.pwd};CHARSET=UTF8'
+
+
+class ConnectionPool:
+    """
+    ConnectionPool
+    ==============
+    Pool of open connections to the query database that can be shared
+    between threads. A connection is borrowed from the pool for the duration
+    of a query and returned afterwards, so the login credentials are read
+    and the connection is established only once per connection.
+
+    Each thread should borrow its own connection: a connection is never
+    handed out to two borrowers at the same time.
+
+    Usage
+    =====
+    with pool.cursor() as cursor:
+        run_query(qd, cursor=cursor)
+
+    Attributes
+    ==========
+    size: int
+        Maximum number of open connections.
+    health_check: str
+        SQL statement used to check if an idle connection is still alive.
+    idle_check: float
+        Connections that have been idle for more than this number of seconds
+        are checked before they are handed out.
+    """
+
+    def __init__(self, size=None, health_check=None, idle_check=None):
+        self.size         = POOL.size if size is None else size
+        self.health_check = (
+            POOL.health_check if health_check is None else health_check)
+        self.idle_check   = (
+            POOL.idle_check if idle_check is None else idle_check)
+        self._idle        = queue.LifoQueue()
+        self._slots       = threading.BoundedSemaphore(self.size)
+        self._lock        = threading.Lock()
+        self._connection_string = None
+
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__}, "
+            f"size={self.size}, idle={self._idle.qsize()}>"
+        )
+
+
+    def acquire(self, timeout=None):
+        """
+        Borrow a connection from the pool.
+        Blocks until a connection is available if all connections are in use.
+
+        Optional key-word arguments
+        ===========================
+        :param timeout: `float`, default `None`
+            Maximum number of seconds to wait for a connection.
+            If None wait indefinitely.
+
+        Return
+        ======
+        :acquire: `pyodbc.Connection`
+        """
+
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(
+                f"No connection available within {timeout} seconds.")
+
+        try:
+            while True:
+                try:
+                    conn, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    return open_connection(self._get_connection_string())
+                idle = timeit.default_timer() - last_used
+                if idle <= self.idle_check or self._is_alive(conn):
+                    return conn
+                self._close(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+
+    def release(self, conn, discard=False):
+        """
+        Return a connection to the pool.
+
+        Parameters
+        ==========
+        :param conn: `pyodbc.Connection`
+
+        Optional key-word arguments
+        ===========================
+        :param discard: `bool`, default False
+            If True the connection is closed instead of reused.
+        """
+
+        if discard:
+            self._close(conn)
+        else:
+            self._idle.put((conn, timeit.default_timer()))
+        self._slots.release()
+        return None
+
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Context manager that borrows a connection from the pool.
+        A connection that raised a database error or was interrupted
+        (cancelled or timed out) is not reused.
+        """
+
+        conn = self.acquire(timeout=timeout)
+        discard = False
+        try:
+            yield conn
+        except (pyodbc.Error, QueryInterrupted):
+            discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+
+    @contextmanager
+    def cursor(self, timeout=None):
+        "Context manager that yields a cursor on a pooled connection."
+
+        with self.connection(timeout=timeout) as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+            finally:
+                try:
+                    cursor.close()
+                except pyodbc.Error:
+                    pass
+
+
+    def close(self):
+        "Close all idle connections."
+
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close(conn)
+        return None
+
+
+    def _get_connection_string(self):
+        with self._lock:
+            if self._connection_string is None:
+                self._connection_string = get_connection_string()
+        return self._connection_string
+
+
+    def _is_alive(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.health_check)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except pyodbc.Error:
+            return False
+
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except pyodbc.Error:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    "Return the shared connection pool (created on first use)."
 
-    # log on to database
-    param = f'DSN={creds.dsn};UID={creds.uid};PWD={creds.pwd};CHARSET=UTF8'
-    conn = pyodbc.connect(param)
-    return conn.cursor()
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+            atexit.register(_pool.close)
+    return _pool
@@ -0,0 +1,477 @@
+"""
+This module fetches query records directly into typed column arrays.
+
+Records are fetched in batches. Every batch is converted column by column
+into the final dtype right away: the dtype declared under [columns] in the
+query definition or, if none is declared, a dtype derived from the type code
+in `cursor.description`. The typed batches are joined once all records are
+fetched, so the records never exist as one big object-dtype frame.
+
+Records can also be streamed to a parquet file: every typed batch is
+written as soon as it is fetched, so only one batch is held in memory.
+"""
+
+# standard library
+import datetime
+import decimal
+import os
+import timeit
+from pathlib import Path
+
+# third party
+import numpy as np
+import pandas as pd
+
+
+INT_DTYPES = {'int', 'int64', 'int32', 'int16', 'int8', 'Int64', 'Int32'}
+FLOAT_DTYPES = {'float', 'float64', 'float32'}
+DATETIME_DTYPES = {'datetime', 'datetime64', 'datetime64[ns]'}
+CATEGORY_DTYPES = {'category'}
+
+# batch size when streaming records without a fetch size
+STREAM_FETCH_SIZE = 10000
+
+
+class ColumnBuilder:
+    """
+    ColumnBuilder
+    =============
+    Collects the values of a column batch by batch as object arrays.
+    Dtypes without a specialized builder are cast when the column is
+    finished.
+    """
+
+    def __init__(self, dtype=None):
+        self.dtype  = dtype
+        self.chunks = list()
+
+
+    def append(self, values):
+        self.chunks.append(np.array(values, dtype=object))
+
+
+    def finish(self):
+        array = pd.Series(self._concat(np.object_), dtype=object)
+        if self.dtype is None:
+            return array.infer_objects()
+        return array.astype(self.dtype)
+
+
+    def _concat(self, dtype):
+        if not self.chunks:
+            return np.empty(0, dtype=dtype)
+        array = np.concatenate(self.chunks)
+        self.chunks.clear()
+        return array
+
+
+class IntBuilder(ColumnBuilder):
+    "Integer column. Nulls are kept in a separate mask."
+
+    def __init__(self, dtype=None):
+        super().__init__(dtype)
+        self.masks = list()
+
+
+    def append(self, values):
+        n = len(values)
+        self.masks.append(
+            np.fromiter((v is None for v in values), dtype=bool, count=n))
+        self.chunks.append(
+            np.fromiter(
+                (0 if v is None else v for v in values),
+                dtype=np.int64,
+                count=n,
+            )
+        )
+
+
+    def finish(self):
+        mask = np.concatenate(self.masks) if self.masks else np.empty(0, bool)
+        self.masks.clear()
+        data = self._concat(np.int64)
+
+        if self.dtype in ('Int64', 'Int32'):
+            array = pd.arrays.IntegerArray(data, mask)
+            return pd.Series(array).astype(self.dtype)
+        if not mask.any():
+            if self.dtype is not None:
+                data = data.astype(self.dtype)
+            return pd.Series(data)
+        if self.dtype is None:
+            data = data.astype(np.float64)
+            data[mask] = np.nan
+            return pd.Series(data)
+        raise ValueError(
+            "Cannot convert non-finite values (NA or inf) to integer")
+
+
+class FloatBuilder(ColumnBuilder):
+    "Float column. Nulls become NaN."
+
+    def append(self, values):
+        self.chunks.append(
+            np.fromiter(
+                (np.nan if v is None else v for v in values),
+                dtype=np.float64,
+                count=len(values),
+            )
+        )
+
+
+    def finish(self):
+        data = self._concat(np.float64)
+        if self.dtype not in (None, 'float'):
+            data = data.astype(self.dtype)
+        return pd.Series(data)
+
+
+class DatetimeBuilder(ColumnBuilder):
+    "Datetime column (datetime64[ns], like `astype`). Nulls become NaT."
+
+    def append(self, values):
+        self.chunks.append(
+            pd.to_datetime(pd.Series(values, dtype=object)).values)
+
+
+    def finish(self):
+        # newer pandas versions keep the unit of the parsed values
+        data = self._concat('datetime64[ns]').astype('datetime64[ns]')
+        return pd.Series(data)
+
+
+class CategoryBuilder(ColumnBuilder):
+    "Categorical column. Values are stored as codes into a category lookup."
+
+    def __init__(self, dtype=None):
+        super().__init__(dtype)
+        self.lookup = dict()
+
+
+    def append(self, values):
+        lookup = self.lookup
+        self.chunks.append(
+            np.fromiter(
+                (
+                    -1 if v is None else lookup.setdefault(v, len(lookup))
+                    for v in values
+                ),
+                dtype=np.int32,
+                count=len(values),
+            )
+        )
+
+
+    def finish(self):
+        codes = self._concat(np.int32)
+        categories = list(self.lookup)
+        self.lookup = dict()
+
+        # sort categories like astype('category') does
+        try:
+            order = sorted(range(len(categories)), key=categories.__getitem__)
+        except TypeError:
+            order = list(range(len(categories)))
+        remap = np.empty(len(categories) + 1, dtype=np.int32)
+        remap[-1] = -1
+        remap[np.array(order, dtype=np.int64)] = np.arange(
+            len(categories), dtype=np.int32)
+        categories = [categories[idx] for idx in order]
+        return pd.Series(
+            pd.Categorical.from_codes(remap[codes], categories=categories))
+
+
+def get_builder(dtype=None, type_code=None):
+    """
+    Return column builder for a declared `dtype` or, if no dtype is declared,
+    for the `type_code` from `cursor.description`.
+    """
+
+    if dtype is None:
+        if type_code is int:
+            return IntBuilder()
+        if type_code is float:
+            return FloatBuilder()
+        return ColumnBuilder()
+
+    if dtype in INT_DTYPES:
+        return IntBuilder(dtype)
+    if dtype in FLOAT_DTYPES:
+        return FloatBuilder(dtype)
+    if dtype in DATETIME_DTYPES:
+        return DatetimeBuilder(dtype)
+    if dtype in CATEGORY_DTYPES:
+        return CategoryBuilder(dtype)
+    return ColumnBuilder(dtype)
+
+
+def fetch_typed(
+    cursor,
+    columns,
+    fetch_size,
+    dtypes=None,
+    cancel=None,
+    trace=None,
+):
+    """
+    Fetch records from `cursor` in batches directly into typed columns.
+
+    Parameters
+    ==========
+    :param cursor: `cursor`
+        Cursor on which the sql statement has been executed.
+    :param columns: `list`
+        Column names.
+    :param fetch_size: `int`
+        Number of records to fetch per batch.
+
+    Optional key-word arguments
+    ===========================
+    :param dtypes: `dict`, default `None`
+        Dtype per column name. Columns without a dtype get a dtype based on
+        the type code in `cursor.description`.
+    :param cancel: `Cancellation`, default `None`
+        Token that is checked before every batch.
+    :param trace: `Trace`, default `None`
+        Trace in which the time spent fetching and building is recorded.
+
+    Return
+    ======
+    :pd.DataFrame:
+    """
+
+    type_codes = get_type_codes(cursor, columns)
+    builders = make_builders(columns, type_codes, dtypes)
+
+    timer = timeit.default_timer
+    start = timer()
+    first_row, fetching, building, nrecords = None, 0.0, 0.0, 0
+    while True:
+        if cancel is not None:
+            cancel.check()
+        fetched = timer()
+        rows = cursor.fetchmany(fetch_size)
+        appended = timer()
+        fetching += appended - fetched
+        if first_row is None:
+            first_row = appended - start
+        if not rows:
+            break
+        append_rows(builders, rows)
+        nrecords += len(rows)
+        building += timer() - appended
+        del rows
+
+    built = timer()
+    df = build_frame(builders, columns)
+    building += timer() - built
+
+    if trace is not None:
+        trace.add('first_row', first_row, start=start)
+        trace.add('fetch', fetching, nrows=nrecords, start=start)
+        trace.add(
+            'frame_build', building,
+            nrows=nrecords, nbytes=get_nbytes(df), start=start,
+        )
+    return df
+
+
+def stream_parquet(
+    cursor,
+    columns,
+    fetch_size,
+    path,
+    dtypes=None,
+    cancel=None,
+    trace=None,
+    compression=None,
+):
+    """
+    Fetch records from `cursor` in batches and write every typed batch to
+    the parquet file `path` right away (requires pyarrow). The file is
+    written next to `path` and moved into place when all records are
+    fetched; if fetching fails the partial file is removed.
+
+    Parameters
+    ==========
+    :param cursor: `cursor`
+        Cursor on which the sql statement has been executed.
+    :param columns: `list`
+        Column names.
+    :param fetch_size: `int`
+        Number of records to fetch per batch.
+        If 0 batches of STREAM_FETCH_SIZE records are fetched.
+    :param path: `Path`
+        Path of the parquet file.
+
+    Optional key-word arguments
+    ===========================
+    :param dtypes: `dict`, default `None`
+        Dtype per column name. Columns without a dtype get a dtype based on
+        the type code in `cursor.description`.
+    :param cancel: `Cancellation`, default `None`
+        Token that is checked before every batch.
+    :param trace: `Trace`, default `None`
+        Trace in which the time spent fetching, building and writing is
+        recorded.
+    :param compression: `str`, default `None`
+        Parquet compression codec.
+
+    Return
+    ======
+    :stream_parquet: `int`
+        Number of records written.
+    """
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    type_codes = get_type_codes(cursor, columns)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+
+    timer = timeit.default_timer
+    start = timer()
+    first_row, fetching, building, writing = None, 0.0, 0.0, 0.0
+    nrecords, nbytes, writer = 0, 0, None
+    try:
+        while True:
+            if cancel is not None:
+                cancel.check()
+            fetched = timer()
+            rows = cursor.fetchmany(fetch_size or STREAM_FETCH_SIZE)
+            appended = timer()
+            fetching += appended - fetched
+            if first_row is None:
+                first_row = appended - start
+            # without records an empty batch is written for the schema
+            if not rows and writer is not None:
+                break
+
+            builders = make_builders(columns, type_codes, dtypes)
+            append_rows(builders, rows)
+            df = build_frame(builders, columns)
+            nbytes += get_nbytes(df)
+            if writer is None:
+                schema = get_arrow_schema(df, type_codes, dtypes)
+                writer = pq.ParquetWriter(
+                    str(tmp), schema, compression=compression)
+            table = pa.Table.from_pandas(
+                df, schema=schema, preserve_index=False)
+            written = timer()
+            building += written - appended
+            writer.write_table(table)
+            writing += timer() - written
+            nrecords += len(rows)
+            if not rows:
+                break
+            del rows, df, table
+        writer.close()
+        os.replace(tmp, path)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        if tmp.exists():
+            tmp.unlink()
+        raise
+
+    if trace is not None:
+        trace.add('first_row', first_row, start=start)
+        trace.add('fetch', fetching, nrows=nrecords, start=start)
+        trace.add(
+            'frame_build', building,
+            nrows=nrecords, nbytes=nbytes, start=start,
+        )
+        trace.add(
+            'save', writing,
+            nrows=nrecords, nbytes=path.stat().st_size, start=start,
+        )
+    return nrecords
+
+
+def get_arrow_schema(df, type_codes, dtypes=None):
+    """
+    Return arrow schema for streaming batches like `df` (the first batch).
+    Types that depend on the values in a batch are widened, so every batch
+    fits the schema: integers may hold nulls, categories get 32-bit codes,
+    decimals the maximum precision and columns without values the type of
+    their type code.
+    """
+
+    import pyarrow as pa
+
+    by_type_code = {
+        int: pa.int64(),
+        float: pa.float64(),
+        bool: pa.bool_(),
+        str: pa.string(),
+        bytes: pa.binary(),
+        decimal.Decimal: pa.decimal128(38, 10),
+        datetime.datetime: pa.timestamp('ns'),
+        datetime.date: pa.date32(),
+    }
+    dtypes = dtypes or dict()
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    fields = list()
+    for field, type_code in zip(schema, type_codes):
+        kind = field.type
+        if pa.types.is_dictionary(kind):
+            value = kind.value_type
+            if pa.types.is_null(value):
+                value = by_type_code.get(type_code, pa.string())
+            kind = pa.dictionary(pa.int32(), value)
+        elif pa.types.is_null(kind):
+            kind = by_type_code.get(type_code, pa.string())
+        elif pa.types.is_decimal(kind):
+            kind = pa.decimal128(38, kind.scale)
+        elif type_code is int and field.name not in dtypes:
+            kind = pa.int64()
+        fields.append(pa.field(field.name, kind))
+    return pa.schema(fields, metadata=schema.metadata)
+
+
+def get_type_codes(cursor, columns):
+    "Return type code per column from `cursor.description`."
+
+    type_codes = [column[1] for column in cursor.description or []]
+    type_codes += [None] * (len(columns) - len(type_codes))
+    return type_codes[:len(columns)]
+
+
+def make_builders(columns, type_codes, dtypes=None):
+    "Return a column builder per column."
+
+    dtypes = dtypes or dict()
+    return [
+        get_builder(dtypes.get(col), type_code)
+        for col, type_code in zip(columns, type_codes)
+    ]
+
+
+def append_rows(builders, rows):
+    "Append a batch of rows to the column builders."
+
+    for builder, values in zip(builders, zip(*rows)):
+        builder.append(values)
+    return None
+
+
+def get_nbytes(df):
+    "Return memory usage of `df` in bytes (including the strings)."
+
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def build_frame(builders, columns):
+    "Return DataFrame from the column builders."
+
+    if not builders:
+        return pd.DataFrame()
+    df = pd.concat(
+        [builder.finish() for builder in builders],
+        axis=1,
+        ignore_index=True,
+    )
+    df.columns = columns
+    return df
@@ -0,0 +1,129 @@
+"""
+This module handles incremental (watermark-based) refreshes of stored query
+results.
+
+A query definition can declare an [incremental] section:
+
+    [incremental]
+    column: mutatiedatum
+    key: [studentnummer, collegejaar]
+
+- column: column in the results holding the watermark (e.g. a mutation date
+  or sequence number).
+- key: (optional) column(s) identifying a record. Fetched records replace
+  stored records with the same key. Without a key, records are appended.
+- sql_column: (optional) name of the watermark column in the sql statement,
+  if it differs from the name under [columns].
+
+Only records with a watermark beyond the highest watermark in the stored
+results are fetched. If a key is declared, records with a watermark equal
+to the highest watermark are fetched as well: watermarks such as mutation
+dates are often day-granular, so records changed later on the same day
+would otherwise be missed (the key replaces the refetched records). Records
+that are deleted from the source are not detected; run a full refresh to
+remove them.
+"""
+
+# third party
+import pandas as pd
+
+# local
+from query.results import QueryResult
+
+
+def get_spec(qd):
+    "Return incremental specification of `qd` or None."
+
+    spec = getattr(qd, 'incremental', None)
+    if not spec or not spec.get('column'):
+        return None
+    key = spec.get('key')
+    if key is not None and not isinstance(key, list):
+        key = [key]
+    return {
+        'column': spec['column'],
+        'key': key,
+        'sql_column': spec.get('sql_column') or spec['column'],
+    }
+
+
+def load_stored(qd):
+    """
+    Return stored QueryResult for `qd` if it can be refreshed incrementally.
+    Return None if there are no (usable) stored results.
+    """
+
+    spec = get_spec(qd)
+    if spec is None:
+        return None
+    try:
+        stored = QueryResult.read(name=qd.filename)
+    except FileNotFoundError:
+        return None
+    if stored.frame.empty or spec['column'] not in stored.frame.columns:
+        return None
+    if pd.isna(stored.frame[spec['column']].max()):
+        return None
+    return stored
+
+
+def get_watermark(qd, frame):
+    "Return highest watermark in `frame` as a value that can be bound in sql."
+
+    value = frame[get_spec(qd)['column']].max()
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+def increment_def(qd):
+    """
+    Return copy of `qd` that selects only the records beyond a watermark
+    (or at the watermark if the definition declares a key).
+    The watermark is bound as a parameter ('?') when executing the statement.
+    """
+
+    spec = get_spec(qd)
+    op = '>=' if spec['key'] else '>'
+    return qd.replace(
+        sql=(
+            f"select * from (\n{qd.sql}\n) inc\n"
+            f"where inc.{spec['sql_column']} {op} ?"
+        )
+    )
+
+
+def merge_increment(qd, stored, fetched):
+    """
+    Merge fetched records into the stored frame.
+    Fetched records replace stored records with the same key.
+
+    Parameters
+    ==========
+    :param qd: `QueryDef`
+    :param stored: `DataFrame`
+        Stored query results.
+    :param fetched: `DataFrame`
+        Records fetched beyond the watermark.
+
+    Return
+    ======
+    :merge_increment: `DataFrame`
+    """
+
+    if fetched.empty:
+        return stored
+
+    key = get_spec(qd)['key']
+    df = pd.concat([stored, fetched], ignore_index=True, sort=False)
+    if key:
+        df = df.drop_duplicates(subset=key, keep='last')
+        df = df.reset_index(drop=True)
+
+    if isinstance(qd.columns, dict):
+        dtypes = {k: v for k, v in qd.columns.items() if v is not None}
+        if dtypes:
+            df = df.astype(dtypes)
+    return df
@@ -0,0 +1,244 @@
+"""
+This module offloads the CPU work after fetching to a process pool.
+
+When a set of queries is run in threads, all threads share the GIL for
+building frames, converting dtypes and serializing the results. In offload
+mode the threads only do the network I/O: the fetched batches are kept as
+they are and handed to a worker process, which builds the typed frame,
+compacts, merges and saves the results. Only the meta data of the
+QueryResult is sent back, so the records are serialized once, on their way
+to the worker, and never on their way back.
+
+If the results are saved, the returned QueryResult does not hold the frame;
+it is loaded from storage on first access. Results that are not saved are
+sent back with their frame.
+
+Enable offload mode with `offload = true` under [EXECUTION] in the config or
+per call with `run_query(qd, offload=True)`.
+"""
+
+# standard library
+import threading
+import timeit
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# local
+from query.cache import get_cache
+from query.compaction import get_spec as get_compaction_spec
+from query.config import EXECUTION
+from query.fetch import (
+    get_type_codes, make_builders, append_rows, build_frame, get_nbytes)
+from query.incremental import load_stored, merge_increment
+from query.results import QueryResult
+from query.snapshots import (
+    get_snapshot_store, is_enabled as is_snapshot_enabled)
+from query.tracing import Trace
+
+
+class RawBatches:
+    """
+    RawBatches
+    ==========
+    Fetched records as batches, ready to be sent to a worker process.
+
+    The batches are kept as fetched, so the fetching thread does no work per
+    record. The records are converted to tuples and serialized only once,
+    when the instance is pickled on its way to the worker process.
+
+    Attributes
+    ==========
+    columns: list
+        Column names.
+    type_codes: list
+        Type code per column from `cursor.description`.
+    dtypes: dict
+        Declared dtype per column name.
+    batches: deque
+        Batches of records (lists of rows).
+    nrecords: int
+        Number of records in all batches.
+    """
+
+    def __init__(self, columns, type_codes, dtypes=None):
+        self.columns    = columns
+        self.type_codes = type_codes
+        self.dtypes     = dtypes
+        self.batches    = deque()
+        self.nrecords   = 0
+
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__}, "
+            f"{self.nrecords} records in {len(self.batches)} batches>"
+        )
+
+
+    def __len__(self):
+        return self.nrecords
+
+
+    def __getstate__(self):
+        # rows from the database driver are pickled as plain tuples
+        state = dict(self.__dict__)
+        state['batches'] = deque(
+            [tuple(row) for row in batch] for batch in self.batches)
+        return state
+
+
+    def append(self, rows):
+        "Add a batch of records."
+
+        self.batches.append(rows)
+        self.nrecords += len(rows)
+        return None
+
+
+    def extend(self, other):
+        "Add the batches of another `RawBatches` instance."
+
+        self.batches.extend(other.batches)
+        self.nrecords += other.nrecords
+        return None
+
+
+    def to_frame(self):
+        "Return DataFrame with typed columns from the batches."
+
+        builders = make_builders(self.columns, self.type_codes, self.dtypes)
+        while self.batches:
+            append_rows(builders, self.batches.popleft())
+        return build_frame(builders, self.columns)
+
+
+def fetch_raw(
+    cursor,
+    columns,
+    fetch_size,
+    dtypes=None,
+    cancel=None,
+    trace=None,
+):
+    """
+    Fetch records from `cursor` in batches for a worker process.
+
+    Parameters
+    ==========
+    :param cursor: `cursor`
+        Cursor on which the sql statement has been executed.
+    :param columns: `list`
+        Column names.
+    :param fetch_size: `int`
+        Number of records to fetch per batch.
+        If 0 all records are fetched at once.
+
+    Optional key-word arguments
+    ===========================
+    :param dtypes: `dict`, default `None`
+        Dtype per column name.
+    :param cancel: `Cancellation`, default `None`
+        Token that is checked before every batch.
+    :param trace: `Trace`, default `None`
+        Trace in which the time spent fetching is recorded.
+
+    Return
+    ======
+    :RawBatches:
+    """
+
+    raw = RawBatches(columns, get_type_codes(cursor, columns), dtypes)
+    start = timeit.default_timer()
+    first_row = None
+    if not fetch_size:
+        raw.append(cursor.fetchall())
+    else:
+        while True:
+            if cancel is not None:
+                cancel.check()
+            rows = cursor.fetchmany(fetch_size)
+            if first_row is None:
+                first_row = timeit.default_timer() - start
+            if not rows:
+                break
+            raw.append(rows)
+            del rows
+
+    if trace is not None:
+        seconds = timeit.default_timer() - start
+        if first_row is not None:
+            trace.add('first_row', first_row, start=start)
+        trace.add('fetch', seconds, nrows=raw.nrecords, start=start)
+    return raw
+
+
+def build_result(qd, raw, seconds, save=True, merge=False):
+    """
+    Build, compact, save and cache the QueryResult from fetched batches.
+    Runs in a worker process. If the results are saved, the QueryResult is
+    returned without its frame (the frame is loaded from storage on first
+    access); otherwise the frame is sent back with it. The spans of the
+    phases in the worker are stored on the result (`spans`).
+
+    Parameters
+    ==========
+    :param qd: `QueryDef`
+        Instance of `QueryDef` containing the query definition.
+    :param raw: `RawBatches`
+        Fetched records.
+    :param seconds: `float`
+        Execution time.
+
+    Optional key-word arguments
+    ===========================
+    :param save: `bool`, default True
+        If True the results are saved to disk.
+    :param merge: `bool`, default False
+        If True the records are merged into the stored results
+        (see `query.incremental`).
+
+    Return
+    ======
+    :QueryResult:
+    """
+
+    trace = Trace()
+    with trace.span('frame_build', nrows=raw.nrecords) as span:
+        df = raw.to_frame()
+        span.nbytes = get_nbytes(df)
+    if merge:
+        df = merge_increment(qd, load_stored(qd).frame, df)
+
+    q = QueryResult(qd, df, seconds)
+    if get_compaction_spec(qd) is not None:
+        with trace.span('compaction', nrows=q.nrecords) as span:
+            q.compact()
+            span.nbytes = q.memory_after
+    if save:
+        with trace.span('save', nrows=q.nrecords) as span:
+            q.save()
+            span.nbytes = q.path.stat().st_size
+    if save and is_snapshot_enabled(qd):
+        with trace.span('snapshot', nrows=q.nrecords) as span:
+            span.nbytes = get_snapshot_store().save(q)['written']
+    get_cache().put(q)
+    # saved results are loaded from storage; unsaved results keep the frame
+    if save:
+        q.frame = None
+    q.spans = trace.spans
+    return q
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    "Return the shared process pool (created on first use)."
+
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=EXECUTION.processes or None)
+    return _pool
@@ -0,0 +1,206 @@
+"""
+This module estimates the size of query results before they are fetched
+and picks a strategy for fetching them.
+
+The number of records and the memory usage of the frame are estimated from
+the latest run of the query in the run log ('history') or by counting the
+records with a `count(*)` around the sql statement and measuring a limited
+sample of records ('count'). Based on the estimate one of these strategies is
+picked:
+- memory:      fetch the records into a frame (the default);
+- disk:        the estimate exceeds the memory budget; every fetched batch
+               is written to the parquet file of the results right away
+               and the frame is loaded from this file on first access (see
+               `query.fetch.stream_parquet`). Only one batch is held in
+               memory while fetching;
+- partitioned: the query returns many records; it is split into partitions
+               (`abs(mod(<partition>, <n>)) = <i>`, the last partition
+               takes the remaining records including nulls) that are
+               fetched in parallel (see `QueryDef.chunks`).
+
+A query definition enables the pre-flight estimate with a [preflight]
+section:
+
+    [preflight]
+    method: count
+    memory_budget: 512
+    partition: studentnummer
+
+- method:         'history' (falls back to 'count' without history) or
+                  'count'.
+- memory_budget:  maximum estimated memory usage (MB) of a frame built in
+                  memory.
+- partition_rows: minimum estimated number of records for a partitioned
+                  fetch.
+- partitions:     number of partitions.
+- sample_rows:    number of records measured to estimate the memory usage.
+- partition:      numeric column (or expression) in the sql statement used
+                  to partition the query. Without a partition the query is
+                  never partitioned.
+
+Settings that are not given are taken from [PREFLIGHT] in the config.
+If `enabled` is true in the config, all queries are estimated.
+"""
+
+# third party
+import pyodbc
+
+# local
+from query.config import PREFLIGHT
+from query.fetch import (
+    get_type_codes, make_builders, append_rows, build_frame, get_nbytes)
+from query.runlog import get_runlog
+
+
+MEMORY = 'memory'
+DISK = 'disk'
+PARTITIONED = 'partitioned'
+
+SETTINGS = [
+    'method', 'memory_budget', 'partition_rows', 'partitions', 'sample_rows']
+
+# the sample is limited in the database; tried in order until one works
+SAMPLE_QUERIES = [
+    "select * from (\n{sql}\n) where rownum <= {n}",
+    "select * from (\n{sql}\n) sample fetch first {n} rows only",
+    "select * from (\n{sql}\n) sample limit {n}",
+]
+
+
+def get_spec(qd):
+    """
+    Return pre-flight specification for `qd` or None if the size of the
+    query results should not be estimated.
+    """
+
+    section = getattr(qd, 'preflight', None)
+    enabled = PREFLIGHT.enabled if section is None else True
+    section = dict(section or {})
+    enabled = section.pop('enabled', enabled)
+    if not enabled:
+        return None
+
+    spec = {
+        key: section.pop(key, getattr(PREFLIGHT, key)) for key in SETTINGS
+    }
+    spec['partition'] = section.pop('partition', None) or None
+    if spec['method'] not in ['history', 'count']:
+        raise ValueError(
+            f"Unknown pre-flight method '{spec['method']}'. "
+            "Choose from: ['history', 'count']."
+        )
+    return spec
+
+
+def estimate_history(qd):
+    """
+    Return number of records and memory usage of the frame of the latest
+    run of `qd` in the run log or None if the query has not been run.
+    Runs served from the result cache or streamed to disk are skipped.
+    """
+
+    latest = get_runlog().latest_phase(
+        qd.filename, 'frame_build', exclude=[DISK])
+    if latest is None:
+        return None
+    return {**latest, 'method': 'history'}
+
+
+def estimate_count(cursor, qd, sample_rows):
+    """
+    Return number of records and estimated memory usage of the frame of
+    `qd`. The records are counted in the database; the memory usage is
+    extrapolated from a sample of `sample_rows` records. The sample is
+    limited in the sql statement (`rownum` in Oracle, `fetch first` or
+    `limit` otherwise), so the query is not run in full.
+    """
+
+    sql = qd.sql.rstrip('; \n')
+    cursor.execute(f"select count(*) from (\n{sql}\n)")
+    nrows = int(cursor.fetchone()[0])
+    if not nrows:
+        return {'nrows': 0, 'nbytes': 0, 'method': 'count'}
+
+    for template in SAMPLE_QUERIES:
+        try:
+            cursor.execute(template.format(sql=sql, n=int(sample_rows)))
+            break
+        except pyodbc.Error as e:
+            error = e
+    else:
+        raise error
+    rows = cursor.fetchmany(sample_rows)
+    if isinstance(qd.columns, dict):
+        dtypes = {k: v for k, v in qd.columns.items() if v is not None}
+    else:
+        dtypes = None
+    columns = list(qd.columns or [col[0] for col in cursor.description])
+    builders = make_builders(
+        columns, get_type_codes(cursor, columns), dtypes)
+    append_rows(builders, rows)
+    sample = build_frame(builders, columns)
+
+    nbytes = 0
+    if len(sample):
+        nbytes = int(get_nbytes(sample) / len(sample) * nrows)
+    return {'nrows': nrows, 'nbytes': nbytes, 'method': 'count'}
+
+
+def choose(estimate, spec, save=True):
+    """
+    Return fetch strategy for the estimated size of the query results.
+    Results are only streamed to disk if they are saved and pyarrow is
+    installed, because the frame is read back from the stored parquet file.
+    """
+
+    over_budget = estimate['nbytes'] > spec['memory_budget'] * 2**20
+    if save and over_budget and can_stream():
+        return DISK
+    if spec['partition'] and estimate['nrows'] >= spec['partition_rows']:
+        return PARTITIONED
+    return MEMORY
+
+
+def partition(qd, spec):
+    """
+    Return copy of `qd` split into partitions (see `QueryDef.chunks`).
+    Records are assigned to a partition on `abs(mod(<partition>, <n>))`.
+    The last partition takes all other records (null, fractional), so no
+    records are lost.
+    """
+
+    sql = qd.sql.rstrip('; \n')
+    n = spec['partitions']
+    if n < 2:
+        return qd
+    column = spec['partition']
+    bucket = f"abs(mod({column}, {n}))"
+    others = ', '.join(str(i) for i in range(n - 1))
+    conditions = [f"{bucket} = {i}" for i in range(n - 1)] + [
+        f"{column} is null or {bucket} not in ({others})"]
+    return qd.replace(
+        chunks=[
+            f"select * from (\n{sql}\n) where {condition}"
+            for condition in conditions
+        ]
+    )
+
+
+def can_stream():
+    "Return True if results can be streamed to disk (requires pyarrow)."
+
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return False
+    return True
+
+
+def describe(qd, estimate, strategy):
+    "Return message describing the estimate and chosen strategy."
+
+    size = estimate['nbytes'] / 2**20
+    return (
+        f"Query '{qd.name}' is estimated at {estimate['nrows']} records "
+        f"({size:.1f} MB, {estimate['method']}): fetching {strategy}."
+    )
@@ -1,11 +1,46 @@
 # standard library
 import datetime
+import json
+import operator
+import os
 import pickle
+import re
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # local
-from query.config import PATHS
+from query import compaction
+from query.catalog import get_catalog
+from query.config import PATHS, STORAGE, parse_value
+from query.definition import QueryDef
+from query.diff import diff_frames
+
+
+# status of a QueryResult
+OK = 'ok'
+FAILED = 'failed'
+
+SUFFIXES = {
+    'pickle': '.pkl',
+    'parquet': '.parquet',
+    'feather': '.feather',
+}
+
+# folders in the output folder that do not hold query results
+INTERNAL_FOLDERS = {'_snapshots_'}
+
+# row filters: 'column operator value'
+FILTER = re.compile(r'^\s*(\w+)\s*(==|=|!=|<=|>=|<|>|not in|in)\s*(.+?)\s*$')
+OPERATORS = {
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
 
 
 class QueryResult:
@@ -20,34 +55,210 @@ class QueryResult:
     qd : QueryDef
         Holds the meta data of the query.
     frame : DataFrame
-        Df with the query data.
+        Df with the query data. Results listed from their manifest or
+        streamed to disk load the frame from storage on first access.
     nrecords: int
         Number of records in the query data.
     timer:
         Execution time.
     dtime:
         Execution date and time.
+    status: str
+        'ok', 'failed', 'cancelled' or 'timeout'.
+    error: str
+        Error message if the query did not complete.
+    memory_before: int
+        Memory usage of the frame in bytes before compaction.
+    memory_after: int
+        Memory usage of the frame in bytes after compaction.
+    spans: list
+        Duration of the phases of running the query (see `query.tracing`).
+    strategy: str
+        Fetch strategy chosen by the pre-flight estimate: 'memory', 'disk'
+        or 'partitioned' (None without estimate; see `query.preflight`).
+    path: Path
+        Path to the stored results (None if the results are not stored).
+    cached: bool
+        True if the results were served from the result cache.
 
     Methods
     =======
+    - compact
+    - diff
+    - iter_frames
+    - save
+    - read
+    - from_manifest
+    - from_parquet
     - to_pickle
     - read_pickle
+    - to_parquet
+    - to_feather
+    - fetch_sets
     - view_sets
+    - fetch_queries
     - view_queries
     """
 
-    def __init__(self, qd, frame, seconds=None):
+    def __init__(self, qd, frame, seconds=None, status=OK, error=None):
         self.qd       = qd
         self.frame    = frame
-        self.nrecords = len(frame)
+        self.nrecords = 0 if frame is None else len(frame)
         self.timer    = seconds
         self.dtime    = datetime.datetime.now()
+        self.status   = status
+        self.error    = error
+        self.memory_before = None
+        self.memory_after  = None
+        self.spans         = list()
+        self.strategy      = None
+        self.cached        = False
+        self._path         = None
+
+
+    def __setstate__(self, state):
+        # results pickled before frames were loaded lazily
+        if 'frame' in state:
+            state['_frame'] = state.pop('frame')
+        state.setdefault('_path', None)
+        state.setdefault('spans', list())
+        state.setdefault('strategy', None)
+        state.setdefault('cached', False)
+        self.__dict__.update(state)
+
+
+    @property
+    def path(self):
+        return self._path
+
+
+    @property
+    def frame(self):
+        if self._frame is None and self._path is not None:
+            self._frame = self.read(path=self._path).frame
+        return self._frame
+
+
+    @frame.setter
+    def frame(self, frame):
+        self._frame = frame
 
 
     def __repr__(self):
+        status = getattr(self, 'status', OK)
+        if status != OK:
+            return (
+                f"<{self.__class__.__name__}, '{self.qd.name}', {status}>")
         return f"<{self.__class__.__name__}, '{self.qd.name}', {self.nrecords}>"
 
 
+    def compact(self, spec=None):
+        """
+        Compact the frame in memory and record the memory usage before and
+        after compaction.
+
+        Optional key-word arguments
+        ===========================
+        :param spec: `dict`, default `None`
+            Compaction specification. If None the specification is taken
+            from the query definition (see `query.compaction`).
+        """
+
+        if spec is None:
+            spec = compaction.get_spec(self.qd, force=True)
+        self.memory_before = compaction.memory_usage(self.frame)
+        self.frame = compaction.compact_frame(self.frame, spec)
+        self.memory_after = compaction.memory_usage(self.frame)
+        return None
+
+
+    def diff(self, other, key=None, summary=False):
+        """
+        Return the differences with the results of an earlier run.
+        Records are compared on hashes of their key and values
+        (see `query.diff`).
+
+        Parameters
+        ==========
+        :param other: `QueryResult`
+            Results of an earlier run of the query.
+
+        Optional key-word arguments
+        ===========================
+        :param key: `str` or `list`, default `None`
+            Column(s) identifying a record. If None the key under
+            [incremental] in the query definition is used; without a key
+            complete records are compared.
+        :param summary: `bool`, default False
+            If True only the number of differences is returned.
+
+        Return
+        ======
+        :diff: `Diff`
+        """
+
+        if key is None:
+            incremental = getattr(self.qd, 'incremental', None) or dict()
+            key = incremental.get('key')
+        diff = diff_frames(self.frame, other.frame, key=key, summary=summary)
+        diff.name      = self.qd.name
+        diff.filename  = self.qd.filename
+        diff.dtime_old = other.dtime
+        diff.dtime_new = self.dtime
+        return diff
+
+
+    def iter_frames(self):
+        """
+        Yield the frame in consecutive parts. Results streamed to a parquet
+        file of which the frame is not loaded yet are read one row group at a
+        time; otherwise the frame is yielded as a whole.
+        """
+
+        path = self._path
+        if self._frame is not None or path is None or (
+            path.suffix != SUFFIXES['parquet']
+        ):
+            yield self.frame
+            return
+
+        import pyarrow.parquet as pq
+
+        parquet = pq.ParquetFile(str(path))
+        if not parquet.num_row_groups:
+            yield parquet.read().to_pandas()
+        for idx in range(parquet.num_row_groups):
+            yield parquet.read_row_group(idx).to_pandas()
+
+
+    def save(self, path=None, fmt=None):
+        """
+        Save QueryResult in the storage format set in the config.
+
+        Optional key-word arguments
+        ===========================
+        :param path: `Path`
+            Path to store the QueryResult.
+        :param fmt: `str`, default `None`
+            Storage format: 'pickle', 'parquet' or 'feather'.
+            If None the format from the config is used.
+        """
+
+        if fmt is None:
+            fmt = STORAGE.format
+        if fmt not in SUFFIXES:
+            raise ValueError(
+                f"Unknown storage format '{fmt}'. "
+                f"Choose from: {list(SUFFIXES)}."
+            )
+
+        if fmt == 'pickle':
+            return self.to_pickle(path)
+        if fmt == 'parquet':
+            return self.to_parquet(path)
+        return self.to_feather(path)
+
+
     def to_pickle(self, path=None):
         """
         Save QueryResult to pickle.
@@ -60,13 +271,121 @@ class QueryResult:
 
         if not path:
             path = PATHS.output / f'{self.qd.filename}.pkl'
+        path = Path(path)
 
         # pickle pack
         if not path.parent.exists():
             path.parent.mkdir(parents=True)
+        # load the frame (if not loaded yet) before pickling
+        self.frame = self.frame
+        self._path = path
         with open(path, 'wb') as f:
             pickle.dump(self, f)
+        self.write_manifest(path, 'pickle')
+        return None
+
+
+    def to_parquet(self, path=None):
+        """
+        Save dataframe from the QueryResult as a parquet file.
+        The meta data is stored in a json sidecar next to it.
+
+        Optional key-word arguments
+        ===========================
+        :param path: `Path`
+            Path to store the parquet file.
+        """
+
+        import pyarrow.parquet as pq
+
+        path = self._columnar_path(path, 'parquet')
+        pq.write_table(
+            self._to_arrow(),
+            str(path),
+            compression=STORAGE.compression,
+        )
+        self._path = path
+        self.write_manifest(path, 'parquet')
+        return None
+
+
+    def to_feather(self, path=None):
+        """
+        Save dataframe from the QueryResult as a feather (Arrow IPC) file.
+        The file is stored uncompressed, so it can be memory-mapped on load.
+        The meta data is stored in a json sidecar next to it.
+
+        Optional key-word arguments
+        ===========================
+        :param path: `Path`
+            Path to store the feather file.
+        """
+
+        import pyarrow.feather as feather
+
+        path = self._columnar_path(path, 'feather')
+        feather.write_feather(
+            self._to_arrow(),
+            str(path),
+            compression='uncompressed',
+        )
+        self._path = path
+        self.write_manifest(path, 'feather')
+        return None
+
+
+    def _columnar_path(self, path, fmt):
+        if not path:
+            path = PATHS.output / f'{self.qd.filename}{SUFFIXES[fmt]}'
+        path = Path(path)
+        if not path.parent.exists():
+            path.parent.mkdir(parents=True)
+        return path
+
+
+    def _to_arrow(self):
+        import pyarrow as pa
+        return pa.Table.from_pandas(self.frame, preserve_index=False)
+
+
+    def write_manifest(self, path, fmt, dtypes=None):
+        """
+        Write the manifest of the stored results next to `path`.
+        The manifest holds the meta data of the results, so stored results
+        can be listed and filtered without loading their frames.
+
+        Parameters
+        ==========
+        :param path: `Path`
+            Path to the stored results.
+        :param fmt: `str`
+            Storage format of the stored results.
 
+        Optional key-word arguments
+        ===========================
+        :param dtypes: `Series`, default `None`
+            Dtype per column. If None the dtypes of the frame are used.
+        """
+
+        path = Path(path)
+        if dtypes is None:
+            dtypes = self.frame.dtypes
+        meta = {
+            'format': fmt,
+            'name': self.qd.name,
+            'filename': self.qd.filename,
+            'qtype': self.qd.qtype,
+            'parameters': self.qd.parameters,
+            'nrecords': self.nrecords,
+            'timer': self.timer,
+            'dtime': self.dtime.isoformat(),
+            'status': getattr(self, 'status', OK),
+            'schema': {str(k): str(v) for k, v in dtypes.items()},
+            'size': path.stat().st_size,
+            'qd': self.qd.to_dict(),
+        }
+        with open(path.with_suffix('.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=4, default=str)
         return None
 
 
@@ -116,6 +435,156 @@ class QueryResult:
             return pickle.load(f)
 
 
+    @classmethod
+    def read(
+        cls,
+        name=None,
+        path=None,
+        columns=None,
+        memory_map=False,
+        filters=None,
+    ):
+        """
+        Read QueryResult from storage.
+        The storage format is derived from the suffix of `path`. If no suffix
+        is given, the format set in the config is tried first and then the
+        other formats.
+
+        Parquet and feather files are read column-wise: only the columns in
+        `columns` are loaded from disk. Row filters are applied while reading
+        parquet files, so row groups without matching records are skipped.
+
+        Optional key-word arguments
+        ===========================
+        :param name: `str`
+            Name of the query to be loaded.
+            For example: 'monitor/inschrijfhistorie_2019'
+        :param path: `Path`
+            Path to stored QueryResult.
+        :param columns: `list`, default `None`
+            Columns to load. If None all columns are loaded.
+        :param memory_map: `bool`, default False
+            If True parquet and feather files are memory-mapped.
+        :param filters: `list`, default `None`
+            Row filters that must all hold, either as string
+            ('collegejaar >= 2018') or as tuple ('collegejaar', '>=', 2018).
+            Supported operators: =, ==, !=, <, <=, >, >=, in, not in.
+        """
+
+        if name is not None:
+            path = PATHS.output / f'{name}'
+        elif path is not None:
+            path = Path(path)
+        else:
+            raise ValueError(
+                "Either query name or query path is needed to load query.")
+
+        fmt = find_format(path)
+        path = path.with_suffix(SUFFIXES[fmt])
+        filters = [parse_filter(item) for item in filters or []]
+
+        # columns needed for filtering are read as well
+        read_columns = columns
+        if columns is not None:
+            read_columns = list(columns) + [
+                item[0] for item in filters if item[0] not in columns
+            ]
+
+        if fmt == 'pickle':
+            result = cls.read_pickle(path=path)
+            frame = result.frame
+        else:
+            if fmt == 'parquet':
+                import pyarrow.parquet as pq
+                table = pq.read_table(
+                    str(path),
+                    columns=read_columns,
+                    memory_map=memory_map,
+                    filters=filters or None,
+                )
+            else:
+                import pyarrow.feather as feather
+                table = feather.read_table(
+                    str(path), columns=read_columns, memory_map=memory_map)
+            meta = read_manifest(path)
+            result = cls(QueryDef.from_dict(meta['qd']), None, meta['timer'])
+            result.dtime = datetime.datetime.fromisoformat(meta['dtime'])
+            frame = table.to_pandas()
+            del table
+
+        if filters:
+            frame = apply_filters(frame, filters)
+        if columns is not None:
+            frame = frame[list(columns)]
+        result.frame = frame
+        result.nrecords = len(frame)
+        return result
+
+
+    @classmethod
+    def from_manifest(cls, path):
+        """
+        Return QueryResult from the manifest of stored results.
+        Only the meta data is read; the frame is loaded on first access.
+
+        Parameters
+        ==========
+        :param path: `Path`
+            Path to the manifest or the stored results.
+        """
+
+        meta = read_manifest(path)
+        result = cls(
+            QueryDef.from_dict(meta['qd']),
+            None,
+            meta['timer'],
+            status=meta.get('status', OK),
+        )
+        result.nrecords = meta['nrecords']
+        result.dtime = datetime.datetime.fromisoformat(meta['dtime'])
+        result._path = Path(path).with_suffix(SUFFIXES[meta['format']])
+        return result
+
+
+    @classmethod
+    def from_parquet(cls, qd, path, nrecords, seconds=None):
+        """
+        Return QueryResult for records that were streamed to the parquet
+        file `path` (see `query.fetch.stream_parquet`). The manifest is
+        written next to it and results stored in other formats under the
+        same name are removed. The frame is loaded on first access.
+
+        Parameters
+        ==========
+        :param qd: `QueryDef`
+            Instance of `QueryDef` containing the query definition.
+        :param path: `Path`
+            Path to the parquet file.
+        :param nrecords: `int`
+            Number of records in the parquet file.
+
+        Optional key-word arguments
+        ===========================
+        :param seconds: `float`, default `None`
+            Execution time.
+        """
+
+        import pyarrow.parquet as pq
+
+        path = Path(path)
+        result = cls(qd, None, seconds)
+        result.nrecords = nrecords
+        result._path = path
+        schema = pq.read_schema(str(path))
+        dtypes = schema.empty_table().to_pandas().dtypes
+        result.write_manifest(path, 'parquet', dtypes=dtypes)
+        for suffix in SUFFIXES.values():
+            other = path.with_suffix(suffix)
+            if other != path and other.exists():
+                other.unlink()
+        return result
+
+
     # @staticmethod
     # def view_sets():
     #     """
@@ -145,10 +614,11 @@ class QueryResult:
     @staticmethod
     def fetch_sets():
         """
-        Return available sets in PATHS.output.
+        Return sets with stored results in PATHS.output.
         """
         path = PATHS.output
-        return [item.relative_to(path) for item in path.glob('**')]
+        sets = {item.parent for item in find_manifests(path)}
+        return sorted(item.relative_to(path) for item in sets)
 
 
     @classmethod
@@ -158,35 +628,183 @@ class QueryResult:
 
 
     @classmethod
-    def fetch_queries(cls, queryset):
+    def fetch_queries(cls, queryset='', **filters):
         """
         Return available query results in PATHS.output / queryset.
+        The results are listed from their manifests; frames are loaded on
+        first access.
+
+        Filters are matched against the fields in the manifest (name,
+        filename, qtype, nrecords, dtime, timer, status, format, size). A
+        filter is either a value or a function returning True for values
+        to keep. For example:
+
+        QueryResult.fetch_queries('monitor', nrecords=lambda n: n > 0)
         """
 
-        path = PATHS.output / queryset
-        return [cls.read_pickle(file) for file in path.glob('**/*.pkl')]
+        results = list()
+        for path in find_manifests(PATHS.output / queryset):
+            meta = read_manifest(path)
+            if all(
+                value(meta.get(key)) if callable(value)
+                else meta.get(key) == value
+                for key, value in filters.items()
+            ):
+                results.append(cls.from_manifest(path))
+        return results
 
 
     @classmethod
-    def view_queries(cls, queryset):
-        [print(item.qd.filename) for item in cls.fetch_queries(queryset)]
+    def view_queries(cls, queryset='', **filters):
+        for item in cls.fetch_queries(queryset, **filters):
+            print(
+                f"{item.qd.filename:<50} {item.nrecords:>10} "
+                f"{item.dtime:%Y-%m-%d %H:%M}"
+            )
         return None
 
 
-def load_set(queryset, parameters=None):
+def find_format(path):
+    """
+    Return the storage format of the QueryResult stored at `path`.
+    If `path` has no known suffix, the format from the config is tried first.
+    """
+
+    path = Path(path)
+    for fmt, suffix in SUFFIXES.items():
+        if path.suffix == suffix:
+            return fmt
+
+    formats = [STORAGE.format] + [f for f in SUFFIXES if f != STORAGE.format]
+    for fmt in formats:
+        if path.with_suffix(SUFFIXES[fmt]).exists():
+            return fmt
+    raise FileNotFoundError(f"No stored query results found for '{path}'")
+
+
+def read_manifest(path):
+    "Return the manifest of the results stored at `path` as dictionary."
+
+    with open(Path(path).with_suffix('.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def find_manifests(path):
+    """
+    Return paths to the manifests of all results stored under `path`.
+    Only json files next to stored results ('<name>.json') are read and
+    folders that do not hold query results (e.g. snapshots) are skipped.
+    Pickled results that were stored without a manifest are loaded once to
+    write their manifest.
+    """
+
+    suffixes = set(SUFFIXES.values())
+    manifests = set()
+    for root, folders, files in os.walk(path):
+        folders[:] = [f for f in folders if f not in INTERNAL_FOLDERS]
+        for name in files:
+            item = Path(root) / name
+            manifest = item.with_suffix('.json')
+            if item.suffix not in suffixes or manifest in manifests:
+                continue
+            if not manifest.exists():
+                if item.suffix != SUFFIXES['pickle']:
+                    continue
+                QueryResult.read_pickle(path=item).write_manifest(
+                    item, 'pickle')
+            try:
+                meta = read_manifest(manifest)
+            except (ValueError, UnicodeDecodeError):
+                continue
+            if isinstance(meta, dict) and 'qd' in meta and 'format' in meta:
+                manifests.add(manifest)
+    return sorted(manifests)
+
+
+def parse_filter(value):
+    """
+    Return row filter as (column, operator, value) tuple.
+    Strings like 'collegejaar >= 2018' or "examentype in ('BA', 'MA')" are
+    parsed.
+    """
+
+    if not isinstance(value, str):
+        return tuple(value)
+
+    match = FILTER.match(value)
+    if match is None:
+        raise ValueError(f"Cannot parse filter '{value}'.")
+    column, op, value = match.groups()
+    if op in ('in', 'not in'):
+        value = [parse_literal(v) for v in value.strip('()[]').split(',')]
+    else:
+        value = parse_literal(value)
+    return column, op, value
+
+
+def parse_literal(value):
+    "Return value from a row filter (quoted values are strings)."
+
+    value = value.strip()
+    if len(value) > 1 and value[0] == value[-1] and value[0] in '\'"':
+        return value[1:-1]
+    return parse_value(value)
+
+
+def apply_filters(df, filters):
+    "Return the records in `df` for which all row filters hold."
+
+    mask = None
+    for column, op, value in filters:
+        if op == 'in':
+            selected = df[column].isin(value)
+        elif op == 'not in':
+            selected = ~df[column].isin(value)
+        else:
+            selected = OPERATORS[op](df[column], value)
+        mask = selected if mask is None else mask & selected
+    if mask is None:
+        return df
+    return df[mask].reset_index(drop=True)
+
+
+def load_set(
+    queryset,
+    parameters=None,
+    columns=None,
+    filters=None,
+    as_dict=False,
+    max_workers=None,
+):
     """
-    Load a set of queries as defined in config/queries.json.
+    Load the stored results of a set of queries concurrently.
+
+    Options (`columns` and `filters`) can be given for all results at once
+    or per result as a dictionary with the field names as keys. Options
+    given for all results are only applied to results that contain the
+    column.
 
     Parameters
     ==========
-    :param query_set: `str`
-        Name of the query set as string.
+    :param queryset: `str` or `list`
+        Name of the query set (folder in 'definitions') or a list with
+        names of stored results.
+        For example: ['monitor/inschrijfhistorie_2019', 'monitor/vooropl']
 
     Optional key-word arguments
     ===========================
-    :param parameters: `str` or `list`, default=None
-        Parameters in order for finding the correct name.
+    :param parameters: `dict`, default=None
+        Parameters for finding the filenames of the results in the set.
         See `QueryDef`.
+    :param columns: `list` or `dict`, default=None
+        Columns to load.
+    :param filters: `str`, `list` or `dict`, default=None
+        Row filters applied while reading (see `QueryResult.read`).
+        For example: 'collegejaar >= 2018'.
+    :param as_dict: `bool`, default=False
+        If True a dictionary is returned instead of a namedtuple.
+    :param max_workers: `int`, default=None
+        Maximum number of results loaded at the same time.
 
     Returns
     =======
@@ -194,25 +812,63 @@ def load_set(queryset, parameters=None):
         Namedtuple containing all `DataFrames` in the query set.
     """
 
-    gen = QueryResult.fetch_queries(queryset)
-
-    if isinstance(query_set, list):
-        queries = query_set
-    else:
-        queries = QUERIES[query_set]['queries']
-
-    DataSet = namedtuple('DataSet', [get_name(q) for q in queries])
-
-    if parameters:
-        if not isinstance(parameters, list):
-            parameters = [parameters]
-        parameters = [str(p) for p in parameters]
-
-        return DataSet(
-            **{
-                get_name(q):load_frame(f"{q}_var_{'_'.join(parameters)}")
-                for q in queries
-            }
-        )
+    if isinstance(queryset, str):
+        qds = get_catalog().definitions(queryset)
+        if parameters:
+            qds = [qd.prime(parameters) for qd in qds]
+        names = [qd.filename for qd in qds]
     else:
-        return DataSet(**{get_name(q):load_frame(q) for q in queries})
+        names = list(queryset)
+    fields = [get_name(name) for name in names]
+
+    def get_option(option, field):
+        if isinstance(option, dict):
+            return option.get(field)
+        return option
+
+    def load(name, field):
+        path = PATHS.output / name
+        result_columns = get_option(columns, field)
+        result_filters = get_option(filters, field)
+        if isinstance(result_filters, str):
+            result_filters = [result_filters]
+        if result_filters:
+            result_filters = [parse_filter(item) for item in result_filters]
+
+        schema = get_schema(path)
+        if schema is not None:
+            if result_columns and not isinstance(columns, dict):
+                result_columns = [c for c in result_columns if c in schema]
+            if result_filters and not isinstance(filters, dict):
+                result_filters = [
+                    item for item in result_filters if item[0] in schema
+                ]
+
+        return QueryResult.read(
+            path=path,
+            columns=result_columns or None,
+            filters=result_filters,
+        ).frame
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        frames = list(executor.map(load, names, fields))
+
+    if as_dict:
+        return dict(zip(fields, frames))
+    DataSet = namedtuple('DataSet', fields, rename=True)
+    return DataSet(*frames)
+
+
+def get_name(name):
+    "Return field name for a stored result ('monitor/inschrijvingen_2019')."
+
+    return re.sub(r'\W', '_', Path(name).name)
+
+
+def get_schema(path):
+    "Return the columns of the results stored at `path` from its manifest."
+
+    try:
+        return list(read_manifest(path)['schema'])
+    except (FileNotFoundError, KeyError, ValueError):
+        return None
@@ -0,0 +1,417 @@
+# standard library
+import datetime
+import sqlite3
+import threading
+import uuid
+from pathlib import Path
+
+# third party
+import pandas as pd
+
+# local
+from query.config import PATHS, RUNLOG, SCHEDULER, to_path
+
+
+# column name -> sqlite type
+COLUMNS = {
+    'run_id': 'TEXT',
+    'qtype': 'TEXT',
+    'name': 'TEXT',
+    'filename': 'TEXT',
+    'description': 'TEXT',
+    'sql': 'TEXT',
+    'columns': 'TEXT',
+    'nrecords': 'INTEGER',
+    'timer': 'REAL',
+    'dtime': 'TEXT',
+    'memory_before': 'INTEGER',
+    'memory_after': 'INTEGER',
+    'status': 'TEXT',
+    'error': 'TEXT',
+    'strategy': 'TEXT',
+    'cached': 'INTEGER',
+}
+
+# column name -> sqlite type (spans of the phases of an execution)
+SPAN_COLUMNS = {
+    'run': 'INTEGER',
+    'name': 'TEXT',
+    'start': 'REAL',
+    'seconds': 'REAL',
+    'nrows': 'INTEGER',
+    'nbytes': 'INTEGER',
+}
+
+
+class RunLog:
+    """
+    RunLog
+    ======
+    Append-only log of query executions stored in a SQLite database.
+
+    Every execution is recorded as a separate row, so concurrent runs never
+    overwrite each other. Results served from the result cache are recorded
+    with `cached` set; they do not count as executions for runtime
+    estimates. The log is indexed on filename, name and execution
+    date for fast lookups of the history of a query. The duration of the
+    phases of every execution is recorded in a separate table.
+
+    Attributes
+    ==========
+    path: Path
+        Path to the SQLite database.
+
+    Methods
+    =======
+    - record
+    - history
+    - spans
+    - timers
+    - latest_phase
+    - to_excel
+    - import_excel
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = to_path(RUNLOG.path) if RUNLOG.path else PATHS.output
+            path = path / '_runlog_.sqlite' if path.suffix == '' else path
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._initialized = False
+
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}, '{self.path}'>"
+
+
+    def connect(self):
+        "Return connection to the run log (creating the table if needed)."
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(str(self.path), timeout=RUNLOG.timeout)
+        with self._lock:
+            if not self._initialized:
+                self._create(con)
+                self._initialized = True
+        return con
+
+
+    def record(self, result, run_id=None):
+        """
+        Append the execution of a QueryResult to the log.
+
+        Parameters
+        ==========
+        :param result: `QueryResult`
+
+        Optional key-word arguments
+        ===========================
+        :param run_id: `str`, default `None`
+            Identifier of the run the query was part of.
+        """
+
+        row = get_record(result)
+        row['run_id'] = run_id
+        row = {k: v for k, v in row.items() if k in COLUMNS}
+
+        names = ', '.join(row)
+        markers = ', '.join('?' for _ in row)
+        spans = [
+            [span.name, span.start, span.seconds, span.nrows, span.nbytes]
+            for span in getattr(result, 'spans', [])
+        ]
+
+        con = self.connect()
+        try:
+            with con:
+                cursor = con.execute(
+                    f"insert into runs ({names}) values ({markers})",
+                    list(row.values()),
+                )
+                con.executemany(
+                    "insert into spans (run, name, start, seconds, nrows, "
+                    "nbytes) values (?, ?, ?, ?, ?, ?)",
+                    [[cursor.lastrowid] + span for span in spans],
+                )
+        finally:
+            con.close()
+        return None
+
+
+    def history(self, filename=None, name=None, days=None):
+        """
+        Return logged executions as DataFrame.
+
+        Optional key-word arguments
+        ===========================
+        :param filename: `str`, default `None`
+            Only return executions of queries with this filename.
+        :param name: `str`, default `None`
+            Only return executions of queries with this name.
+        :param days: `int`, default `None`
+            Only return executions of the last number of days.
+
+        Return
+        ======
+        :history: `DataFrame`
+        """
+
+        where, values = self._where(filename, name, days)
+        con = self.connect()
+        try:
+            df = pd.read_sql_query(
+                f"select * from runs {where} order by dtime",
+                con,
+                params=values,
+                index_col='id',
+            )
+        finally:
+            con.close()
+        df['dtime'] = pd.to_datetime(df['dtime'])
+        return df
+
+
+    def spans(self, filename=None, name=None, days=None):
+        """
+        Return the duration of the phases of logged executions as DataFrame.
+        The key-word arguments filter the executions (see `history`).
+
+        Return
+        ======
+        :spans: `DataFrame`
+            One row per phase (`phase`) of an execution (`run`).
+        """
+
+        where, values = self._where(filename, name, days)
+        con = self.connect()
+        try:
+            df = pd.read_sql_query(
+                "select spans.run, runs.filename, runs.name, runs.dtime, "
+                "spans.name as phase, spans.start, spans.seconds, "
+                "spans.nrows, spans.nbytes "
+                f"from spans join runs on spans.run = runs.id {where} "
+                "order by runs.dtime, spans.start",
+                con,
+                params=values,
+            )
+        finally:
+            con.close()
+        df['dtime'] = pd.to_datetime(df['dtime'])
+        return df
+
+
+    def timers(self, filenames=None, window=None):
+        """
+        Return runtimes of the latest executions per filename (oldest
+        first). Only the last `window` runtimes of every query are read, so
+        the cost does not grow with the size of the log. Results served from
+        the result cache are skipped.
+
+        Optional key-word arguments
+        ===========================
+        :param filenames: `list`, default `None`
+            Filenames of the queries. If None all queries in the log.
+        :param window: `int`, default `None`
+            Number of runtimes per query.
+            If None the window from [SCHEDULER] in the config is used.
+
+        Return
+        ======
+        :timers: `dict`
+        """
+
+        if window is None:
+            window = SCHEDULER.window
+        con = self.connect()
+        try:
+            if filenames is None:
+                filenames = [
+                    row[0] for row in
+                    con.execute("select distinct filename from runs")
+                ]
+            timers = dict()
+            for filename in dict.fromkeys(filenames):
+                rows = con.execute(
+                    "select timer from runs "
+                    "where filename = ? and timer is not null "
+                    "and not coalesce(cached, 0) "
+                    "order by dtime desc limit ?",
+                    [filename, int(window)],
+                ).fetchall()
+                if rows:
+                    timers[filename] = [row[0] for row in reversed(rows)]
+        finally:
+            con.close()
+        return timers
+
+
+    def latest_phase(self, filename, phase, exclude=None):
+        """
+        Return the number of records and bytes of `phase` in the latest
+        successful execution of a query that recorded the phase, summed over
+        its spans (e.g. the chunks of a partitioned query). Results served
+        from the result cache are skipped.
+
+        Parameters
+        ==========
+        :param filename: `str`
+            Filename of the query definition.
+        :param phase: `str`
+            Name of the phase (see `query.tracing`).
+
+        Optional key-word arguments
+        ===========================
+        :param exclude: `list`, default `None`
+            Fetch strategies of executions to skip (see `query.preflight`).
+
+        Return
+        ======
+        :latest_phase: `dict`
+            `nrows` and `nbytes`, or None if no execution recorded the phase.
+        """
+
+        exclude = list(exclude or [])
+        markers = ', '.join('?' for _ in exclude)
+        skip = f"and coalesce(runs.strategy, '') not in ({markers}) "
+        con = self.connect()
+        try:
+            row = con.execute(
+                "select runs.id from runs join spans on spans.run = runs.id "
+                "where runs.filename = ? and spans.name = ? "
+                "and runs.status = 'ok' and not coalesce(runs.cached, 0) "
+                + (skip if exclude else '')
+                + "order by runs.dtime desc, runs.id desc limit 1",
+                [filename, phase] + exclude,
+            ).fetchone()
+            if row is None:
+                return None
+            nrows, nbytes = con.execute(
+                "select sum(coalesce(nrows, 0)), sum(coalesce(nbytes, 0)) "
+                "from spans where run = ? and name = ?",
+                [row[0], phase],
+            ).fetchone()
+        finally:
+            con.close()
+        return {'nrows': int(nrows), 'nbytes': int(nbytes)}
+
+
+    def to_excel(self, path=None, **kwargs):
+        """
+        Export the run log to an excel file.
+        Key-word arguments are passed to `history` for filtering.
+
+        Optional key-word arguments
+        ===========================
+        :param path: `Path`
+            Path to store the excel sheet.
+        """
+
+        if not path:
+            path = PATHS.output / '_queries_overview_.xlsx'
+        self.history(**kwargs).to_excel(path)
+        return None
+
+
+    def import_excel(self, path=None):
+        "Import the records from an (old style) excel query overview."
+
+        if not path:
+            path = PATHS.output / '_queries_overview_.xlsx'
+        df = pd.read_excel(path, index_col=0)
+        df = df[[col for col in df.columns if col in COLUMNS]]
+        if 'dtime' in df.columns:
+            df['dtime'] = pd.to_datetime(df['dtime']).map(
+                lambda x: x.isoformat())
+
+        con = self.connect()
+        try:
+            with con:
+                df.to_sql('runs', con, if_exists='append', index=False)
+        finally:
+            con.close()
+        return None
+
+
+    @staticmethod
+    def _where(filename=None, name=None, days=None):
+        "Return where clause and values for filtering executions."
+
+        clauses, values = list(), list()
+        if filename is not None:
+            clauses.append('runs.filename = ?')
+            values.append(filename)
+        if name is not None:
+            clauses.append('runs.name = ?')
+            values.append(name)
+        if days is not None:
+            since = datetime.datetime.now() - datetime.timedelta(days=days)
+            clauses.append('runs.dtime >= ?')
+            values.append(since.isoformat())
+        where = f"where {' and '.join(clauses)}" if clauses else ''
+        return where, values
+
+
+    def _create(self, con):
+        columns = ', '.join(f"{k} {v}" for k, v in COLUMNS.items())
+        with con:
+            con.execute(
+                "create table if not exists runs "
+                f"(id INTEGER PRIMARY KEY AUTOINCREMENT, {columns})"
+            )
+            info = con.execute("pragma table_info(runs)").fetchall()
+            existing = {row[1] for row in info}
+            for column, ctype in COLUMNS.items():
+                if column not in existing:
+                    con.execute(
+                        f"alter table runs add column {column} {ctype}")
+            con.execute(
+                "create index if not exists idx_runs_filename "
+                "on runs (filename, dtime)"
+            )
+            con.execute(
+                "create index if not exists idx_runs_name on runs (name, dtime)")
+            con.execute(
+                "create index if not exists idx_runs_dtime on runs (dtime)")
+
+            columns = ', '.join(f"{k} {v}" for k, v in SPAN_COLUMNS.items())
+            con.execute(
+                "create table if not exists spans "
+                f"(id INTEGER PRIMARY KEY AUTOINCREMENT, {columns})"
+            )
+            con.execute(
+                "create index if not exists idx_spans_run on spans (run)")
+        return None
+
+
+def get_record(result):
+    "Return the meta data of a QueryResult as a flat dictionary."
+
+    data = vars(result.qd).copy()
+    data['columns'] = '|'.join([col for col in data['columns'] or []])
+    data.update(vars(result))
+    for key in ['parameters', 'frame', '_frame', '_path', 'qd', 'spans']:
+        data.pop(key, None)
+    if isinstance(data.get('dtime'), datetime.datetime):
+        data['dtime'] = data['dtime'].isoformat()
+    return data
+
+
+def new_run_id():
+    "Return a unique identifier for a run."
+
+    return uuid.uuid4().hex
+
+
+_runlog = None
+_runlog_lock = threading.Lock()
+
+
+def get_runlog():
+    "Return the shared run log (created on first use)."
+
+    global _runlog
+    with _runlog_lock:
+        if _runlog is None:
+            _runlog = RunLog()
+    return _runlog
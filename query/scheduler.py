@@ -0,0 +1,324 @@
+"""
+This module schedules the execution of a set of queries.
+
+Queries are started in order of priority and, within the same priority,
+longest expected runtime first (LPT scheduling). This keeps a single slow
+query from being started last and stretching the runtime of the whole set.
+The expected runtime is estimated from the runtimes of earlier runs.
+
+Queries can depend on the results of other queries in the set (see
+`QueryDef.depends`). The set is then run as a graph: a query is started as
+soon as the queries it depends on have completed and upstream queries are
+started in order of their longest chain of dependent queries.
+
+At most `SCHEDULER.dsn_limit` queries run on the query database at the same
+time in this process. The limit is shared by `run_scheduled` and the asyncio
+interface (see `query.async_execution`), so sets run through both together
+do not exceed it.
+"""
+
+# standard library
+import functools
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# third party
+import pandas as pd
+
+# local
+from query.cancellation import Cancellation
+from query.config import SCHEDULER
+from query.definition import split_reference
+from query.results import QueryResult, OK, FAILED
+
+
+_dsn_slots = None
+_dsn_slots_lock = threading.Lock()
+
+
+def get_dsn_slots():
+    """
+    Return the semaphore limiting the number of queries running on the
+    query database at the same time (created on first use).
+    """
+
+    global _dsn_slots
+    with _dsn_slots_lock:
+        if _dsn_slots is None:
+            _dsn_slots = threading.BoundedSemaphore(SCHEDULER.dsn_limit)
+    return _dsn_slots
+
+
+def limited(func):
+    "Decorator that runs `func` while holding one of the shared DSN slots."
+
+    @functools.wraps(func)
+    def wrapper_limited(*args, **kwargs):
+        with get_dsn_slots():
+            return func(*args, **kwargs)
+    return wrapper_limited
+
+
+def estimate_costs(qds, history=None):
+    """
+    Return expected runtime in seconds per query definition.
+
+    The estimate is the median runtime of the last `SCHEDULER.window` runs
+    of the query (matched on filename). Queries without history are
+    assumed to be as expensive as the most expensive known query, so they
+    are started early.
+
+    Parameters
+    ==========
+    :param qds: `list`
+        List of `QueryDef` instances.
+
+    Optional key-word arguments
+    ===========================
+    :param history: `dict`, default `None`
+        Runtimes of earlier runs per filename, oldest first.
+
+    Return
+    ======
+    :estimate_costs: `list`
+        Expected runtime per query definition (same order as `qds`).
+    """
+
+    history = history or dict()
+    costs = list()
+    for qd in qds:
+        timers = [t for t in history.get(qd.filename, []) if t is not None]
+        timers = timers[-SCHEDULER.window:]
+        costs.append(statistics.median(timers) if timers else None)
+
+    known = [cost for cost in costs if cost is not None]
+    default = max(known) if known else 0
+    return [default if cost is None else cost for cost in costs]
+
+
+def schedule(qds, history=None):
+    """
+    Return query definitions in the order in which they should be started:
+    highest priority first and within a priority longest runtime first.
+    The runtime of a query includes its longest chain of dependent queries.
+    """
+
+    return [qds[idx] for idx in get_order(qds, history)]
+
+
+def get_order(qds, history=None, upstream=None):
+    "Return indices of `qds` in the order returned by `schedule`."
+
+    if upstream is None:
+        upstream = get_graph(qds)
+    costs = estimate_costs(qds, history)
+
+    # add the cost of the longest chain of downstream queries
+    paths = list(costs)
+    for idx in reversed(sort_graph(upstream)):
+        for up in upstream[idx]:
+            paths[up] = max(paths[up], costs[up] + paths[idx])
+
+    def key(idx):
+        priority = getattr(qds[idx], 'priority', 0) or 0
+        return -priority, -paths[idx]
+
+    return sorted(range(len(qds)), key=key)
+
+
+def get_graph(qds):
+    """
+    Return the dependencies between the query definitions in `qds`.
+    Upstream queries are matched on name (see `QueryDef.depends`).
+
+    Return
+    ======
+    :get_graph: `list`
+        Set of indices of the upstream queries per query definition.
+    """
+
+    names = dict()
+    for idx, qd in enumerate(qds):
+        names.setdefault(qd.name, list()).append(idx)
+
+    upstream = list()
+    for qd in qds:
+        indices = set()
+        for reference in (getattr(qd, 'depends', None) or dict()).values():
+            name, _ = split_reference(reference)
+            if name not in names:
+                raise ValueError(
+                    f"Definition for '{qd.name}' depends on "
+                    f"unknown query '{name}'."
+                )
+            indices.update(names[name])
+        upstream.append(indices)
+    sort_graph(upstream)
+    return upstream
+
+
+def sort_graph(upstream):
+    """
+    Return indices in topological order (upstream before downstream).
+    Raise ValueError if the dependencies contain a cycle.
+    """
+
+    waiting = [len(indices) for indices in upstream]
+    downstream = get_downstream(upstream)
+    order = [idx for idx, n in enumerate(waiting) if n == 0]
+    for idx in order:
+        for down in downstream[idx]:
+            waiting[down] -= 1
+            if waiting[down] == 0:
+                order.append(down)
+    if len(order) < len(upstream):
+        raise ValueError("The dependencies between the queries form a cycle.")
+    return order
+
+
+def get_downstream(upstream):
+    "Return set of indices of the downstream queries per query."
+
+    downstream = [set() for _ in upstream]
+    for idx, indices in enumerate(upstream):
+        for up in indices:
+            downstream[up].add(idx)
+    return downstream
+
+
+def bind(qd, results, names=None):
+    """
+    Return primed copies of `qd` with its dependencies bound to the results
+    of the upstream queries (see `QueryDef.bind`). Upstream queries in
+    `names` without results (e.g. not started because of an empty upstream
+    result) are bound to an empty result.
+    Raise ValueError if an upstream query did not complete.
+    """
+
+    frames = {name: list() for name in names or []}
+    for result in results:
+        if result.status != OK:
+            raise ValueError(
+                f"Upstream query '{result.qd.name}' did not complete.")
+        frames.setdefault(result.qd.name, list()).append(result.frame)
+    return qd.bind(frames)
+
+
+def skipped(qd, error):
+    "Return failed QueryResult for a query that could not be started."
+
+    print(f"Query '{qd.name}' is skipped: {error}")
+    return QueryResult(qd, pd.DataFrame(), status=FAILED, error=str(error))
+
+
+def run_scheduled(
+    qds,
+    func,
+    history=None,
+    max_concurrent=None,
+    cancellations=None,
+):
+    """
+    Run `func` on every query definition in `qds` concurrently.
+    Queries are started in the order returned by `schedule`.
+    Queries that depend on other queries are started as soon as these have
+    completed; if an upstream query fails, its dependent queries are skipped
+    and returned as failed results.
+    Yield the results as they are completed.
+
+    `func` is called with the query definition and a `Cancellation` token
+    (`func(qd, cancel=token)`). If the run is interrupted (e.g. with ctrl+c)
+    all running queries are cancelled and waiting queries are not started.
+
+    Parameters
+    ==========
+    :param qds: `list`
+        List of `QueryDef` instances.
+    :param func: `callable`
+        Function that runs a single query definition.
+
+    Optional key-word arguments
+    ===========================
+    :param history: `dict`, default `None`
+        Runtimes of earlier runs per filename (see `estimate_costs`).
+    :param max_concurrent: `int`, default `None`
+        Maximum number of queries of this set running at the same time.
+        If None the dsn_limit from the config is used. Queries never exceed
+        the shared dsn_limit (see `get_dsn_slots`).
+    :param cancellations: `dict`, default `None`
+        Dictionary that is filled with a `Cancellation` token per query
+        filename. Use it to cancel queries from another thread.
+    """
+
+    if max_concurrent is None:
+        max_concurrent = SCHEDULER.dsn_limit
+    if cancellations is None:
+        cancellations = dict()
+
+    func = limited(func)
+    upstream = get_graph(qds)
+    downstream = get_downstream(upstream)
+    order = get_order(qds, history, upstream)
+    position = {idx: pos for pos, idx in enumerate(order)}
+    waiting = [len(indices) for indices in upstream]
+    results = [list() for _ in qds]
+    running = [0 for _ in qds]
+
+    def complete(idx):
+        "Return downstream queries that are ready to start."
+
+        ready = list()
+        for down in downstream[idx]:
+            waiting[down] -= 1
+            if waiting[down] == 0:
+                ready.append(down)
+        return ready
+
+    with ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+        futures = dict()
+        ready = [idx for idx in order if not upstream[idx]]
+        try:
+            while ready or futures:
+                for idx in sorted(ready, key=position.get):
+                    qd = qds[idx]
+                    copies = [qd]
+                    if upstream[idx]:
+                        names = [qds[up].name for up in upstream[idx]]
+                        inputs = [
+                            r for up in upstream[idx] for r in results[up]]
+                        try:
+                            copies = bind(qd, inputs, names)
+                        except ValueError as e:
+                            result = skipped(qd, e)
+                            results[idx].append(result)
+                            yield result
+                            copies = list()
+                    for copy in copies:
+                        token = cancellations.setdefault(
+                            copy.filename, Cancellation())
+                        future = executor.submit(func, copy, cancel=token)
+                        futures[future] = idx
+                        running[idx] += 1
+                ready = [
+                    down for idx in ready if running[idx] == 0
+                    for down in complete(idx)
+                ]
+                if ready or not futures:
+                    continue
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    idx = futures.pop(future)
+                    result = future.result()
+                    results[idx].append(result)
+                    running[idx] -= 1
+                    if running[idx] == 0:
+                        ready.extend(complete(idx))
+                    yield result
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            for token in cancellations.values():
+                token.cancel()
+            raise
@@ -0,0 +1,483 @@
+"""
+This module keeps a local, searchable catalog of the OSIRIS tables and their
+columns.
+
+The tables and columns are fetched from ALL_TABLES and ALL_TAB_COLUMNS in
+bulk and stored in a SQLite database. Names are indexed with a trigram
+full-text index (SQLite 3.34+), so substring and fuzzy lookups do not need
+to scan all names. On older SQLite versions the catalog falls back to
+`like`-searches.
+
+A refresh is incremental: only the columns of tables that have been created
+or altered (LAST_DDL_TIME in ALL_OBJECTS) since the previous refresh are
+fetched again and dropped tables are removed.
+
+Usage
+=====
+from query.schema import get_schema_catalog
+
+schema = get_schema_catalog()
+schema.refresh()
+schema.tables('INSTELLING')
+schema.columns('BETAALWIJZE', table='OST_INSTELLING')
+"""
+
+# standard library
+import datetime
+import sqlite3
+import threading
+from pathlib import Path
+
+# third party
+import pandas as pd
+
+# local
+from query.config import EXECUTION, PATHS, SCHEMA, to_path
+from query.definition import QueryDef, chunk_list, format_list
+from query.execution import execute, get_pool
+
+
+TABLES_SQL = """
+    select
+        t.owner,
+        t.table_name,
+        t.num_rows,
+        o.last_ddl_time
+    from
+        all_tables t
+        join all_objects o
+            on o.owner = t.owner
+            and o.object_name = t.table_name
+            and o.object_type = 'TABLE'
+    where
+        t.table_name like '{pattern}'"""
+
+COLUMNS_SQL = """
+    select
+        owner,
+        table_name,
+        column_name,
+        data_type,
+        data_length,
+        nullable,
+        column_id
+    from
+        all_tab_columns
+    where
+        {where}"""
+
+# column name -> sqlite type
+TABLE_COLUMNS = {
+    'owner': 'TEXT',
+    'table_name': 'TEXT',
+    'num_rows': 'INTEGER',
+    'last_ddl_time': 'TEXT',
+}
+
+# column name -> sqlite type
+COLUMN_COLUMNS = {
+    'owner': 'TEXT',
+    'table_name': 'TEXT',
+    'column_name': 'TEXT',
+    'data_type': 'TEXT',
+    'data_length': 'INTEGER',
+    'nullable': 'TEXT',
+    'column_id': 'INTEGER',
+}
+
+# index: table -> indexed column
+INDEXED = {
+    'tables': 'table_name',
+    'columns': 'column_name',
+}
+
+
+class SchemaCatalog:
+    """
+    SchemaCatalog
+    =============
+    Local catalog of the tables and columns in the query database.
+
+    Attributes
+    ==========
+    path: Path
+        Path to the SQLite database.
+    pattern: str
+        Pattern (sql like) of the table names in the catalog.
+    trigram: bool
+        True if names are indexed with a trigram full-text index.
+
+    Methods
+    =======
+    - refresh
+    - tables
+    - columns
+    - refreshed
+    """
+
+    def __init__(self, path=None, pattern=None):
+        if path is None:
+            path = (
+                to_path(SCHEMA.path) if SCHEMA.path
+                else PATHS.output / 'systeem' / '_schema_.sqlite'
+            )
+        self.path    = Path(path)
+        self.pattern = SCHEMA.pattern if pattern is None else pattern
+        self.trigram = None
+        self._lock   = threading.Lock()
+        self._con    = None
+
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}, '{self.path}'>"
+
+
+    def connect(self):
+        "Return connection to the catalog (creating the tables if needed)."
+
+        with self._lock:
+            if self._con is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                con = sqlite3.connect(str(self.path), check_same_thread=False)
+                self._create(con)
+                self._con = con
+        return self._con
+
+
+    def close(self):
+        "Close the connection to the catalog."
+
+        with self._lock:
+            if self._con is not None:
+                self._con.close()
+                self._con = None
+        return None
+
+
+    def refresh(self, full=False, cursor=None):
+        """
+        Fetch the tables and columns from the query database.
+
+        Optional key-word arguments
+        ===========================
+        :param full: `bool`, default False
+            If True the columns of all tables are fetched again. Otherwise
+            only those of tables that are new or altered since the previous
+            refresh.
+        :param cursor: `cursor`, default `None`
+            Cursor on the query database.
+            If None a connection is borrowed from the connection pool.
+
+        Return
+        ======
+        :refresh: `dict`
+            Number of tables that were added, changed and removed.
+        """
+
+        if cursor is None:
+            with get_pool().cursor() as cursor:
+                return self.refresh(full=full, cursor=cursor)
+
+        tables = fetch(cursor, TABLES_SQL.format(pattern=self.pattern),
+                       list(TABLE_COLUMNS))
+        tables['last_ddl_time'] = tables['last_ddl_time'].map(to_isoformat)
+        keys = list(zip(tables['owner'], tables['table_name']))
+
+        con = self.connect()
+        with self._lock:
+            stored = dict(
+                ((owner, name), ddl) for owner, name, ddl in con.execute(
+                    "select owner, table_name, last_ddl_time from tables")
+            )
+        removed = set(stored) - set(keys)
+        if full or not stored:
+            changed = set(keys)
+        else:
+            changed = {
+                key for key, ddl in zip(keys, tables['last_ddl_time'])
+                if stored.get(key) != ddl
+            }
+
+        columns = self._fetch_columns(cursor, changed, len(keys))
+        with self._lock, con:
+            delete = [list(key) for key in removed | changed]
+            con.executemany(
+                "delete from columns where owner = ? and table_name = ?",
+                delete)
+            con.executemany(
+                "delete from tables where owner = ? and table_name = ?",
+                delete)
+            tables = tables[[key in changed for key in keys]]
+            insert(con, 'tables', tables.sort_values(['table_name']))
+            insert(
+                con, 'columns',
+                columns.sort_values(['table_name', 'column_id']),
+            )
+            con.execute(
+                "insert or replace into meta (key, value) values (?, ?)",
+                ['refreshed', datetime.datetime.now().isoformat()],
+            )
+        return {
+            'added': len(changed - set(stored)),
+            'changed': len(changed & set(stored)),
+            'removed': len(removed),
+        }
+
+
+    def tables(self, search=None, fuzzy=False, limit=None):
+        """
+        Return tables whose name contains `search` as DataFrame.
+
+        Optional key-word arguments
+        ===========================
+        :param search: `str`, default `None`
+            (Part of) the table name (case-insensitive).
+            If None all tables are returned.
+        :param fuzzy: `bool`, default False
+            If True tables sharing parts of the name with `search` are
+            returned as well, the best matches first.
+        :param limit: `int`, default `None`
+            Maximum number of tables returned.
+
+        Return
+        ======
+        :tables: `DataFrame`
+        """
+
+        return self._search('tables', search, fuzzy, limit)
+
+
+    def columns(self, search=None, table=None, fuzzy=False, limit=None):
+        """
+        Return columns whose name contains `search` as DataFrame.
+
+        Optional key-word arguments
+        ===========================
+        :param search: `str`, default `None`
+            (Part of) the column name (case-insensitive).
+            If None all columns are returned.
+        :param table: `str`, default `None`
+            Only return columns of this table.
+        :param fuzzy: `bool`, default False
+            If True columns sharing parts of the name with `search` are
+            returned as well, the best matches first.
+        :param limit: `int`, default `None`
+            Maximum number of columns returned.
+
+        Return
+        ======
+        :columns: `DataFrame`
+        """
+
+        where = dict() if table is None else {'table_name': table.upper()}
+        return self._search('columns', search, fuzzy, limit, where)
+
+
+    def refreshed(self):
+        "Return date and time of the last refresh (None if never refreshed)."
+
+        row = self.connect().execute(
+            "select value from meta where key = 'refreshed'").fetchone()
+        return None if row is None else datetime.datetime.fromisoformat(row[0])
+
+
+    def _fetch_columns(self, cursor, tables, ntables):
+        "Return columns of `tables` as DataFrame."
+
+        names = list(COLUMN_COLUMNS)
+        if not tables:
+            return pd.DataFrame(columns=names)
+
+        # fetching all columns at once is cheaper than a long list of tables
+        if len(tables) > ntables // 2:
+            where = f"table_name like '{self.pattern}'"
+            df = fetch(cursor, COLUMNS_SQL.format(where=where), names)
+        else:
+            frames = list()
+            chunks = chunk_list(
+                sorted({name for _, name in tables}), EXECUTION.in_list_limit)
+            for chunk in chunks:
+                where = f"table_name in ({format_list(chunk)})"
+                frames.append(
+                    fetch(cursor, COLUMNS_SQL.format(where=where), names))
+            df = pd.concat(frames, ignore_index=True)
+        keys = zip(df['owner'], df['table_name'])
+        return df[[key in tables for key in keys]]
+
+
+    def _search(self, table, search, fuzzy, limit, where=None):
+        "Return records from `table` matching `search` as DataFrame."
+
+        con = self.connect()
+        column = INDEXED[table]
+        order = ['table_name', 'column_id' if table == 'columns' else column]
+        clauses, values = list(), list()
+        for key, value in (where or dict()).items():
+            clauses.append(f"t.{key} = ?")
+            values.append(value)
+
+        # matches are selected in storage order, so the search can stop as
+        # soon as `limit` matches are found; they are sorted afterwards
+        join, sql_order = '', ', '.join(f"t.{name}" for name in order)
+        if search:
+            search = search.upper()
+            grams = trigrams(search)
+            sql_order = 't.rowid'
+            if self.trigram and grams:
+                join = f"join {table}_fts f on f.rowid = t.rowid"
+                sql_order = 'f.rowid'
+                clauses.append(f"{table}_fts match ?")
+                if fuzzy:
+                    values.append(' OR '.join(quote(gram) for gram in grams))
+                    sql_order = 'f.rank'
+                else:
+                    values.append(quote(search))
+            elif not fuzzy:
+                clauses.append(f"instr(upper(t.{column}), ?) > 0")
+                values.append(search)
+
+        names = list(get_columns(table))
+        sql = f"select {', '.join('t.' + name for name in names)} "
+        sql += f"from {table} t {join}"
+        if clauses:
+            sql += f" where {' and '.join(clauses)}"
+        sql += f" order by {sql_order}"
+        # without trigram index fuzzy matches are ranked in pandas
+        ranked = fuzzy and search and not join
+        if limit and not ranked:
+            sql += f" limit {int(limit)}"
+
+        with self._lock:
+            rows = con.execute(sql, values).fetchall()
+        df = pd.DataFrame.from_records(rows, columns=names)
+        if ranked:
+            return fuzzy_sort(df, column, search).head(limit)
+        if search and not fuzzy:
+            df = df.sort_values(order, kind='mergesort').reset_index(drop=True)
+        return df
+
+
+    def _create(self, con):
+        with con:
+            for table in INDEXED:
+                columns = ', '.join(
+                    f"{k} {v}" for k, v in get_columns(table).items())
+                con.execute(f"create table if not exists {table} ({columns})")
+            con.execute(
+                "create index if not exists idx_tables_name "
+                "on tables (table_name, owner)"
+            )
+            con.execute(
+                "create index if not exists idx_columns_table "
+                "on columns (table_name, column_id)"
+            )
+            con.execute(
+                "create table if not exists meta "
+                "(key TEXT PRIMARY KEY, value TEXT)"
+            )
+            self.trigram = self._create_fts(con)
+        return None
+
+
+    @staticmethod
+    def _create_fts(con):
+        """
+        Create trigram indexes kept up to date by triggers.
+        Return False if SQLite does not support the trigram tokenizer.
+        """
+
+        try:
+            for table, column in INDEXED.items():
+                con.execute(
+                    f"create virtual table if not exists {table}_fts "
+                    f"using fts5({column}, content='{table}', "
+                    "content_rowid='rowid', tokenize='trigram')"
+                )
+                con.execute(
+                    f"create trigger if not exists {table}_ai "
+                    f"after insert on {table} begin "
+                    f"insert into {table}_fts (rowid, {column}) "
+                    f"values (new.rowid, new.{column}); end"
+                )
+                con.execute(
+                    f"create trigger if not exists {table}_ad "
+                    f"after delete on {table} begin "
+                    f"insert into {table}_fts ({table}_fts, rowid, {column}) "
+                    f"values ('delete', old.rowid, old.{column}); end"
+                )
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+
+def fetch(cursor, sql, columns):
+    "Return records of `sql` as DataFrame with `columns`."
+
+    qd = QueryDef('schema', 'systeem/schema', sql, columns=columns)
+    return execute(cursor, qd, raise_errors=True)
+
+
+def insert(con, table, df):
+    "Insert records from `df` into `table`."
+
+    names = list(get_columns(table))
+    markers = ', '.join('?' for _ in names)
+    rows = df[names].astype(object).where(df[names].notnull(), None)
+    con.executemany(
+        f"insert into {table} ({', '.join(names)}) values ({markers})",
+        rows.itertuples(index=False, name=None),
+    )
+    return None
+
+
+def get_columns(table):
+    "Return column name -> sqlite type of `table`."
+
+    return TABLE_COLUMNS if table == 'tables' else COLUMN_COLUMNS
+
+
+def to_isoformat(value):
+    "Return date(time) as string in ISO format (None if missing)."
+
+    if value is None or pd.isnull(value):
+        return None
+    if isinstance(value, (datetime.date, pd.Timestamp)):
+        return value.isoformat()
+    return str(value)
+
+
+def trigrams(value):
+    "Return the distinct trigrams in `value` in order of appearance."
+
+    grams = [value[idx:idx + 3] for idx in range(len(value) - 2)]
+    return list(dict.fromkeys(grams))
+
+
+def quote(value):
+    "Return `value` as string literal for a full-text query."
+
+    return '"{}"'.format(value.replace('"', '""'))
+
+
+def fuzzy_sort(df, column, search):
+    "Return `df` sorted on the similarity of `column` to `search`."
+
+    grams = set(trigrams(search)) or {search}
+    score = df[column].map(
+        lambda x: len(grams & set(trigrams(x.upper()))) or int(search in x))
+    order = score[score > 0].sort_values(ascending=False, kind='mergesort')
+    return df.loc[order.index].reset_index(drop=True)
+
+
+_schema = None
+_schema_lock = threading.Lock()
+
+
+def get_schema_catalog():
+    "Return the shared schema catalog (created on first use)."
+
+    global _schema
+    with _schema_lock:
+        if _schema is None:
+            _schema = SchemaCatalog()
+    return _schema
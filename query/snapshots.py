@@ -0,0 +1,518 @@
+"""
+This module stores snapshots of query results with deduplication.
+
+The frame of a result is split into chunks of records. The boundaries of
+the chunks are determined by the content of the records (a record ends a
+chunk if its hash matches a bit mask), so inserting or changing a record
+only affects the chunk it is in. Every chunk is stored once, compressed,
+under the hash of its records. A snapshot is a manifest listing its chunks,
+so storing a snapshot only writes the chunks that changed since earlier
+snapshots of the same query.
+
+Chunks are compressed with zlib, or with zstd or lz4 if the `zstandard` or
+`lz4` package is installed (see [SNAPSHOTS] in the config). Deduplication
+works best if the query returns the records in a stable order.
+
+Layout
+======
+<path>/<filename>/<dtime>.json                  manifest of a snapshot
+<path>/<filename>/objects/<xx>/<hash>.<codec>   compressed chunk
+<path>/<filename>/snapshots.lock                held while saving or pruning
+
+Usage
+=====
+from query.snapshots import get_snapshot_store
+
+store = get_snapshot_store()
+store.save(result)
+store.snapshots('monitor/inschrijvingen')
+result = store.load('monitor/inschrijvingen', '2019-10-01')
+"""
+
+# standard library
+import datetime
+import hashlib
+import itertools
+import json
+import os
+import pickle
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# third party
+import numpy as np
+import pandas as pd
+
+# local
+from query.cache import file_lock
+from query.config import PATHS, SNAPSHOTS, to_path
+from query.definition import QueryDef
+from query.results import QueryResult, OK
+
+
+DTIME_FORMAT = '%Y%m%dT%H%M%S%f'
+# saving a large snapshot can take a while
+LOCK_STALE = 3600
+LOCK_TIMEOUT = 600
+
+
+class SnapshotStore:
+    """
+    SnapshotStore
+    =============
+    Deduplicated, compressed snapshots of query results.
+    Snapshots of a query are saved and pruned while holding a lock file,
+    so pruning never removes chunks of a snapshot that is being saved.
+
+    Attributes
+    ==========
+    path: Path
+        Folder containing the snapshots.
+    codec: str
+        Compression of new chunks: 'zlib', 'zstd' or 'lz4'.
+    chunk_rows: int
+        Average number of records per chunk.
+
+    Methods
+    =======
+    - save
+    - snapshots
+    - load
+    - prune
+    """
+
+    def __init__(self, path=None, codec=None, chunk_rows=None):
+        if path is None:
+            path = (
+                to_path(SNAPSHOTS.path) if SNAPSHOTS.path
+                else PATHS.output / '_snapshots_'
+            )
+        self.path       = Path(path)
+        self.codec      = codec or SNAPSHOTS.compression
+        self.chunk_rows = chunk_rows or SNAPSHOTS.chunk_rows
+
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}, '{self.path}'>"
+
+
+    def save(self, result, max_workers=None):
+        """
+        Store a snapshot of `result`.
+        Only chunks that are not stored yet are compressed and written.
+        Results streamed to disk are read one row group at a time, so their
+        frame is not loaded as a whole (see `QueryResult.iter_frames`).
+
+        Parameters
+        ==========
+        :param result: `QueryResult`
+
+        Optional key-word arguments
+        ===========================
+        :param max_workers: `int`, default `None`
+            Number of threads compressing and writing chunks.
+
+        Return
+        ======
+        :save: `dict`
+            Manifest of the snapshot. `written` holds the number of bytes
+            written and `new` the number of new chunks.
+        """
+
+        folder = self.path / result.qd.filename
+        compress, _ = get_codec(self.codec)
+
+        frames = result.iter_frames()
+        first = next(frames)
+        schema = {str(k): str(v) for k, v in first.dtypes.items()}
+
+        def write(chunk):
+            part, path = chunk
+            if path.exists():
+                return 0
+            data = compress(pickle.dumps(part, protocol=4))
+            write_atomic(path, data)
+            return len(data)
+
+        chunks, written = list(), list()
+        with self._locked(result.qd.filename):
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                parts = itertools.chain([first], frames)
+                for batch in split_frames(parts, self.chunk_rows, schema):
+                    written.extend(executor.map(write, [
+                        (part, get_object_path(folder, digest, self.codec))
+                        for part, digest in batch
+                    ]))
+                    chunks.extend(
+                        [digest, len(part)] for part, digest in batch)
+            meta = {
+                'name': result.qd.name,
+                'filename': result.qd.filename,
+                'dtime': result.dtime.isoformat(),
+                'nrecords': result.nrecords,
+                'timer': result.timer,
+                'status': getattr(result, 'status', OK),
+                'schema': schema,
+                'codec': self.codec,
+                'chunks': chunks,
+                'new': sum(1 for nbytes in written if nbytes),
+                'written': sum(written),
+                'qd': result.qd.to_dict(),
+            }
+            path = folder / f"{result.dtime.strftime(DTIME_FORMAT)}.json"
+            data = json.dumps(meta, indent=4, default=str).encode('utf-8')
+            write_atomic(path, data)
+        return meta
+
+
+    def snapshots(self, filename):
+        """
+        Return the snapshots of a query as DataFrame (oldest first).
+
+        Parameters
+        ==========
+        :param filename: `str`
+            Filename of the query definition.
+
+        Return
+        ======
+        :snapshots: `DataFrame`
+            Date, number of records and chunks, and the number of new chunks
+            and bytes written per snapshot.
+        """
+
+        records = list()
+        for path in self._manifests(filename):
+            meta = read_json(path)
+            records.append({
+                'dtime': datetime.datetime.fromisoformat(meta['dtime']),
+                'nrecords': meta['nrecords'],
+                'chunks': len(meta['chunks']),
+                'new': meta['new'],
+                'written': meta['written'],
+                'status': meta['status'],
+            })
+        columns = ['dtime', 'nrecords', 'chunks', 'new', 'written', 'status']
+        return pd.DataFrame(records, columns=columns)
+
+
+    def load(self, filename, dtime=None, max_workers=None):
+        """
+        Return QueryResult as it was stored at `dtime`.
+
+        Parameters
+        ==========
+        :param filename: `str`
+            Filename of the query definition.
+
+        Optional key-word arguments
+        ===========================
+        :param dtime: `datetime`, `date` or `str`, default `None`
+            Latest snapshot at or before this moment is returned. A date
+            includes all snapshots of that day. If None the latest snapshot
+            is returned.
+        :param max_workers: `int`, default `None`
+            Number of threads reading chunks.
+
+        Return
+        ======
+        :load: `QueryResult`
+        """
+
+        manifests = self._manifests(filename)
+        if dtime is not None:
+            moment = to_datetime(dtime).strftime(DTIME_FORMAT)
+            manifests = [p for p in manifests if p.stem <= moment]
+        if not manifests:
+            raise FileNotFoundError(
+                f"No snapshot of '{filename}' found"
+                + ('' if dtime is None else f" at or before {dtime}")
+            )
+
+        meta = read_json(manifests[-1])
+        folder = self.path / filename
+        _, decompress = get_codec(meta['codec'])
+
+        def read(chunk):
+            path = get_object_path(folder, chunk[0], meta['codec'])
+            with open(path, 'rb') as f:
+                return pickle.loads(decompress(f.read()))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            parts = list(executor.map(read, meta['chunks']))
+        frame = join_chunks(parts, meta['schema'])
+
+        result = QueryResult(
+            QueryDef.from_dict(meta['qd']),
+            frame,
+            meta['timer'],
+            status=meta['status'],
+        )
+        result.dtime = datetime.datetime.fromisoformat(meta['dtime'])
+        return result
+
+
+    def prune(self, filename, before=None, keep=None):
+        """
+        Remove snapshots of a query and the chunks no longer used.
+        At least one of `before` and `keep` is required.
+
+        Parameters
+        ==========
+        :param filename: `str`
+            Filename of the query definition.
+
+        Optional key-word arguments
+        ===========================
+        :param before: `datetime`, `date` or `str`, default `None`
+            Remove snapshots made before this moment.
+        :param keep: `int`, default `None`
+            Number of most recent snapshots that are never removed.
+
+        Return
+        ======
+        :prune: `int`
+            Number of bytes freed.
+        """
+
+        if before is None and keep is None:
+            raise ValueError(
+                "Pass `before` and/or `keep` to prune snapshots; "
+                "prune never removes all snapshots by default."
+            )
+
+        freed = 0
+        with self._locked(filename):
+            manifests = self._manifests(filename)
+            removable = manifests[:-keep] if keep else list(manifests)
+            if before is not None:
+                moment = to_datetime(before, end=False).strftime(DTIME_FORMAT)
+                removable = [p for p in removable if p.stem < moment]
+            for path in removable:
+                freed += path.stat().st_size
+                path.unlink()
+            used = {
+                get_object_path(self.path / filename, digest, meta['codec'])
+                for meta in map(read_json, self._manifests(filename))
+                for digest, _ in meta['chunks']
+            }
+            objects = self.path / filename / 'objects'
+            for path in objects.glob('*/*'):
+                if path not in used:
+                    freed += path.stat().st_size
+                    path.unlink()
+        return freed
+
+
+    def _locked(self, filename):
+        "Hold the lock on the snapshots of a query."
+
+        return file_lock(
+            self.path / filename / 'snapshots.lock',
+            timeout=LOCK_TIMEOUT,
+            stale=LOCK_STALE,
+        )
+
+
+    def _manifests(self, filename):
+        "Return paths to the manifests of a query (oldest first)."
+
+        folder = self.path / filename
+        if not folder.exists():
+            return list()
+        return sorted(folder.glob('*.json'))
+
+
+def split_frame(frame, chunk_rows, schema=None, final=True):
+    """
+    Split `frame` into chunks of records with content-defined boundaries.
+    A record ends a chunk if the lowest bits of its hash are zero, so the
+    chunks have on average `chunk_rows` records. Chunks are at least a
+    quarter and at most four times as long.
+
+    Parameters
+    ==========
+    :param frame: `DataFrame`
+    :param chunk_rows: `int`
+        Average number of records per chunk.
+
+    Optional key-word arguments
+    ===========================
+    :param schema: `dict`, default `None`
+        Column name -> dtype; part of the hash of every chunk.
+    :param final: `bool`, default True
+        If False `frame` is followed by more records: the records after the
+        last boundary are left out of the chunks (see `split_frames`).
+
+    Return
+    ======
+    :split_frame: `list`
+        Start, stop and hash (hex) of every chunk.
+    """
+
+    nrows = len(frame)
+    if not nrows:
+        return list()
+    hashes = pd.util.hash_pandas_object(frame, index=False).values
+    mask = np.uint64(2 ** max(int(np.log2(chunk_rows)), 0) - 1)
+    candidates = np.flatnonzero((hashes & mask) == 0) + 1
+    smallest, largest = max(chunk_rows // 4, 1), chunk_rows * 4
+
+    bounds, start = list(), 0
+    for stop in list(candidates) + ([nrows] if final else []):
+        while stop - start > largest:
+            start += largest
+            bounds.append(start)
+        if stop > start and (
+            stop - start >= smallest or (final and stop == nrows)
+        ):
+            bounds.append(stop)
+            start = stop
+
+    prefix = json.dumps(schema or dict(), sort_keys=True).encode('utf-8')
+    chunks, start = list(), 0
+    for stop in bounds:
+        digest = hashlib.blake2b(prefix, digest_size=20)
+        digest.update(hashes[start:stop].tobytes())
+        chunks.append((start, stop, digest.hexdigest()))
+        start = stop
+    return chunks
+
+
+def split_frames(frames, chunk_rows, schema=None):
+    """
+    Split the consecutive parts of a frame into chunks (see `split_frame`).
+    The records after the last boundary of a part are carried over to the
+    next part, so the chunks are the same as for the complete frame while
+    only one part is held in memory.
+
+    Parameters
+    ==========
+    :param frames: iterable of `DataFrame`
+    :param chunk_rows: `int`
+        Average number of records per chunk.
+
+    Optional key-word arguments
+    ===========================
+    :param schema: `dict`, default `None`
+        Column name -> dtype; part of the hash of every chunk.
+
+    Return
+    ======
+    :split_frames: generator
+        List of chunks (records and hash) per part.
+    """
+
+    frames = iter(frames)
+    frame, rest = next(frames, None), None
+    while frame is not None:
+        following = next(frames, None)
+        if rest is not None and len(rest):
+            frame = pd.concat([rest, frame], ignore_index=True)
+        final = following is None
+        chunks = split_frame(frame, chunk_rows, schema, final=final)
+        yield [
+            (frame.iloc[start:stop], digest)
+            for start, stop, digest in chunks
+        ]
+        rest = frame.iloc[chunks[-1][1] if chunks else 0:]
+        frame = following
+
+
+def join_chunks(parts, schema):
+    "Return frame from chunks with the dtypes of `schema` restored."
+
+    if not parts:
+        return pd.DataFrame({
+            col: pd.Series([], dtype=dtype) for col, dtype in schema.items()
+        })
+    frame = pd.concat(parts, ignore_index=True)
+    # chunks with different categories are concatenated as object
+    categories = {
+        col: 'category' for col, dtype in schema.items()
+        if dtype == 'category' and str(frame[col].dtype) != 'category'
+    }
+    return frame.astype(categories) if categories else frame
+
+
+def get_codec(name):
+    "Return compress and decompress function of codec `name`."
+
+    if name == 'zlib':
+        return zlib.compress, zlib.decompress
+    if name == 'zstd':
+        import zstandard
+        return (
+            lambda data: zstandard.ZstdCompressor().compress(data),
+            lambda data: zstandard.ZstdDecompressor().decompress(data),
+        )
+    if name == 'lz4':
+        import lz4.frame
+        return lz4.frame.compress, lz4.frame.decompress
+    raise ValueError(f"Unknown compression '{name}'; use zlib, zstd or lz4.")
+
+
+def get_object_path(folder, digest, codec):
+    "Return path to the chunk with hash `digest`."
+
+    return Path(folder) / 'objects' / digest[:2] / f'{digest}.{codec}'
+
+
+def write_atomic(path, data):
+    "Write `data` to `path`, so readers never see a partial file."
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(
+        f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return None
+
+
+def read_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def to_datetime(value, end=True):
+    """
+    Return `value` as datetime. A date (without time) is the end of that
+    day if `end` is True, otherwise the start.
+    """
+
+    if isinstance(value, str):
+        value = value.strip()
+        if len(value) == 10:
+            value = datetime.date.fromisoformat(value)
+        else:
+            value = datetime.datetime.fromisoformat(value)
+    if isinstance(value, pd.Timestamp):
+        value = value.to_pydatetime()
+    if not isinstance(value, datetime.datetime):
+        time = datetime.time.max if end else datetime.time.min
+        value = datetime.datetime.combine(value, time)
+    return value
+
+
+def is_enabled(qd):
+    "Return True if snapshots are stored for query definition `qd`."
+
+    snapshot = getattr(qd, 'snapshot', None)
+    return SNAPSHOTS.enabled if snapshot is None else bool(snapshot)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_snapshot_store():
+    "Return the shared snapshot store (created on first use)."
+
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SnapshotStore()
+    return _store
@@ -0,0 +1,135 @@
+"""
+This module compiles the parameter templates used in query definitions.
+
+A template is a string with placeholders between square brackets:
+- [param]       value of the parameter
+- [param+n]     value of the parameter plus n (integer arithmetic)
+- [param-n]     value of the parameter minus n (integer arithmetic)
+- [param(a:b)]  slice of the value of the parameter
+
+Parameter names consist of letters, digits and underscores. Unlike the
+former string replacement, placeholders with other characters in the name
+(such as [year-code] or [year.start]) are not recognised.
+
+A template is parsed once into literal segments and placeholder nodes.
+Rendering is a single pass over these segments. Placeholders that refer to
+parameters that are not given are left untouched.
+"""
+
+# standard library
+import re
+from collections import namedtuple
+
+
+PLACEHOLDER = re.compile(
+    r'\[(?P<key>\w+)'
+    r'(?:(?P<op>[+-])(?P<n>\d+)|\((?P<start>-?\d*):(?P<stop>-?\d*)\))?\]'
+)
+
+
+Placeholder = namedtuple('Placeholder', ['key', 'op', 'n', 'slice', 'raw'])
+
+
+class Template:
+    """
+    Template
+    ========
+    Compiled parameter template.
+
+    Attributes
+    ==========
+    text: str
+        Template string.
+    segments: tuple
+        Literal strings and `Placeholder` nodes in order of appearance.
+    keys: set
+        Names of the parameters used in the template.
+    """
+
+    def __init__(self, text):
+        self.text     = text
+        self.segments = tuple(parse(text))
+        self.keys     = {
+            seg.key for seg in self.segments if isinstance(seg, Placeholder)
+        }
+
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}, {self.text!r}>"
+
+
+    def __copy__(self):
+        # compiled templates are immutable, so copies can share them
+        return self
+
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+    def render(self, parameters):
+        "Return template with the placeholders replaced by `parameters`."
+
+        parts = list()
+        for seg in self.segments:
+            if not isinstance(seg, Placeholder):
+                parts.append(seg)
+            elif seg.key not in parameters:
+                parts.append(seg.raw)
+            else:
+                parts.append(render_placeholder(seg, parameters[seg.key]))
+        return ''.join(parts)
+
+
+def parse(text):
+    "Split template `text` into literal strings and `Placeholder` nodes."
+
+    segments = list()
+    pos = 0
+    for match in PLACEHOLDER.finditer(text):
+        if match.start() > pos:
+            segments.append(text[pos:match.start()])
+
+        slice_ = None
+        if match.group('start') is not None:
+            start, stop = match.group('start'), match.group('stop')
+            slice_ = slice(
+                int(start) if start else None,
+                int(stop) if stop else None,
+            )
+        segments.append(
+            Placeholder(
+                key=match.group('key'),
+                op=match.group('op'),
+                n=int(match.group('n')) if match.group('n') else None,
+                slice=slice_,
+                raw=match.group(0),
+            )
+        )
+        pos = match.end()
+
+    if pos < len(text):
+        segments.append(text[pos:])
+    return segments
+
+
+def render_placeholder(placeholder, value):
+    "Return value for a single placeholder."
+
+    if placeholder.op == '+':
+        return str(int(value) + placeholder.n)
+    if placeholder.op == '-':
+        return str(int(value) - placeholder.n)
+    if placeholder.slice is not None:
+        return str(value)[placeholder.slice]
+    return str(value)
+
+
+def compile_template(text):
+    """
+    Return compiled `Template` for `text`.
+    Query definitions store their compiled templates
+    (see `QueryDef.compile_templates`).
+    """
+
+    return Template(text)
@@ -0,0 +1,326 @@
+"""
+This module records how long the phases of running a query take.
+
+Every query run collects a trace of spans:
+- cache: lookup in the result cache;
+- preflight: estimating the size of the results (see `query.preflight`);
+- connect: borrowing or opening a connection;
+- execute: executing the sql statement;
+- first_row: waiting for the first batch of records (part of fetch);
+- fetch: fetching the records;
+- frame_build: building the DataFrame;
+- cast: casting the declared dtypes;
+- compaction: compacting the frame;
+- save: writing the results to disk;
+- snapshot: storing a snapshot of the results (see `query.snapshots`).
+
+Each span holds its duration and, where known, a row and byte count. The
+spans are stored on the QueryResult (`spans`), written to the run log and
+emitted to the configured sinks (see [TRACING] in the config). Sinks are
+pluggable: any object with an `emit(result)` method can be added with
+`add_sink`.
+"""
+
+# standard library
+import functools
+import json
+import os
+import threading
+import timeit
+from contextlib import contextmanager
+from pathlib import Path
+
+# local
+from query.cache import file_lock
+from query.config import TRACING, to_path
+
+
+class Span:
+    """
+    Span
+    ====
+    Duration of a single phase of running a query.
+
+    Attributes
+    ==========
+    name: str
+        Name of the phase.
+    start: float
+        Seconds between the start of the trace and the start of the phase.
+    seconds: float
+        Duration of the phase.
+    nrows: int
+        Number of records processed in the phase (None if not applicable).
+    nbytes: int
+        Number of bytes processed in the phase (None if not applicable).
+    """
+
+    def __init__(self, name, start, seconds=None, nrows=None, nbytes=None):
+        self.name    = name
+        self.start   = start
+        self.seconds = seconds
+        self.nrows   = nrows
+        self.nbytes  = nbytes
+
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}, '{self.name}', {self.seconds}>"
+
+
+    def to_dict(self):
+        return vars(self).copy()
+
+
+class Trace:
+    """
+    Trace
+    =====
+    Collects the spans of a query run.
+
+    Usage
+    =====
+    with trace.span('execute'):
+        cursor.execute(sql)
+
+    trace.add('fetch', seconds, nrows=nrecords)
+
+    Attributes
+    ==========
+    spans: list
+        List of `Span` instances in the order they were completed.
+    """
+
+    def __init__(self):
+        self.spans  = list()
+        self._start = timeit.default_timer()
+
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}, {len(self.spans)} spans>"
+
+
+    @contextmanager
+    def span(self, name, nrows=None, nbytes=None):
+        "Context manager that records the duration of the block as a span."
+
+        start = timeit.default_timer()
+        span = Span(name, start - self._start, nrows=nrows, nbytes=nbytes)
+        try:
+            yield span
+        finally:
+            span.seconds = timeit.default_timer() - start
+            self.spans.append(span)
+
+
+    def add(self, name, seconds, nrows=None, nbytes=None, start=None):
+        """
+        Add a span that has been timed by the caller.
+        If `start` (timer value) is None the span is assumed to have ended
+        just now.
+        """
+
+        if start is None:
+            start = timeit.default_timer() - seconds
+        span = Span(name, start - self._start, seconds, nrows, nbytes)
+        self.spans.append(span)
+        return span
+
+
+    def extend(self, spans, start=None):
+        """
+        Add spans recorded elsewhere (for example in a worker process).
+        If `start` (timer value) is given, the spans are moved as if their
+        trace started at `start`.
+        """
+
+        offset = 0.0 if start is None else start - self._start
+        for span in spans or []:
+            span.start += offset
+            self.spans.append(span)
+        return None
+
+
+def traced(func):
+    """
+    Decorator for running a query with a trace.
+    A new trace is passed to `func` as key-word argument `trace`. The spans
+    are stored on the returned QueryResult and emitted to the sinks.
+    """
+
+    @functools.wraps(func)
+    def wrapper_traced(*args, **kwargs):
+        trace = kwargs.get('trace')
+        if trace is None:
+            trace = kwargs['trace'] = Trace()
+        result = func(*args, **kwargs)
+        result.spans = trace.spans
+        emit(result)
+        return result
+    return wrapper_traced
+
+
+class ConsoleSink:
+    "Print a summary of every query run."
+
+    def emit(self, result):
+        total = max(
+            (span.start + span.seconds for span in result.spans), default=0)
+        phases = ', '.join(
+            f"{span.name} {span.seconds:.2f}" for span in result.spans)
+        print(f"Query '{result.qd.name}' returned {result!r} in "
+              f"{round(total, 2)} seconds ({phases})")
+        return None
+
+
+class JsonLinesSink:
+    "Append every query run with its spans as a line of JSON to a file."
+
+    def __init__(self, path):
+        self.path  = Path(path)
+        self._lock = threading.Lock()
+
+
+    def emit(self, result):
+        line = json.dumps({
+            'dtime': result.dtime.isoformat(),
+            'name': result.qd.name,
+            'filename': result.qd.filename,
+            'status': result.status,
+            'nrecords': result.nrecords,
+            'timer': result.timer,
+            'spans': [span.to_dict() for span in result.spans],
+        })
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        return None
+
+
+class PrometheusSink:
+    """
+    Write the spans of the latest run of every query to a file in the
+    Prometheus text format (for the textfile collector of node exporter).
+
+    Every run replaces all samples of its query, so phases of earlier runs
+    do not linger. The file is merged under a lock file, so processes
+    writing to the same file keep each other's queries.
+    """
+
+    METRICS = {
+        'seconds': ('osiris_query_phase_seconds', 'Duration of the phase.'),
+        'nrows': ('osiris_query_phase_rows', 'Records in the phase.'),
+        'nbytes': ('osiris_query_phase_bytes', 'Bytes in the phase.'),
+    }
+
+    def __init__(self, path):
+        self.path  = Path(path)
+        self._lock = threading.Lock()
+
+
+    def emit(self, result):
+        label = f'query="{escape_label(result.qd.filename)}"'
+        samples = {metric: list() for metric, _ in self.METRICS.values()}
+        for attr, (metric, _) in self.METRICS.items():
+            for span in result.spans:
+                value = getattr(span, attr)
+                if value is not None:
+                    samples[metric].append(
+                        f'{metric}{{{label},phase="{span.name}"}} {value}')
+
+        lock = self.path.with_name(f'{self.path.name}.lock')
+        with self._lock, file_lock(lock):
+            for metric, lines in self._read().items():
+                samples.setdefault(metric, list())
+                samples[metric] = [
+                    line for line in lines if f'{{{label},' not in line
+                ] + samples[metric]
+            self._write(samples)
+        return None
+
+
+    def _read(self):
+        "Return the samples in the file per metric."
+
+        samples = dict()
+        if not self.path.exists():
+            return samples
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f.read().splitlines():
+                if line and not line.startswith('#'):
+                    metric = line.split('{', 1)[0]
+                    samples.setdefault(metric, list()).append(line)
+        return samples
+
+
+    def _write(self, samples):
+        descriptions = dict(self.METRICS.values())
+        lines = list()
+        for metric, values in samples.items():
+            lines.append(f"# HELP {metric} {descriptions.get(metric, '')}")
+            lines.append(f"# TYPE {metric} gauge")
+            lines.extend(sorted(values))
+
+        # write atomically, so the collector never reads a partial file
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, self.path)
+        return None
+
+
+def escape_label(value):
+    "Return value escaped for use as label value in the Prometheus format."
+
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
+
+
+_sinks = None
+_sinks_lock = threading.Lock()
+
+
+def get_sinks():
+    "Return the sinks (created from the config on first use)."
+
+    global _sinks
+    with _sinks_lock:
+        if _sinks is None:
+            _sinks = list()
+            if TRACING.console:
+                _sinks.append(ConsoleSink())
+            if TRACING.jsonl:
+                _sinks.append(JsonLinesSink(to_path(TRACING.jsonl)))
+            if TRACING.prometheus:
+                _sinks.append(PrometheusSink(to_path(TRACING.prometheus)))
+    return _sinks
+
+
+def add_sink(sink):
+    "Add a sink; `sink` needs an `emit(result)` method."
+
+    get_sinks().append(sink)
+    return None
+
+
+def remove_sink(sink):
+    "Remove a sink."
+
+    get_sinks().remove(sink)
+    return None
+
+
+def emit(result):
+    "Emit the spans of a QueryResult to all sinks."
+
+    for sink in list(get_sinks()):
+        try:
+            sink.emit(result)
+        except Exception as e:
+            print(f"Could not emit trace to {sink!r}: {e}")
+    return None
@@ -1,24 +1,8 @@
-import timeit
-import functools
 from configparser import ConfigParser
 from pathlib import Path
 from collections import namedtuple
 
 
-def reporter(func):
-    @functools.wraps(func)
-    def wrapper_reporter(*args, **kwargs):
-        start = timeit.default_timer()
-        value = func(*args, **kwargs)
-        stop = timeit.default_timer()
-        sec = stop - start
-        print(
-            f"{func.__name__!r} returned {value!r} in {round(sec, 2)} seconds"
-        )
-        return value
-    return wrapper_reporter
-
-
 def getpw(path):
     # get login details
     path = Path(path)
@@ -70,15 +54,16 @@ def studnum_to_string(
     :studnum_to_string: `str`
     """
 
-    string = ''
+    parts = list()
     studentnummers = df[colname].to_list()
     if as_set:
         studentnummers = set(studentnummers)
     for idx, studentnummer in enumerate(studentnummers):
         if ((idx + 1) % 500):
-            string += f"{studentnummer};"
+            parts.append(f"{studentnummer};")
         else:
-            string += f"{studentnummer}\n\n"
+            parts.append(f"{studentnummer}\n\n")
+    string = ''.join(parts)
 
     if print_strings:
         print(string)
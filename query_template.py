@@ -4,7 +4,7 @@ start = timeit.default_timer()
 import argparse
 
 #local
-from query.query import connect, run_query
+from query.execution import get_pool, run_query
 
 
 QUERIES = [
@@ -22,12 +22,11 @@ def run():
     arg = parser.parse_args()
     parameters = vars(arg)
 
-    # CONNECT TO DATABASE
-    cursor = connect()
-
-    # RUN QUERIES
-    for query in QUERIES:
-        run_query(query, cursor=cursor, parameters=parameters)
+    # BORROW CONNECTION FROM POOL AND RUN QUERIES
+    with get_pool().cursor() as cursor:
+        for query in QUERIES:
+            query(parameters)
+            run_query(query, cursor=cursor)
 
     # STOP TIMER AND PRINT RUNTIME
     stop = timeit.default_timer()
@@ -3,15 +3,13 @@ import sys
 import timeit
 from textwrap import wrap, indent
 from os import system, name
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-# third party
-import pandas as pd
 
 #local
-from query.config import PATHS
-from query.definition import QueryDef
-from query.execution import connect, run_query
+from query.catalog import get_catalog
+from query.definition import get_list_type, prime_set
+from query.execution import run_query
+from query.runlog import get_runlog, new_run_id
+from query.scheduler import run_scheduled
 from query.version import status
 
 
@@ -22,42 +20,14 @@ from query.version import status
 def run(querydefs):
     start = timeit.default_timer()
 
-    all_results = list()
-
-    # RUN QUERIES
-    with ThreadPoolExecutor(max_workers=7) as executor:
-        futures = [executor.submit(run_query, query) for query in querydefs]
-        for future in as_completed(futures):
-            result = future.result()
-            data = vars(result.qd).copy()
-            data['columns'] = '|'.join([col for col in data['columns']])
-            data.update(vars(result))
-            for key in ['parameters', 'frame', 'qd']:
-                del data[key]
-            all_results.append(data)
-
-    # update query overview
-    path_overview = PATHS.output / '_queries_overview_.xlsx'
-
-    try:
-        df = pd.read_excel(path_overview, index_col=0)
-    except FileNotFoundError:
-        columns = [
-            'qtype',
-            'name',
-            'filename',
-            'description',
-            'sql',
-            'columns',
-            'nrecords',
-            'timer',
-            'dtime',
-        ]
-        df = pd.DataFrame(columns=columns)
-
-    data = pd.DataFrame(all_results)
-    df = df.append(data, sort=False, ignore_index=True)
-    df.to_excel(path_overview)
+    # runtimes of earlier runs are used for scheduling
+    runlog = get_runlog()
+    run_id = new_run_id()
+    history = runlog.timers(filenames=[qd.filename for qd in querydefs])
+
+    # RUN QUERIES (longest first; each worker borrows a connection from pool)
+    for result in run_scheduled(querydefs, run_query, history=history):
+        runlog.record(result, run_id=run_id)
 
     # STOP TIMER AND PRINT RUNTIME
     stop = timeit.default_timer()
@@ -71,6 +41,9 @@ def run(querydefs):
 ##### INTERFACE #####
 #####################
 
+VALUE_SEPARATOR = ','
+
+
 def clear():
     # for windows
     if name == 'nt':
@@ -162,6 +135,7 @@ def get_user_input_query(options, stop, refresh):
 def get_user_input_parameters(parameters):
     line_printer()
     print(f"SET PARAMETERS:")
+    print(f"(separate multiple values with '{VALUE_SEPARATOR}')")
     line_printer()
 
     for key, ptype in parameters.items():
@@ -173,26 +147,28 @@ def get_user_input_parameters(parameters):
             print(f"\033[F{' ' * 80}", end='')
             print(f"\r{key}{type_description}: ", end='')
             val = input()
+            values = [v.strip() for v in val.split(VALUE_SEPARATOR)]
 
-            if ptype == 'int':
+            if ptype == 'int' or get_list_type(ptype) == 'int':
                 # reject if string is not convertable to integer
                 try:
-                    int(val)
+                    [int(v) for v in values]
                 except ValueError:
                     val = None
                     pass
             elif isinstance(ptype, list):
-                if val not in ptype:
+                if not all(v in ptype for v in values):
                     val = None
 
-            parameters[key] = val
+            parameters[key] = values
     return parameters
 
 
 if __name__ == '__main__':
     clear()
+    catalog = get_catalog()
     while True:
-        query_sets = [x.name for x in PATHS.definitions.iterdir() if x.is_dir()]
+        query_sets = catalog.sets()
         options    = {str(idx):qs for idx, qs in enumerate(query_sets)}
         stop       = '.'
         refresh    = '!'
@@ -206,14 +182,15 @@ if __name__ == '__main__':
         if selected == refresh:
             continue
 
-        files = (PATHS.definitions / options[selected]).glob('*.ini')
-        qds = [QueryDef.from_ini(file) for file in files]
-        parameters = {k:v for qd in qds for k, v in qd.parameters.items()}
+        qds = catalog.definitions(options[selected])
+        # parameters bound to the results of other queries are not asked for
+        parameters = {
+            k:v for qd in qds for k, v in qd.parameters.items()
+            if k not in (qd.depends or {})
+        }
         print_selected_queries(options[selected], qds)
         parameters = get_user_input_parameters(parameters)
-
-        for qd in qds:
-            qd(parameters)
+        qds = prime_set(qds, parameters)
 
         print_defined_queries(qds)
         run(qds)
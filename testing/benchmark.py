@@ -0,0 +1,325 @@
+"""
+Offline benchmark of the execution engine.
+
+The benchmark runs against a local SQLite stand-in of the query database
+(see `testing.odbc_sqlite`) filled with synthetic OSIRIS data (see
+`testing.synthetic`). It times every phase of running a query:
+
+- connect: open a connection;
+- execute: execute the sql statement;
+- first_row: fetch the first record;
+- fetch: fetch the remaining records in batches;
+- frame_build: build a DataFrame from the records;
+- dtype_cast: cast the declared dtypes;
+- fetch_typed: fetch directly into typed columns (fetch + build + cast);
+- save_<format> / load_<format>: store and read the results;
+- run: end-to-end `run()` from run_query.py;
+- set_threads / set_offload: a set of SET_COPIES copies of the query run in
+  threads, with the frames built in the threads or in worker processes
+  (see `query.offload`).
+
+Every phase is repeated and the fastest time is reported. The results are
+written as JSON, so runs of different versions can be compared.
+
+Usage
+=====
+python -m testing.benchmark --sizes 10k 1m --output bench.json
+python -m testing.benchmark --sizes 10k --compare bench.json
+"""
+
+# standard library
+import argparse
+import datetime
+import json
+import platform
+import tempfile
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# third party
+import pandas as pd
+
+# local
+from query import runlog
+from query.config import EXECUTION
+from query.definition import QueryDef
+from query.execution import open_connection, run_query, use_driver
+from query.fetch import fetch_typed
+from query.results import QueryResult, SUFFIXES
+from query.version import version
+from testing.synthetic import TABLE, generate
+
+
+SIZES = {
+    '10k': 10000,
+    '1m': 1000000,
+    '10m': 10000000,
+}
+DRIVER = 'testing.odbc_sqlite'
+WORKDIR = Path(tempfile.gettempdir()) / 'osiris_query_benchmark'
+REGRESSION = 1.1
+SET_COPIES = 4
+
+DTYPES = {
+    'studentnummer': None,
+    'opleiding': 'category',
+    'collegejaar': 'int',
+    'faculteit': 'category',
+    'examentype': 'category',
+    'inschrijvingstatus': None,
+    'vorm': None,
+    'hoofdopleiding': None,
+    'ingangsdatum': 'datetime64[ns]',
+    'afloopdatum': 'datetime64[ns]',
+    'collegegeld': 'float',
+    'mutatie_datum': 'datetime64[ns]',
+}
+
+
+def get_database(nrows, workdir=WORKDIR):
+    "Return path to the synthetic database with `nrows` records."
+
+    path = Path(workdir) / f'osiris_{nrows}.sqlite'
+    if not path.exists():
+        print(f"Generating {nrows} records in '{path}'...")
+        generate(path, nrows)
+    return path
+
+
+def get_querydef(nrows, folder=WORKDIR):
+    """
+    Return query definition selecting all synthetic records.
+    The results are stored in `folder` instead of the output folder.
+    """
+
+    return QueryDef(
+        'benchmark',
+        str(Path(folder) / f'inschrijfhist_{nrows}'),
+        f"select * from {TABLE}",
+        columns=dict(DTYPES),
+        cache_ttl=0,
+    )
+
+
+def timed(func, repeat=1):
+    "Return fastest time of `repeat` calls of `func` and its last result."
+
+    best, value = None, None
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        value = func()
+        seconds = timeit.default_timer() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, value
+
+
+def get_formats():
+    "Return the storage formats that can be used."
+
+    try:
+        import pyarrow
+    except ImportError:
+        return ['pickle']
+    return list(SUFFIXES)
+
+
+def bench(nrows, fetch_size=None, repeat=3, workdir=WORKDIR):
+    """
+    Time the phases of running a query on `nrows` synthetic records.
+
+    Parameters
+    ==========
+    :param nrows: `int`
+        Number of records.
+
+    Optional key-word arguments
+    ===========================
+    :param fetch_size: `int`, default `None`
+        Number of records to fetch per batch.
+        If None the fetch_size from the config is used.
+    :param repeat: `int`, default 3
+        Number of times every phase is repeated.
+    :param workdir: `Path`
+        Folder for the synthetic databases. Results are stored in a
+        temporary folder that is removed afterwards.
+
+    Return
+    ======
+    :bench: `dict`
+        Seconds per phase.
+    """
+
+    fetch_size = fetch_size or EXECUTION.fetch_size or 10000
+    workdir = Path(workdir)
+    use_driver(DRIVER, f'DATABASE={get_database(nrows, workdir)}')
+    with tempfile.TemporaryDirectory(prefix='osiris_query_') as output:
+        qd = get_querydef(nrows, output)
+        return bench_phases(qd, fetch_size, repeat, workdir)
+
+
+def bench_phases(qd, fetch_size, repeat, workdir):
+    "Return seconds per phase of running `qd` (see `bench`)."
+
+    columns = list(DTYPES)
+    dtypes = {k: v for k, v in DTYPES.items() if v is not None}
+    timings = dict()
+
+    def connect():
+        open_connection().close()
+    timings['connect'], _ = timed(connect, repeat)
+
+    con = open_connection()
+    cursor = con.cursor()
+
+    def fetch():
+        rows = list()
+        while True:
+            batch = cursor.fetchmany(fetch_size)
+            if not batch:
+                return rows
+            rows.extend(batch)
+
+    # execute, first_row and fetch are timed on the same statement
+    for _ in range(repeat):
+        seconds = dict()
+        seconds['execute'], _ = timed(lambda: cursor.execute(qd.sql))
+        seconds['first_row'], first = timed(cursor.fetchone)
+        seconds['fetch'], rows = timed(fetch)
+        rows.insert(0, first)
+        for phase, value in seconds.items():
+            timings[phase] = min(timings.get(phase, value), value)
+
+    timings['frame_build'], df = timed(
+        lambda: pd.DataFrame.from_records(rows, columns=columns), repeat)
+    del rows
+    timings['dtype_cast'], df = timed(lambda: df.astype(dtypes), repeat)
+
+    def fetch_typed_():
+        cursor.execute(qd.sql)
+        return fetch_typed(cursor, columns, fetch_size, dtypes=dtypes)
+    timings['fetch_typed'], _ = timed(fetch_typed_, repeat)
+    cursor.close()
+    con.close()
+
+    result = QueryResult(qd, df)
+    for fmt in get_formats():
+        path = Path(f'{qd.filename}{SUFFIXES[fmt]}')
+        timings[f'save_{fmt}'], _ = timed(
+            lambda: result.save(path=path, fmt=fmt), repeat)
+        timings[f'load_{fmt}'], _ = timed(
+            lambda: QueryResult.read(path=path).frame, repeat)
+    del result, df
+
+    timings['run'] = bench_run(qd, repeat, workdir)
+    timings['set_threads'] = bench_set(qd, offload=False, repeat=repeat)
+    timings['set_offload'] = bench_set(qd, offload=True, repeat=repeat)
+    return timings
+
+
+def bench_run(qd, repeat=1, workdir=WORKDIR):
+    "Return fastest time of an end-to-end `run()` of `qd`."
+
+    from run_query import run
+
+    # keep the benchmark out of the run log
+    shared_runlog = runlog._runlog
+    runlog._runlog = runlog.RunLog(Path(workdir) / '_runlog_.sqlite')
+    try:
+        seconds, _ = timed(lambda: run([qd]), repeat)
+    finally:
+        runlog._runlog = shared_runlog
+    return seconds
+
+
+def bench_set(qd, offload, copies=SET_COPIES, repeat=1):
+    """
+    Return fastest time of running `copies` copies of `qd` at the same time
+    in threads, with or without offloading the CPU work after fetching.
+    """
+
+    qds = [
+        qd.replace(filename=f"{qd.filename}_{idx}") for idx in range(copies)]
+
+    def run_set():
+        with ThreadPoolExecutor(max_workers=copies) as executor:
+            return list(executor.map(
+                lambda qd: run_query(qd, use_cache=False, offload=offload),
+                qds,
+            ))
+
+    if offload:
+        # start the worker processes before timing
+        run_query(qds[0], use_cache=False, offload=True)
+    seconds, _ = timed(run_set, repeat)
+    return seconds
+
+
+def run_benchmark(sizes, fetch_size=None, repeat=3, workdir=WORKDIR):
+    """
+    Run the benchmark for every size in `sizes`.
+    Return the results as dictionary that can be stored as JSON.
+    """
+
+    results = dict()
+    for size in sizes:
+        nrows = SIZES.get(str(size).lower()) or int(size)
+        print(f"Benchmarking {nrows} records...")
+        results[str(nrows)] = bench(nrows, fetch_size, repeat, workdir)
+    return {
+        'version': version,
+        'dtime': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'fetch_size': fetch_size or EXECUTION.fetch_size,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(current, previous):
+    """
+    Print the timings of `current` next to those of `previous`.
+    Phases that became more than 10% slower are marked as regression.
+    """
+
+    print(f"{'rows':>10} {'phase':<15} {'previous':>10} {'current':>10}")
+    for nrows, timings in current['results'].items():
+        before = previous['results'].get(nrows, dict())
+        for phase, seconds in timings.items():
+            old = before.get(phase)
+            mark = ''
+            if old:
+                ratio = seconds / old
+                mark = f"{ratio:>6.2f}x"
+                if ratio > REGRESSION:
+                    mark += ' REGRESSION'
+            old = '' if old is None else f"{old:.4f}"
+            print(f"{nrows:>10} {phase:<15} {old:>10} {seconds:>10.4f} {mark}")
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmark the execution engine on synthetic data.")
+    parser.add_argument(
+        '--sizes', nargs='+', default=['10k'],
+        help="number of records: 10k, 1m, 10m or a number")
+    parser.add_argument('--fetch-size', type=int, default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workdir', default=str(WORKDIR))
+    parser.add_argument('--output', help="write results to this JSON file")
+    parser.add_argument('--compare', help="compare with this JSON file")
+    args = parser.parse_args()
+
+    current = run_benchmark(
+        args.sizes, args.fetch_size, args.repeat, args.workdir)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=4)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(current, json.load(f))
+    else:
+        print(json.dumps(current['results'], indent=4))
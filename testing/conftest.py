@@ -0,0 +1,87 @@
+"""
+Fixtures for the tests in this folder.
+
+The tests run against the SQLite stand-in of the query database (see
+`testing.odbc_sqlite`) filled with synthetic data (see `testing.synthetic`).
+Results, cache and snapshots are written to the temporary folder of every
+test. The tests need pyodbc and 'config/config.ini' (a copy of
+'config.ini'); without them the tests are skipped with the reason.
+
+Usage
+=====
+python -m pytest testing
+"""
+
+# standard library
+import importlib.util
+from pathlib import Path
+
+# third party
+import pytest
+
+
+CFG_FILE = Path(__file__).resolve().parent.parent / 'config' / 'config.ini'
+DRIVER = 'testing.odbc_sqlite'
+NROWS = 2000
+
+if importlib.util.find_spec('pyodbc') is None:
+    SKIP = "pyodbc is not installed"
+elif not CFG_FILE.exists():
+    SKIP = f"cannot find '{CFG_FILE}' (copy 'config.ini' to this path)"
+else:
+    SKIP = None
+
+
+def pytest_collect_file(parent):
+    "Skip the tests in this folder if SKIP gives a reason."
+
+    if SKIP:
+        pytest.skip(SKIP)
+
+
+@pytest.fixture(scope='session')
+def database(tmp_path_factory):
+    "Path to a synthetic database with NROWS records."
+
+    from testing.synthetic import generate
+
+    path = tmp_path_factory.mktemp('database') / 'osiris.sqlite'
+    generate(path, NROWS)
+    return path
+
+
+@pytest.fixture
+def connect():
+    """
+    Function that connects the execution engine to a SQLite database.
+    The configured driver is restored after the test.
+    """
+
+    from query.config import EXECUTION
+    from query.execution import use_driver
+
+    def connect(path):
+        use_driver(DRIVER, f'DATABASE={path}')
+
+    yield connect
+    use_driver(EXECUTION.driver, EXECUTION.connection_string)
+
+
+@pytest.fixture
+def driver(database, connect):
+    "Connect the execution engine to the synthetic database."
+
+    connect(database)
+    return database
+
+
+@pytest.fixture(autouse=True)
+def isolated(tmp_path, monkeypatch):
+    "Keep the shared result cache and snapshot store in `tmp_path`."
+
+    from query import cache, snapshots
+
+    monkeypatch.setattr(
+        cache, '_cache', cache.ResultCache(tmp_path / '_cache_', ttl=0))
+    monkeypatch.setattr(
+        snapshots, '_store', snapshots.SnapshotStore(tmp_path / '_snapshots_'))
@@ -0,0 +1,178 @@
+"""
+This module is a DB-API stand-in for the query database based on SQLite.
+
+It mimics the parts of pyodbc the execution engine relies on, so queries can
+be run offline against a local SQLite database:
+- `cursor.description` holds a Python type per column as type code;
+- dates and timestamps are returned as `date` and `datetime` objects;
+- errors are raised as `pyodbc.Error` with an SQLSTATE as first argument;
+- `connection.timeout` sets a query timeout and `cursor.cancel` interrupts
+  the running statement.
+
+Usage
+=====
+from query.execution import use_driver
+
+use_driver('testing.odbc_sqlite', 'DATABASE=path/to/osiris.sqlite')
+"""
+
+# standard library
+import re
+import sqlite3
+import timeit
+
+# third party
+import pyodbc
+
+
+DUAL = re.compile(r'\s+from\s+dual\b', re.IGNORECASE)
+SAMPLE_SIZE = 100
+
+
+class Error(pyodbc.Error):
+    "Database error raised by the stand-in."
+
+
+def connect(connection_string):
+    """
+    Connect to a SQLite database.
+
+    Parameters
+    ==========
+    :param connection_string: `str`
+        Path to the database, optionally as 'DATABASE=<path>'.
+
+    Return
+    ======
+    :Connection:
+    """
+
+    path = connection_string
+    for item in connection_string.split(';'):
+        key, _, value = item.partition('=')
+        if key.strip().upper() == 'DATABASE':
+            path = value.strip()
+    try:
+        con = sqlite3.connect(
+            path,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+        )
+    except sqlite3.Error as e:
+        raise Error('08001', str(e)) from e
+    return Connection(con)
+
+
+class Connection:
+    """
+    Connection
+    ==========
+    Connection to the SQLite database.
+
+    Attributes
+    ==========
+    timeout: int
+        Query timeout in seconds (0 = no timeout).
+    """
+
+    def __init__(self, con):
+        self.timeout = 0
+        self._con    = con
+
+
+    def cursor(self):
+        return Cursor(self)
+
+
+    def commit(self):
+        self._con.commit()
+
+
+    def close(self):
+        self._con.close()
+
+
+class Cursor:
+    """
+    Cursor
+    ======
+    Cursor on the SQLite database.
+    """
+
+    def __init__(self, connection):
+        self.connection  = connection
+        self.description = None
+        self._cursor     = connection._con.cursor()
+        self._buffer     = list()
+
+
+    def execute(self, sql, params=None):
+        "Execute sql statement ('from dual' is left out)."
+
+        sql = DUAL.sub('', sql)
+        con = self.connection._con
+        timeout = self.connection.timeout
+        if timeout:
+            deadline = timeit.default_timer() + timeout
+            con.set_progress_handler(
+                lambda: timeit.default_timer() > deadline, 10000)
+        try:
+            self._cursor.execute(sql, params or [])
+            self._buffer = self._cursor.fetchmany(SAMPLE_SIZE)
+        except sqlite3.Error as e:
+            if timeout and timeit.default_timer() > deadline:
+                raise Error('HYT00', 'Query timeout expired') from e
+            raise Error('HY000', str(e)) from e
+        finally:
+            if timeout:
+                con.set_progress_handler(None, 0)
+        self.description = self._describe()
+        return self
+
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+
+    def fetchmany(self, size=1):
+        rows = self._buffer[:size]
+        del self._buffer[:size]
+        if len(rows) < size:
+            rows += self._fetch(self._cursor.fetchmany, size - len(rows))
+        return rows
+
+
+    def fetchall(self):
+        rows, self._buffer = self._buffer, list()
+        return rows + self._fetch(self._cursor.fetchall)
+
+
+    def cancel(self):
+        self.connection._con.interrupt()
+
+
+    def close(self):
+        self._cursor.close()
+
+
+    def _fetch(self, func, *args):
+        try:
+            return func(*args)
+        except sqlite3.Error as e:
+            raise Error('HY008', str(e)) from e
+
+
+    def _describe(self):
+        if self._cursor.description is None:
+            return None
+
+        # type code per column: type of the first value that is not null
+        description = list()
+        for idx, column in enumerate(self._cursor.description):
+            values = (row[idx] for row in self._buffer)
+            value = next((v for v in values if v is not None), None)
+            type_code = str if value is None else type(value)
+            description.append(
+                (column[0], type_code, None, None, None, None, True))
+        return description
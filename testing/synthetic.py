@@ -0,0 +1,139 @@
+"""
+This module generates synthetic OSIRIS-shaped data in a SQLite database.
+
+The table `ost_student_inschrijfhist` resembles OST_STUDENT_INSCHRIJFHIST:
+integer keys, low-cardinality codes, dates, a nullable end date and an
+amount. The data is generated with a fixed seed, so databases of the same
+size are identical.
+
+Usage
+=====
+python -m testing.synthetic osiris.sqlite 1000000
+"""
+
+# standard library
+import argparse
+import datetime
+import sqlite3
+from pathlib import Path
+
+# third party
+import numpy as np
+
+
+TABLE = 'ost_student_inschrijfhist'
+
+# column name -> sqlite type
+COLUMNS = {
+    'studentnummer': 'INTEGER',
+    'opleiding': 'TEXT',
+    'collegejaar': 'INTEGER',
+    'faculteit': 'TEXT',
+    'examentype': 'TEXT',
+    'inschrijvingstatus': 'TEXT',
+    'vorm': 'TEXT',
+    'hoofdopleiding': 'TEXT',
+    'ingangsdatum': 'DATE',
+    'afloopdatum': 'DATE',
+    'collegegeld': 'REAL',
+    'mutatie_datum': 'TIMESTAMP',
+}
+
+FACULTEITEN = ['BETA', 'DGK', 'GEO', 'GW', 'REBO', 'SW', 'UCU']
+EXAMENTYPES = ['BA', 'MA', 'PM']
+STATUSSEN = ['I', 'V', 'G', 'S']
+VORMEN = ['VT', 'DT']
+COLLEGEJAREN = list(range(2005, 2025))
+N_OPLEIDINGEN = 250
+CHUNK_SIZE = 100000
+
+
+def generate(path, nrows, seed=0, chunk_size=CHUNK_SIZE):
+    """
+    Create a SQLite database at `path` with `nrows` synthetic records.
+    An existing database is replaced.
+
+    Parameters
+    ==========
+    :param path: `Path`
+        Path to the SQLite database.
+    :param nrows: `int`
+        Number of records.
+
+    Optional key-word arguments
+    ===========================
+    :param seed: `int`, default 0
+        Seed of the random generator.
+    :param chunk_size: `int`, default 100000
+        Number of records generated and inserted at once.
+
+    Return
+    ======
+    :generate: `Path`
+    """
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        path.unlink()
+
+    rng = np.random.RandomState(seed)
+    columns = ', '.join(f"{k} {v}" for k, v in COLUMNS.items())
+    markers = ', '.join('?' for _ in COLUMNS)
+    con = sqlite3.connect(str(path))
+    try:
+        with con:
+            con.execute(f"create table {TABLE} ({columns})")
+            for start in range(0, nrows, chunk_size):
+                n = min(chunk_size, nrows - start)
+                con.executemany(
+                    f"insert into {TABLE} values ({markers})",
+                    generate_rows(rng, n),
+                )
+    finally:
+        con.close()
+    return path
+
+
+def generate_rows(rng, n):
+    "Return `n` synthetic records as list of tuples."
+
+    opleidingen = [str(50000 + idx) for idx in range(N_OPLEIDINGEN)]
+    collegejaar = rng.choice(COLLEGEJAREN, n)
+    ingang = [datetime.date(int(jaar), 9, 1) for jaar in collegejaar]
+    duur = rng.randint(30, 1500, n)
+    gestopt = rng.rand(n) < 0.4
+    afloop = [
+        (d + datetime.timedelta(days=int(days))).isoformat() if stop else None
+        for d, days, stop in zip(ingang, duur, gestopt)
+    ]
+    mutatie = [
+        datetime.datetime(int(jaar), 1, 1) + datetime.timedelta(seconds=int(s))
+        for jaar, s in zip(collegejaar, rng.randint(0, 365 * 86400, n))
+    ]
+
+    columns = [
+        rng.randint(1000000, 9999999, n).tolist(),
+        [opleidingen[idx] for idx in rng.randint(0, N_OPLEIDINGEN, n)],
+        collegejaar.tolist(),
+        rng.choice(FACULTEITEN, n).tolist(),
+        rng.choice(EXAMENTYPES, n, p=[0.6, 0.35, 0.05]).tolist(),
+        rng.choice(STATUSSEN, n, p=[0.7, 0.1, 0.15, 0.05]).tolist(),
+        rng.choice(VORMEN, n, p=[0.9, 0.1]).tolist(),
+        rng.choice(['J', 'N'], n, p=[0.85, 0.15]).tolist(),
+        [d.isoformat() for d in ingang],
+        afloop,
+        np.round(rng.uniform(0, 15000, n), 2).tolist(),
+        [d.isoformat(' ') for d in mutatie],
+    ]
+    return list(zip(*columns))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Generate a SQLite database with synthetic OSIRIS data.")
+    parser.add_argument('path', help="path to the SQLite database")
+    parser.add_argument('nrows', type=int, help="number of records")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(generate(args.path, args.nrows, seed=args.seed))
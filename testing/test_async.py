@@ -0,0 +1,108 @@
+"Asyncio interface to the execution engine (see `query.async_execution`)."
+
+# standard library
+import asyncio
+import threading
+import time
+
+# local
+from query import async_execution
+from query.async_execution import run_query_async, run_set_async
+from query.cancellation import Cancellation
+from query.config import SCHEDULER
+from query.definition import QueryDef
+from query.results import OK, QueryResult
+from query.scheduler import run_scheduled
+from testing.synthetic import TABLE
+
+# takes long enough to be cancelled while it runs
+SLOW_SQL = (
+    "with recursive teller(x) as "
+    "(select 1 union all select x + 1 from teller where x < 100000000) "
+    "select count(*) as n from teller"
+)
+
+
+def test_run_query_async(driver, tmp_path):
+    qd = QueryDef('async', str(tmp_path / 'async'), f"select * from {TABLE}")
+    result = asyncio.run(run_query_async(qd, save=False))
+    assert result.status == OK
+    assert result.nrecords > 0
+
+
+def test_run_set_async(driver, tmp_path):
+    faculteiten = QueryDef(
+        'faculteiten',
+        str(tmp_path / 'faculteiten'),
+        f"select distinct faculteit from {TABLE}",
+    )
+    studenten = QueryDef(
+        'studenten',
+        str(tmp_path / 'studenten'),
+        f"select * from {TABLE} where faculteit in ([faculteiten])",
+        parameters={'faculteiten': 'list[str]'},
+        depends={'faculteiten': 'faculteiten.faculteit'},
+    ).prime({})
+
+    async def run():
+        return [
+            result async for result in
+            run_set_async([studenten, faculteiten], save=False)
+        ]
+
+    results = asyncio.run(run())
+    assert [result.qd.name for result in results] == [
+        'faculteiten', 'studenten']
+    assert all(result.status == OK for result in results)
+
+
+def test_cancelled_task_cancels_query(driver, tmp_path):
+    qd = QueryDef('traag', str(tmp_path / 'traag'), SLOW_SQL)
+    cancel = Cancellation()
+
+    async def run():
+        task = asyncio.ensure_future(
+            run_query_async(qd, cancel=cancel, save=False))
+        await asyncio.sleep(0.5)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    start = time.monotonic()
+    asyncio.run(run())
+    assert cancel.interrupted
+    assert time.monotonic() - start < 30
+
+
+def test_dsn_limit_is_shared(monkeypatch):
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def run(qd, cancel=None, **kwargs):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        return QueryResult(qd, None)
+
+    monkeypatch.setattr(async_execution, 'run_query', run)
+    qds = [
+        QueryDef(f'q{idx}', f'q{idx}', 'select 1')
+        for idx in range(SCHEDULER.dsn_limit * 3)
+    ]
+
+    async def run_async():
+        return await asyncio.gather(*[run_query_async(qd) for qd in qds])
+
+    # a set in threads and a set in the event loop at the same time
+    scheduled = threading.Thread(
+        target=lambda: list(run_scheduled(qds, run, max_concurrent=len(qds))))
+    scheduled.start()
+    results = asyncio.run(run_async())
+    scheduled.join()
+    assert len(results) == len(qds)
+    assert peak[0] == SCHEDULER.dsn_limit
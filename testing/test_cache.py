@@ -0,0 +1,60 @@
+"Result cache with a time-to-live (see `query.cache`)."
+
+# standard library
+import time
+
+# third party
+import pandas as pd
+
+# local
+from query.cache import ResultCache
+from query.definition import QueryDef
+from query.execution import run_query
+from query.results import QueryResult
+from testing.synthetic import TABLE
+
+
+def get_result(cache_ttl):
+    qd = QueryDef('cached', 'cached', 'select 1', cache_ttl=cache_ttl)
+    return QueryResult(qd, pd.DataFrame({'a': [1, 2, 3]}))
+
+
+def test_put_and_get(tmp_path):
+    cache = ResultCache(tmp_path, ttl=0)
+    result = get_result(60)
+    cache.put(result)
+    cached = cache.get(result.qd)
+    pd.testing.assert_frame_equal(cached.frame, result.frame)
+
+
+def test_expired_result_is_removed(tmp_path):
+    cache = ResultCache(tmp_path, ttl=0)
+    cache.put(get_result(60))
+    time.sleep(1.1)
+
+    # same sql, so the same cache entry
+    short = get_result(1)
+    assert cache.get(short.qd) is None
+    assert not list(tmp_path.glob('*.pkl'))
+
+
+def test_no_ttl_is_not_cached(tmp_path):
+    cache = ResultCache(tmp_path, ttl=0)
+    result = get_result(None)
+    cache.put(result)
+    assert cache.get(get_result(60).qd) is None
+
+
+def test_run_query_returns_cached_result(driver, tmp_path):
+    qd = QueryDef(
+        'cached',
+        str(tmp_path / 'cached'),
+        f"select * from {TABLE} where collegejaar = 2019",
+        cache_ttl=60,
+    )
+    first = run_query(qd, save=False)
+    second = run_query(qd, save=False)
+    assert second.dtime == first.dtime
+    assert second.cached and not first.cached
+    third = run_query(qd, save=False, use_cache=False)
+    assert third.dtime > first.dtime
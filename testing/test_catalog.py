@@ -0,0 +1,53 @@
+"Index of the query definitions on disk (see `query.catalog`)."
+
+# standard library
+import pickle
+import shutil
+
+# local
+from query.catalog import CATALOG_VERSION, DefinitionCatalog
+from query.config import PATHS
+
+
+SOURCE = PATHS.definitions / 'osiris_table_column_names' / 'column_names.ini'
+
+
+def get_catalog(tmp_path, names):
+    folder = tmp_path / 'definitions' / 'systeem'
+    folder.mkdir(parents=True)
+    for name in names:
+        shutil.copy(str(SOURCE), str(folder / f'{name}.ini'))
+    return DefinitionCatalog(
+        tmp_path / 'definitions', cache_path=tmp_path / 'catalog.pkl')
+
+
+def cached_keys(tmp_path):
+    with open(tmp_path / 'catalog.pkl', 'rb') as f:
+        return sorted(pickle.load(f)['entries'])
+
+
+def test_deleted_definitions_are_dropped(tmp_path):
+    catalog = get_catalog(tmp_path, ['a', 'b'])
+    assert len(catalog.definitions('systeem')) == 2
+    assert len(cached_keys(tmp_path)) == 2
+
+    (tmp_path / 'definitions' / 'systeem' / 'b.ini').unlink()
+    assert len(catalog.definitions('systeem')) == 1
+    keys = cached_keys(tmp_path)
+    assert len(keys) == 1 and keys[0].endswith('a.ini')
+
+    # a fresh catalog reads the pruned cache from disk
+    fresh = DefinitionCatalog(
+        tmp_path / 'definitions', cache_path=tmp_path / 'catalog.pkl')
+    assert len(fresh._load()) == 1
+
+
+def test_other_version_is_discarded(tmp_path):
+    catalog = get_catalog(tmp_path, ['a'])
+    catalog.definitions('systeem')
+    with open(tmp_path / 'catalog.pkl', 'wb') as f:
+        pickle.dump({'version': CATALOG_VERSION - 1, 'entries': {'x': 1}}, f)
+    fresh = DefinitionCatalog(
+        tmp_path / 'definitions', cache_path=tmp_path / 'catalog.pkl')
+    assert fresh._load() == {}
+    assert len(fresh.definitions('systeem')) == 1
@@ -0,0 +1,141 @@
+"List-typed parameters split into chunks (see `QueryDef.chunks`)."
+
+# standard library
+import math
+import sqlite3
+import threading
+import time
+
+# third party
+import numpy as np
+import pandas as pd
+import pytest
+
+# local
+from query import definition, execution
+from query.cancellation import CANCELLED, TIMEOUT, QueryInterrupted
+from query.cancellation import Cancellation
+from query.config import EXECUTION
+from query.definition import QueryDef, format_list
+from query.execution import execute_chunks, get_pool, run_query
+from testing.synthetic import TABLE
+
+
+# every chunk counts a long recursive sequence
+SLOW_SQL = (
+    "with recursive teller(x) as "
+    "(select 1 union all select x + 1 from teller where x < 100000000) "
+    "select count(*) as n from teller where x in ([getallen])"
+)
+
+
+def get_querydef(folder):
+    return QueryDef(
+        'studenten',
+        str(folder / 'studenten'),
+        f"select * from {TABLE} where studentnummer in ([studentnummers])",
+        parameters={'studentnummers': 'list[int]'},
+    )
+
+
+def test_long_list_is_chunked(driver, tmp_path):
+    with sqlite3.connect(str(driver)) as con:
+        ids = [row[0] for row in con.execute(
+            f"select distinct studentnummer from {TABLE} "
+            f"order by studentnummer limit 1200"
+        )]
+        expected = con.execute(
+            f"select count(*) from {TABLE} where studentnummer "
+            f"<= {ids[-1]}"
+        ).fetchone()[0]
+    con.close()
+
+    qd = get_querydef(tmp_path).prime({'studentnummers': ids})
+    limit = EXECUTION.in_list_limit
+    assert len(qd.chunks) == math.ceil(len(ids) / limit)
+    for chunk in qd.chunks:
+        values = chunk.split('in (')[1].split(')')[0].split(',')
+        assert len(values) <= limit
+
+    result = run_query(qd, save=False)
+    assert result.nrecords == expected
+    assert set(result.frame['studentnummer']) == set(ids)
+
+
+def test_short_list_is_not_chunked(driver, tmp_path):
+    qd = get_querydef(tmp_path).prime({'studentnummers': '1, 2, 3'})
+    assert not qd.chunks
+    assert 'in(1,2,3)' in qd.sql.replace(' ', '')
+
+
+def test_not_in_is_not_chunked(tmp_path):
+    qd = QueryDef(
+        'overig',
+        str(tmp_path / 'overig'),
+        f"select * from {TABLE} where studentnummer not in ([studentnummers])",
+        parameters={'studentnummers': 'list[int]'},
+    )
+    limit = EXECUTION.in_list_limit
+    assert qd.prime({'studentnummers': list(range(limit))}).sql
+    with pytest.raises(ValueError):
+        qd.prime({'studentnummers': list(range(limit + 1))})
+
+
+def test_numpy_integers_are_not_quoted():
+    values = [np.int64(1), np.int32(2), 3, 'a']
+    assert format_list(values) == "1, 2, 3, 'a'"
+
+
+def get_slow_querydef(folder, monkeypatch, nchunks):
+    monkeypatch.setattr(
+        definition, 'EXECUTION', EXECUTION._replace(in_list_limit=1))
+    qd = QueryDef(
+        'traag',
+        str(folder / 'traag'),
+        SLOW_SQL,
+        parameters={'getallen': 'list[int]'},
+    )
+    return qd.prime({'getallen': list(range(1, nchunks + 1))})
+
+
+def test_chunks_share_the_timeout(tmp_path, monkeypatch):
+    qd = get_slow_querydef(tmp_path, monkeypatch, 4)
+    timeouts = list()
+
+    def execute(cursor, qd, timeout=None, **kwargs):
+        timeouts.append(timeout)
+        time.sleep(0.4)
+        return pd.DataFrame()
+
+    monkeypatch.setattr(execution, 'execute', execute)
+    cancel = Cancellation()
+    with pytest.raises(QueryInterrupted):
+        execute_chunks(object(), qd, cancel=cancel, timeout=1)
+    assert cancel.status == TIMEOUT
+    # the fourth chunk is not started once the time is up
+    assert len(timeouts) == 3
+    assert timeouts == sorted(timeouts, reverse=True)
+    assert timeouts[0] <= 1 and timeouts[-1] < 0.4
+
+
+@pytest.mark.parametrize('cursor', [False, True])
+def test_chunked_query_times_out(driver, tmp_path, monkeypatch, cursor):
+    qd = get_slow_querydef(tmp_path, monkeypatch, 3)
+    start = time.monotonic()
+    if cursor:
+        with get_pool().cursor() as cursor:
+            result = run_query(qd, save=False, cursor=cursor, timeout=1)
+    else:
+        result = run_query(qd, save=False, timeout=1)
+    assert result.status == TIMEOUT
+    assert time.monotonic() - start < 3
+
+
+def test_chunked_query_is_cancelled(driver, tmp_path, monkeypatch):
+    qd = get_slow_querydef(tmp_path, monkeypatch, 3)
+    cancel = Cancellation()
+    threading.Timer(0.5, cancel.cancel).start()
+    start = time.monotonic()
+    result = run_query(qd, save=False, cancel=cancel)
+    assert result.status == CANCELLED
+    assert time.monotonic() - start < 3
@@ -0,0 +1,53 @@
+"Priming query definitions over parameter grids (see `query.definition`)."
+
+# local
+from query.definition import QueryDef, prime_set
+
+
+def get_querydef(filename):
+    return QueryDef(
+        'inschrijvingen',
+        filename,
+        "select * from inschrijvingen "
+        "where collegejaar = [collegejaar] and examentype = '[examentype]'",
+        parameters={'collegejaar': 'int', 'examentype': 'str'},
+    )
+
+
+def test_expand_gives_unique_filenames():
+    qd = get_querydef('monitor/inschrijvingen')
+    qds = qd.expand({'collegejaar': [2018, 2019], 'examentype': ['BA', 'MA']})
+    assert len(qds) == 4
+    assert {qd.filename for qd in qds} == {
+        'monitor/inschrijvingen_2018_BA',
+        'monitor/inschrijvingen_2018_MA',
+        'monitor/inschrijvingen_2019_BA',
+        'monitor/inschrijvingen_2019_MA',
+    }
+    assert qd.filename == 'monitor/inschrijvingen'
+
+
+def test_parameters_in_filename_are_not_appended():
+    qd = get_querydef('monitor/inschrijvingen_[collegejaar]')
+    qds = qd.expand({'collegejaar': [2018, 2019], 'examentype': ['BA']})
+    assert [qd.filename for qd in qds] == [
+        'monitor/inschrijvingen_2018',
+        'monitor/inschrijvingen_2019',
+    ]
+
+
+def test_prime_set_skips_unused_parameters():
+    used = get_querydef('monitor/inschrijvingen')
+    unused = QueryDef('totaal', 'monitor/totaal', 'select 1')
+    qds = prime_set(
+        [used, unused],
+        [
+            {'collegejaar': 2018, 'examentype': 'BA'},
+            {'collegejaar': 2019, 'examentype': 'BA'},
+        ],
+    )
+    assert [qd.filename for qd in qds] == [
+        'monitor/inschrijvingen_2018',
+        'monitor/inschrijvingen_2019',
+        'monitor/totaal',
+    ]
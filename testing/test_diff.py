@@ -0,0 +1,72 @@
+"Differences between two runs of a query (see `query.diff`)."
+
+# third party
+import pandas as pd
+import pytest
+
+# local
+from query.definition import QueryDef
+from query.diff import Diff, diff_frames
+from query.results import QueryResult
+
+
+OLD = pd.DataFrame({'id': [1, 2, 3], 'waarde': ['a', 'b', 'c']})
+NEW = pd.DataFrame({'id': [2, 3, 4], 'waarde': ['b', 'x', 'd']})
+
+
+def test_diff_on_key():
+    diff = diff_frames(NEW, OLD, key='id')
+    summary = diff.summary
+    assert (summary['added'], summary['removed']) == (1, 1)
+    assert (summary['changed'], summary['unchanged']) == (1, 1)
+    assert summary['columns'] == {'waarde': 1}
+    assert diff.added['id'].tolist() == [4]
+    assert diff.removed['id'].tolist() == [1]
+    assert diff.changed['waarde'].tolist() == ['x']
+    assert diff.before['waarde'].tolist() == ['c']
+
+
+def test_diff_without_key():
+    diff = diff_frames(NEW, OLD)
+    assert diff.summary['added'] == 2
+    assert diff.summary['removed'] == 2
+    assert diff.summary['changed'] == 0
+
+
+def test_duplicate_records_without_key():
+    old = pd.DataFrame({'waarde': ['a', 'a', 'b']})
+    new = pd.DataFrame({'waarde': ['a', 'b']})
+    diff = diff_frames(new, old)
+    assert diff.summary['removed'] == 1
+    assert diff.summary['added'] == 0
+
+
+def test_summary_only():
+    diff = diff_frames(NEW, OLD, key='id', summary=True)
+    assert diff.summary['changed'] == 1
+    assert diff.added is None and diff.changed is None
+
+
+def test_key_must_be_unique():
+    old = pd.DataFrame({'id': [1, 1], 'waarde': ['a', 'b']})
+    with pytest.raises(ValueError):
+        diff_frames(NEW, old, key='id')
+    with pytest.raises(ValueError):
+        diff_frames(NEW, OLD, key='onbekend')
+
+
+def test_result_diff_uses_incremental_key(tmp_path):
+    qd = QueryDef(
+        'waarden', 'waarden', 'select 1',
+        incremental={'column': 'id', 'key': 'id'},
+    )
+    new, old = QueryResult(qd, NEW), QueryResult(qd, OLD)
+    diff = new.diff(old)
+    assert diff.summary['key'] == ['id']
+    assert diff.summary['changed'] == 1
+
+    path = tmp_path / 'waarden.diff'
+    diff.save(path)
+    assert (tmp_path / 'waarden.diff.json').exists()
+    loaded = Diff.read(path=path)
+    assert loaded.summary == diff.summary
@@ -0,0 +1,33 @@
+"Fetching records into typed columns (see `query.fetch`)."
+
+# standard library
+import datetime
+
+# third party
+import pandas as pd
+
+# local
+from query.execution import execute, get_pool
+from query.fetch import get_builder
+from testing.benchmark import get_querydef
+
+
+def test_datetime_builder_returns_nanoseconds():
+    values = [datetime.datetime(2019, 9, 1, 12, 30), None]
+    builder = get_builder('datetime64[ns]')
+    builder.append(values)
+    builder.append([datetime.datetime(2020, 1, 1)])
+    series = builder.finish()
+    expected = pd.Series(
+        values + [datetime.datetime(2020, 1, 1)], dtype=object,
+    ).astype('datetime64[ns]')
+    pd.testing.assert_series_equal(series, expected)
+
+
+def test_typed_fetch_equals_fetchall(driver, tmp_path):
+    qd = get_querydef(0, tmp_path)
+    with get_pool().cursor() as cursor:
+        typed = execute(cursor, qd, fetch_size=300)
+        expected = execute(cursor, qd, fetch_size=0)
+    assert typed.dtypes.to_dict() == expected.dtypes.to_dict()
+    pd.testing.assert_frame_equal(typed, expected)
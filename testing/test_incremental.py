@@ -0,0 +1,86 @@
+"Incremental refresh of stored results (see `query.incremental`)."
+
+# standard library
+import sqlite3
+
+# local
+from query.definition import QueryDef
+from query.execution import run_query
+
+
+def write_rows(path, rows):
+    with sqlite3.connect(str(path)) as con:
+        con.execute(
+            "create table if not exists mutaties "
+            "(id integer, waarde text, mutatie_datum timestamp)"
+        )
+        con.executemany("insert into mutaties values (?, ?, ?)", rows)
+    con.close()
+
+
+def get_querydef(folder, key='id'):
+    incremental = {'column': 'mutatie_datum'}
+    if key:
+        incremental['key'] = key
+    return QueryDef(
+        'mutaties',
+        str(folder / 'mutaties'),
+        "select * from mutaties",
+        columns={
+            'id': 'int',
+            'waarde': None,
+            'mutatie_datum': 'datetime64[ns]',
+        },
+        incremental=incremental,
+    )
+
+
+def test_merge_updates_and_inserts_on_watermark_day(tmp_path, connect):
+    path = tmp_path / 'mutaties.sqlite'
+    write_rows(path, [
+        (1, 'a', '2019-10-01 00:00:00'),
+        (2, 'b', '2019-10-01 00:00:00'),
+        (3, 'c', '2019-10-02 00:00:00'),
+    ])
+    connect(path)
+    qd = get_querydef(tmp_path)
+    assert run_query(qd).nrecords == 3
+
+    # changed later on the day of the watermark
+    with sqlite3.connect(str(path)) as con:
+        con.execute("update mutaties set waarde = 'x' where id = 3")
+    con.close()
+    write_rows(path, [(4, 'd', '2019-10-02 00:00:00')])
+
+    frame = run_query(qd).frame.sort_values('id')
+    assert frame['id'].tolist() == [1, 2, 3, 4]
+    assert frame['waarde'].tolist() == ['a', 'b', 'x', 'd']
+
+
+def test_append_without_key_uses_strict_watermark(tmp_path, connect):
+    path = tmp_path / 'mutaties.sqlite'
+    write_rows(path, [
+        (1, 'a', '2019-10-01 00:00:00'),
+        (2, 'b', '2019-10-02 00:00:00'),
+    ])
+    connect(path)
+    qd = get_querydef(tmp_path, key=None)
+    run_query(qd)
+
+    write_rows(path, [(3, 'c', '2019-10-03 00:00:00')])
+    frame = run_query(qd).frame
+    assert frame['id'].tolist() == [1, 2, 3]
+
+
+def test_full_refresh(tmp_path, connect):
+    path = tmp_path / 'mutaties.sqlite'
+    write_rows(path, [(1, 'a', '2019-10-01 00:00:00')])
+    connect(path)
+    qd = get_querydef(tmp_path)
+    run_query(qd)
+
+    with sqlite3.connect(str(path)) as con:
+        con.execute("delete from mutaties")
+    con.close()
+    assert run_query(qd).nrecords == 1
+    assert run_query(qd, incremental=False).nrecords == 0
@@ -0,0 +1,44 @@
+"Building results in a worker process (see `query.offload`)."
+
+# standard library
+import pickle
+
+# third party
+import pandas as pd
+
+# local
+from query.execution import run_query
+from query.offload import RawBatches
+from testing.benchmark import get_querydef
+
+
+class Row:
+    "Row of a database driver that is not a tuple."
+
+    def __init__(self, *values):
+        self.values = values
+
+
+    def __iter__(self):
+        return iter(self.values)
+
+
+def test_batches_are_pickled_as_tuples():
+    raw = RawBatches(['a', 'b'], [int, str])
+    raw.append([Row(1, 'x'), Row(2, None)])
+    raw.append([Row(3, 'z')])
+    assert len(raw) == 3
+
+    copy = pickle.loads(pickle.dumps(raw))
+    assert list(copy.batches) == [[(1, 'x'), (2, None)], [(3, 'z')]]
+    frame = copy.to_frame()
+    assert frame['a'].tolist() == [1, 2, 3]
+    assert not copy.batches
+
+
+def test_offloaded_result_equals_result_built_in_thread(driver, tmp_path):
+    qd = get_querydef(0, tmp_path)
+    expected = run_query(qd, save=False, offload=False).frame
+    offloaded = run_query(qd, use_cache=False, offload=True)
+    assert offloaded.nrecords == len(expected)
+    pd.testing.assert_frame_equal(offloaded.frame, expected)
@@ -0,0 +1,27 @@
+"Shared connection pool (see `query.execution.ConnectionPool`)."
+
+# local
+from query.definition import QueryDef
+from query.execution import get_pool, run_query
+from query.results import OK, FAILED
+from testing.synthetic import TABLE
+
+
+def test_connection_is_reused(driver, tmp_path):
+    pool = get_pool()
+    qd = QueryDef('goed', str(tmp_path / 'goed'), f"select * from {TABLE}")
+    assert run_query(qd, save=False).status == OK
+    conn = pool.acquire()
+    pool.release(conn)
+    assert run_query(qd, save=False).status == OK
+    assert pool.acquire() is conn
+
+
+def test_failed_connection_is_not_reused(driver, tmp_path):
+    pool = get_pool()
+    conn = pool.acquire()
+    pool.release(conn)
+
+    qd = QueryDef('fout', str(tmp_path / 'fout'), "select * from onbekend")
+    assert run_query(qd, save=False).status == FAILED
+    assert pool.acquire() is not conn
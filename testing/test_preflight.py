@@ -0,0 +1,103 @@
+"Pre-flight estimate and fetch strategies (see `query.preflight`)."
+
+# standard library
+import sqlite3
+
+# third party
+import pandas as pd
+import pytest
+
+# local
+from query import execution, preflight
+from query.cache import get_cache
+from query.definition import QueryDef
+from query.execution import get_pool, run_query
+from query.results import QueryResult
+from query.snapshots import get_snapshot_store
+from testing.benchmark import get_querydef
+from testing.synthetic import TABLE
+
+
+def count(database):
+    with sqlite3.connect(str(database)) as con:
+        nrows = con.execute(f"select count(*) from {TABLE}").fetchone()[0]
+    con.close()
+    return nrows
+
+
+def test_choose():
+    spec = {'memory_budget': 1, 'partition': 'id', 'partition_rows': 100}
+    small = {'nrows': 10, 'nbytes': 1000}
+    large = {'nrows': 1000, 'nbytes': 2**30}
+    assert preflight.choose(small, spec) == preflight.MEMORY
+    assert preflight.choose({**small, 'nrows': 100}, spec) == (
+        preflight.PARTITIONED)
+    if preflight.can_stream():
+        assert preflight.choose(large, spec) == preflight.DISK
+    assert preflight.choose(large, spec, save=False) == preflight.PARTITIONED
+
+
+def test_estimate_count(driver, tmp_path):
+    nrows = count(driver)
+    qd = get_querydef(nrows, tmp_path)
+    with get_pool().cursor() as cursor:
+        estimate = preflight.estimate_count(cursor, qd, 100)
+    frame = run_query(qd, save=False).frame
+    nbytes = frame.memory_usage(index=True, deep=True).sum()
+    assert estimate['nrows'] == nrows
+    assert 0.5 < estimate['nbytes'] / nbytes < 2
+
+
+def test_disk_strategy_streams_to_parquet(driver, tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    # several row groups, so the snapshot is read in parts
+    monkeypatch.setattr(
+        execution, 'EXECUTION', execution.EXECUTION._replace(fetch_size=300))
+    nrows = count(driver)
+    qd = get_querydef(nrows, tmp_path)
+    expected = run_query(qd, save=False).frame
+
+    streamed = qd.replace(
+        filename=str(tmp_path / 'streamed'),
+        preflight={'method': 'count', 'memory_budget': 0},
+        snapshot=True,
+        cache_ttl=60,
+    )
+    result = run_query(streamed)
+    assert result.strategy == preflight.DISK
+    assert result.path == tmp_path / 'streamed.parquet'
+    assert result.nrecords == nrows
+    assert get_cache().get(streamed) is None
+    assert len(list(result.iter_frames())) > 1
+
+    frame = QueryResult.read(path=result.path).frame
+    snapshot = get_snapshot_store().load(streamed.filename).frame
+    for col, dtype in expected.dtypes.items():
+        if str(dtype).startswith('datetime64'):
+            frame[col] = frame[col].astype(dtype)
+            snapshot[col] = snapshot[col].astype(dtype)
+    pd.testing.assert_frame_equal(
+        frame, expected, check_dtype=False, check_categorical=False)
+    pd.testing.assert_frame_equal(
+        snapshot, expected, check_dtype=False, check_categorical=False)
+
+
+@pytest.mark.parametrize('column', [
+    # negative and null values
+    "case when afloopdatum is null then null else 5000000 - studentnummer end",
+    # fractional values
+    'collegegeld',
+])
+def test_partitions_keep_all_records(driver, tmp_path, column):
+    nrows = count(driver)
+    qd = QueryDef(
+        'partities',
+        str(tmp_path / 'partities'),
+        f"select t.*, {column} as sleutel from {TABLE} t",
+        preflight={
+            'method': 'count', 'partition': 'sleutel', 'partition_rows': 0},
+    )
+    result = run_query(qd, save=False)
+    assert result.strategy == preflight.PARTITIONED
+    assert result.nrecords == nrows
+    assert result.frame['sleutel'].isna().any() == ('null' in column)
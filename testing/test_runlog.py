@@ -0,0 +1,68 @@
+"Append-only log of query executions (see `query.runlog`)."
+
+# standard library
+import datetime
+
+# third party
+import pandas as pd
+
+# local
+from query.definition import QueryDef
+from query.results import QueryResult
+from query.runlog import RunLog
+from query.tracing import Span
+
+
+def record(runlog, filename, timer, day, cached=False, spans=(), **kwargs):
+    qd = QueryDef(filename, filename, 'select 1')
+    result = QueryResult(qd, pd.DataFrame({'a': [1]}), timer)
+    result.dtime = datetime.datetime(2019, 10, day)
+    result.cached = cached
+    result.spans = list(spans)
+    for key, value in kwargs.items():
+        setattr(result, key, value)
+    runlog.record(result)
+    return result
+
+
+def test_timers_reads_window_per_query(tmp_path):
+    runlog = RunLog(tmp_path / 'runlog.sqlite')
+    for day in range(1, 6):
+        record(runlog, 'monitor/a', float(day), day)
+    record(runlog, 'monitor/b', 10.0, 1)
+
+    assert runlog.timers(window=2) == {
+        'monitor/a': [4.0, 5.0],
+        'monitor/b': [10.0],
+    }
+    assert runlog.timers(['monitor/b', 'monitor/c'], window=2) == {
+        'monitor/b': [10.0],
+    }
+
+
+def test_cache_hits_are_flagged(tmp_path):
+    runlog = RunLog(tmp_path / 'runlog.sqlite')
+    record(runlog, 'monitor/a', 5.0, 1)
+    record(runlog, 'monitor/a', 5.0, 1, cached=True)
+
+    history = runlog.history(filename='monitor/a')
+    assert history['cached'].astype(bool).tolist() == [False, True]
+    assert runlog.timers() == {'monitor/a': [5.0]}
+
+
+def test_latest_phase(tmp_path):
+    runlog = RunLog(tmp_path / 'runlog.sqlite')
+
+    def build(nrows):
+        return Span('frame_build', 0, seconds=1, nrows=nrows, nbytes=nrows)
+
+    assert runlog.latest_phase('monitor/a', 'frame_build') is None
+    record(runlog, 'monitor/a', 5.0, 1, spans=[build(10), build(20)])
+    record(runlog, 'monitor/a', 5.0, 2, spans=[build(99)], strategy='disk')
+    record(runlog, 'monitor/a', 5.0, 3, spans=[build(99)], cached=True)
+    record(runlog, 'monitor/a', 5.0, 4, spans=[Span('cache', 0, 1)])
+
+    latest = runlog.latest_phase('monitor/a', 'frame_build', exclude=['disk'])
+    assert latest == {'nrows': 30, 'nbytes': 30}
+    latest = runlog.latest_phase('monitor/a', 'frame_build')
+    assert latest['nrows'] == 99
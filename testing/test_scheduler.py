@@ -0,0 +1,90 @@
+"Dependencies between queries in a set (see `query.scheduler`)."
+
+# standard library
+import sqlite3
+
+# third party
+import pytest
+
+# local
+from query.definition import QueryDef
+from query.execution import run_query
+from query.results import OK, FAILED
+from query.scheduler import get_graph, run_scheduled, sort_graph
+from testing.synthetic import TABLE
+
+
+def run(qd, cancel):
+    return run_query(qd, save=False, cancel=cancel)
+
+
+def get_querydefs(folder, upstream_sql=None):
+    faculteiten = QueryDef(
+        'faculteiten',
+        str(folder / 'faculteiten'),
+        upstream_sql or f"select distinct faculteit from {TABLE}",
+    )
+    aantallen = QueryDef(
+        'aantallen',
+        str(folder / 'aantallen'),
+        f"select count(*) as n from {TABLE} where faculteit = '[faculteit]'",
+        parameters={'faculteit': 'str'},
+        depends={'faculteit': 'faculteiten.faculteit'},
+    )
+    studenten = QueryDef(
+        'studenten',
+        str(folder / 'studenten'),
+        f"select * from {TABLE} where faculteit in ([faculteiten])",
+        parameters={'faculteiten': 'list[str]'},
+        depends={'faculteiten': 'faculteiten.faculteit'},
+    )
+    # downstream queries first, so the order comes from the graph
+    return [qd.prime({}) for qd in [aantallen, studenten, faculteiten]]
+
+
+def test_sort_graph():
+    assert sort_graph([{2}, {0}, set()]) == [2, 0, 1]
+    with pytest.raises(ValueError):
+        sort_graph([{1}, {0}])
+
+
+def test_get_graph_unknown_query(tmp_path):
+    qds = get_querydefs(tmp_path)[:2]
+    with pytest.raises(ValueError):
+        get_graph(qds)
+
+
+def test_downstream_runs_after_upstream(driver, tmp_path):
+    qds = get_querydefs(tmp_path)
+    assert get_graph(qds) == [{2}, {2}, set()]
+
+    results = list(run_scheduled(qds, run))
+    names = [result.qd.name for result in results]
+    assert names[0] == 'faculteiten'
+    assert all(result.status == OK for result in results)
+
+    with sqlite3.connect(str(driver)) as con:
+        counts = dict(con.execute(
+            f"select faculteit, count(*) from {TABLE} group by faculteit"))
+    con.close()
+
+    # a copy per faculteit, each with its own filename
+    aantallen = [r for r in results if r.qd.name == 'aantallen']
+    assert len(aantallen) == len(counts)
+    filenames = {r.qd.filename for r in aantallen}
+    assert len(filenames) == len(counts)
+    for result in aantallen:
+        faculteit = result.qd.filename.rsplit('_', 1)[1]
+        assert result.frame['n'].iloc[0] == counts[faculteit]
+
+    # a list parameter gets all values in one query
+    studenten = [r for r in results if r.qd.name == 'studenten']
+    assert len(studenten) == 1
+    assert studenten[0].nrecords == sum(counts.values())
+
+
+def test_failed_upstream_skips_downstream(driver, tmp_path):
+    qds = get_querydefs(tmp_path, upstream_sql="select * from onbekend")
+    results = list(run_scheduled(qds, run))
+    assert len(results) == 3
+    assert all(result.status == FAILED for result in results)
@@ -0,0 +1,86 @@
+"Deduplicated snapshots of query results (see `query.snapshots`)."
+
+# standard library
+import datetime
+
+# third party
+import numpy as np
+import pandas as pd
+import pytest
+
+# local
+from query.definition import QueryDef
+from query.results import QueryResult
+from query.snapshots import SnapshotStore, split_frame, split_frames
+
+
+def get_frame(nrows=1000):
+    rng = np.random.RandomState(0)
+    return pd.DataFrame({
+        'studentnummer': np.arange(nrows),
+        'faculteit': pd.Categorical(rng.choice(['BETA', 'GW', 'SW'], nrows)),
+        'ingangsdatum': pd.Timestamp('2019-09-01')
+            + pd.to_timedelta(rng.randint(0, 365, nrows), unit='D'),
+        'collegegeld': rng.rand(nrows) * 2000,
+        'vorm': rng.choice(['VT', 'DT'], nrows),
+    })
+
+
+def save(store, frame, dtime):
+    result = QueryResult(QueryDef('snap', 'monitor/snap', 'select 1'), frame)
+    result.dtime = dtime
+    return store.save(result)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SnapshotStore(tmp_path, codec='zlib', chunk_rows=64)
+
+
+def test_round_trip(store):
+    frame = get_frame()
+    save(store, frame, datetime.datetime(2019, 10, 1, 12))
+    loaded = store.load('monitor/snap')
+    pd.testing.assert_frame_equal(loaded.frame, frame)
+    assert loaded.dtime == datetime.datetime(2019, 10, 1, 12)
+
+
+def test_unchanged_chunks_are_stored_once(store):
+    frame = get_frame()
+    first = save(store, frame, datetime.datetime(2019, 10, 1))
+    changed = frame.copy()
+    changed.loc[500, 'vorm'] = 'XX'
+    second = save(store, changed, datetime.datetime(2019, 10, 2))
+
+    assert first['new'] == len(first['chunks'])
+    assert 0 < second['new'] < len(second['chunks'])
+    pd.testing.assert_frame_equal(
+        store.load('monitor/snap', '2019-10-01').frame, frame)
+    pd.testing.assert_frame_equal(
+        store.load('monitor/snap', '2019-10-02').frame, changed)
+
+
+def test_parts_are_split_like_the_frame():
+    frame = get_frame(5000)
+    schema = {str(k): str(v) for k, v in frame.dtypes.items()}
+    expected = [digest for *_, digest in split_frame(frame, 64, schema)]
+    parts = [frame.iloc[start:start + 700] for start in range(0, 5000, 700)]
+    chunks = [
+        chunk for batch in split_frames(parts, 64, schema) for chunk in batch]
+    assert [digest for _, digest in chunks] == expected
+    assert sum(len(part) for part, _ in chunks) == len(frame)
+
+
+def test_prune(store):
+    frame = get_frame()
+    save(store, frame, datetime.datetime(2019, 10, 1))
+    save(store, frame.iloc[::-1].reset_index(drop=True),
+         datetime.datetime(2019, 10, 2))
+
+    with pytest.raises(ValueError):
+        store.prune('monitor/snap')
+    assert store.prune('monitor/snap', before='2019-10-02') > 0
+    assert len(store.snapshots('monitor/snap')) == 1
+    with pytest.raises(FileNotFoundError):
+        store.load('monitor/snap', '2019-10-01')
+    assert len(store.load('monitor/snap').frame) == len(frame)
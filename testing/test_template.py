@@ -0,0 +1,72 @@
+"Compiled parameter templates (see `query.template`)."
+
+# standard library
+import re
+
+# third party
+import pytest
+
+# local
+from query.template import compile_template
+
+
+def legacy_render(x, parameters):
+    "String replacement that rendered templates before `query.template`."
+
+    parameters = {k: str(v) for k, v in parameters.items()}
+    for key, value in parameters.items():
+        x = x.replace(f'[{key}]', str(value))
+
+        srch_str = fr'(\[({key})(-|\+)(\d+)\])'
+        for match in re.findall(re.compile(srch_str), x):
+            output = eval(value + match[2] + match[3])
+            x = x.replace(match[0], str(output))
+
+        srch_str = fr'\[{key}\((.?:.?)\)\]'
+        match = re.search(re.compile(srch_str), x)
+        if match is None:
+            continue
+        slice_ = match.group(1).split(':')
+        left = None if slice_[0] == '' else int(slice_[0])
+        right = None if slice_[1] == '' else int(slice_[1])
+        x = x.replace(f'[{key}({match.group(1)})]', value[left:right])
+    return x
+
+
+PARAMETERS = {'jaar': 2019, 'faculteit': 'BETA', 'code': '20190901'}
+
+
+@pytest.mark.parametrize('text', [
+    "where collegejaar = [jaar]",
+    "where collegejaar between [jaar-2] and [jaar+1]",
+    "inschrijvingen_[faculteit]_[jaar]",
+    "where maand = '[code(4:6)]'",
+    "where datum >= '[code(2:)]'",
+    "where faculteit = '[onbekend]' and jaar = [onbekend+1]",
+    "select [1] from t where x in ([]) and [jaar",
+])
+def test_same_output_as_legacy(text):
+    assert compile_template(text).render(PARAMETERS) == (
+        legacy_render(text, PARAMETERS))
+
+
+def test_every_slice_is_replaced():
+    # the legacy renderer only replaced the first slice of a parameter
+    text = "[code(:4)]-[code(4:6)]"
+    assert legacy_render(text, PARAMETERS) == "2019-[code(4:6)]"
+    assert compile_template(text).render(PARAMETERS) == "2019-09"
+
+
+def test_unknown_keys_are_left_untouched():
+    template = compile_template("[jaar]_[onbekend]_[onbekend(2:)]")
+    assert template.keys == {'jaar', 'onbekend'}
+    assert template.render({'jaar': 2019}) == "2019_[onbekend]_[onbekend(2:)]"
+
+
+def test_keys_are_word_characters():
+    # the legacy renderer replaced any key; only \w+ names are recognised now
+    text = "[jaar-code]_[jaar.start]"
+    parameters = {'jaar-code': 'x', 'jaar.start': 'y'}
+    assert legacy_render(text, parameters) == 'x_y'
+    assert compile_template(text).render(parameters) == text
+    assert compile_template(text).keys == set()
@@ -0,0 +1,48 @@
+"Sinks for the phases of query runs (see `query.tracing`)."
+
+# third party
+import pandas as pd
+
+# local
+from query.definition import QueryDef
+from query.results import QueryResult
+from query.tracing import PrometheusSink, Span
+
+
+def get_result(filename, phases):
+    qd = QueryDef(filename, filename, 'select 1')
+    result = QueryResult(qd, pd.DataFrame({'a': [1]}))
+    result.spans = [
+        Span(phase, idx, seconds=0.5, nrows=1) for idx, phase in
+        enumerate(phases)
+    ]
+    return result
+
+
+def read_samples(path):
+    lines = path.read_text(encoding='utf-8').splitlines()
+    return [line for line in lines if not line.startswith('#')]
+
+
+def test_prometheus_keeps_latest_run_only(tmp_path):
+    path = tmp_path / 'osiris.prom'
+    sink = PrometheusSink(path)
+    sink.emit(get_result('monitor/a', ['execute', 'fetch']))
+    sink.emit(get_result('monitor/a', ['cache']))
+    samples = read_samples(path)
+    assert samples == [
+        'osiris_query_phase_seconds{query="monitor/a",phase="cache"} 0.5',
+        'osiris_query_phase_rows{query="monitor/a",phase="cache"} 1',
+    ]
+
+
+def test_prometheus_merges_writers(tmp_path):
+    path = tmp_path / 'osiris.prom'
+    # two sinks on the same file, as in two processes
+    PrometheusSink(path).emit(get_result('monitor/a', ['execute']))
+    PrometheusSink(path).emit(get_result('monitor/b', ['execute']))
+    samples = read_samples(path)
+    assert len(samples) == 4
+    assert any('query="monitor/a"' in line for line in samples)
+    assert any('query="monitor/b"' in line for line in samples)
+    assert not list(tmp_path.glob('*.lock'))